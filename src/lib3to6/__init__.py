@@ -5,14 +5,18 @@
 # SPDX-License-Identifier: MIT
 
 from .packaging import fix
+from .packaging import build_dual_wheels
 from .transpile import transpile_module
+from .importhook import install_import_hook
 from .utils import parsedump_ast, parsedump_source
 
 __version__ = "v201809.0017-alpha"
 
 __all__ = [
     "fix",
+    "build_dual_wheels",
     "transpile_module",
+    "install_import_hook",
     "parsedump_ast",
     "parsedump_source",
 ]
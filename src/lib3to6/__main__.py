@@ -5,13 +5,92 @@
 # (C) 2018 Manuel Barkhau (@mbarkhau)
 # SPDX-License-Identifier: MIT
 
-import io
+import os
+import sys
 import click
+import itertools
 import typing as typ
 
 import difflib
-from . import packaging
+from . import common
+from . import fileio
 from . import transpile
+from . import packaging
+from . import server
+from . import watch as lib3to6_watch
+
+
+# (path, coding, source data)
+Source = typ.Tuple[str, str, bytes]
+
+# the source argument to read from stdin and write to stdout
+STDIN_SOURCE = "-"
+
+
+def _iter_sources(source_paths: typ.Iterable[fileio.SourcePath]) -> typ.Iterable[Source]:
+    # NOTE (mb 2018-09-28): Files are only read once they are
+    #   about to be transpiled, so that the whole tree is never
+    #   held in memory at once.
+    for path, _ in source_paths:
+        if path == STDIN_SOURCE:
+            source_data = sys.stdin.buffer.read()
+        else:
+            source_data = fileio.read_file(path)
+        coding, _ = transpile.parse_module_header(source_data)
+        yield path, coding, source_data
+
+
+def _iter_daemon_results(
+    cfg: common.BuildConfig, sources: typ.Iterable[Source], socket_path: str, jobs: int
+) -> typ.Iterable[packaging.DataTranspileResult]:
+    sources_a, sources_b = itertools.tee(sources)
+    source_texts = (source_data.decode(coding) for _, coding, source_data in sources_a)
+    results = server.iter_transpiled_sources(cfg, source_texts, socket_path, jobs)
+    for (_, coding, _), (fixed_source_text, error) in zip(sources_b, results):
+        if fixed_source_text is None:
+            yield None, error
+        else:
+            yield fixed_source_text.encode(coding), error
+
+
+def _write_unified_diff(path: str, coding: str, source_data: bytes, fixed_source_data: bytes) -> None:
+    source_lines = source_data.decode(coding).splitlines(keepends=True)
+    fixed_source_lines = fixed_source_data.decode(coding).splitlines(keepends=True)
+    diff_lines = difflib.unified_diff(source_lines, fixed_source_lines, path, path)
+    for line in diff_lines:
+        sys.stdout.write(line if line.endswith("\n") else line + "\n")
+
+
+def _transpile_targets(
+    cfg: common.BuildConfig,
+    source_paths: typ.Iterable[fileio.SourcePath],
+    output: str,
+    jobs: int,
+) -> typ.List[typ.Tuple[str, str]]:
+    source_paths_a, source_paths_b = itertools.tee(source_paths)
+    source_datas = (fileio.read_file(path) for path, _ in source_paths_a)
+    results = packaging.iter_transpiled_targets_data(cfg, source_datas, jobs)
+
+    errors: typ.List[typ.Tuple[str, str]] = []
+    for (path, relpath), target_results in zip(source_paths_b, results):
+        for tgt_version, (fixed_source_data, error) in target_results.items():
+            if fixed_source_data is None:
+                errors.append((path, f"{error or ''} (target version {tgt_version})"))
+                continue
+
+            output_path = os.path.join(output, tgt_version, relpath)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            fileio.write_atomic(output_path, fixed_source_data)
+    return errors
+
+
+def _echo_poll_result(result: lib3to6_watch.PollResult) -> None:
+    for path in result.written:
+        click.echo(f"transpiled {path}")
+    for path in result.removed:
+        click.echo(f"removed {path}")
+    for path, error in result.errors:
+        click.echo(f"{path}: {error}", err=True)
 
 
 @click.command()
@@ -19,13 +98,23 @@ from . import transpile
     "--target-version",
     default="2.7",
     metavar="<version>",
-    help="Target version of python.",
+    help=(
+        "Target version of python. Several comma separated versions "
+        "can be given with --output <dir>, each is written to a "
+        "subdirectory named after the version."
+    ),
 )
 @click.option(
     "--diff",
     default=False,
     is_flag=True,
-    help="Output diff instead of transpiled source.",
+    help="Output a unified diff instead of transpiled source.",
+)
+@click.option(
+    "--check",
+    default=False,
+    is_flag=True,
+    help="Only list files which would change, exit with status 1 if any would.",
 )
 @click.option(
     "--in-place",
@@ -33,6 +122,100 @@ from . import transpile
     is_flag=True,
     help="Write result back to input file.",
 )
+@click.option(
+    "--wheel",
+    default=None,
+    metavar="<in.whl>",
+    help="Transpile the modules of an existing wheel (requires --output).",
+)
+@click.option(
+    "--dual",
+    default=False,
+    is_flag=True,
+    help=(
+        "With --wheel, write a retagged native wheel and a transpiled wheel "
+        "for older versions to the --output directory (by default the "
+        "directory of the --wheel, which is then removed from it)."
+    ),
+)
+@click.option(
+    "--changed-since",
+    default=None,
+    metavar="<ref>",
+    help=(
+        "Transpile modules changed since the git <ref> into the existing "
+        "--output directory, removing outputs of deleted modules."
+    ),
+)
+@click.option(
+    "--watch",
+    default=False,
+    is_flag=True,
+    help=(
+        "Keep running and re-transpile sources to the --output directory "
+        "whenever they change."
+    ),
+)
+@click.option(
+    "--no-cache",
+    default=False,
+    is_flag=True,
+    help="Transpile every file, instead of reusing results of earlier runs from the cache.",
+)
+@click.option(
+    "--serve",
+    default=False,
+    is_flag=True,
+    help="Run a daemon which transpiles sources sent to --socket.",
+)
+@click.option(
+    "--batch",
+    default=False,
+    is_flag=True,
+    help="Answer json requests from stdin on stdout, one per line.",
+)
+@click.option(
+    "--use-daemon",
+    default=False,
+    is_flag=True,
+    help="Transpile using the daemon on --socket, if it is running.",
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    default=server.DEFAULT_SOCKET_PATH,
+    metavar="<path>",
+    help="Path of the unix domain socket of the daemon.",
+)
+@click.option(
+    "-o",
+    "--output",
+    default=None,
+    metavar="<path>",
+    help="Path of the output file or directory.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    default=1,
+    metavar="<n>",
+    help="Number of files to transpile in parallel (0 for one per cpu).",
+)
+@click.option(
+    "--include",
+    "include_globs",
+    multiple=True,
+    default=["*.py"],
+    metavar="<glob>",
+    help="Files in directories to transpile (default: *.py).",
+)
+@click.option(
+    "--exclude",
+    "exclude_globs",
+    multiple=True,
+    metavar="<glob>",
+    help="Files and directories to skip when walking directories.",
+)
 @click.option(
     "--config",
     default="lib3to6.toml",
@@ -41,33 +224,135 @@ from . import transpile
     help="Path to config file.",
 )
 @click.argument(
-    "source_files",
-    metavar="<source_file>",
+    "sources",
+    metavar="<source_file_or_dir>",
     nargs=-1,
-    type=click.File(mode="r"),
+    type=click.Path(exists=True, allow_dash=True),
 )
 def main(
     target_version: str,
     diff: bool,
+    check: bool,
     in_place: bool,
+    wheel: typ.Optional[str],
+    dual: bool,
+    changed_since: typ.Optional[str],
+    watch: bool,
+    no_cache: bool,
+    serve: bool,
+    batch: bool,
+    use_daemon: bool,
+    socket_path: str,
+    output: typ.Optional[str],
+    jobs: int,
+    include_globs: typ.Sequence[str],
+    exclude_globs: typ.Sequence[str],
     config: str,
-    source_files: typ.Iterable[io.TextIOWrapper],
+    sources: typ.Sequence[str],
 ) -> None:
     # TODO (mb 2018-07-12): evaluate build config
-    cfg = packaging.eval_build_config()
-    differ = difflib.Differ()
-    for src_file in source_files:
-        source_text = src_file.read()
-        fixed_source_text = transpile.transpile_module(cfg, source_text)
+    # unchanged files are answered from the cache of earlier runs
+    force_transpile = "1" if no_cache else "0"
+    cfg = packaging.eval_build_config(target_version=target_version, force_transpile=force_transpile)
+
+    if changed_since:
+        if output is None:
+            raise click.UsageError("Option --changed-since requires --output <dir>")
+        written_paths, removed_paths = packaging.transpile_changed_modules(
+            cfg, changed_since, output, jobs
+        )
+        for path in written_paths:
+            print(f"transpiled {path}")
+        for path in removed_paths:
+            print(f"removed {path}")
+        return
+
+    if STDIN_SOURCE in sources and (watch or "," in target_version):
+        raise click.UsageError("Source - (stdin) can't be used with --watch or several target versions")
+
+    if serve:
+        click.echo(f"serving on {socket_path}", err=True)
+        server.serve(socket_path)
+        return
+
+    if batch:
+        server.TranspileService().handle_stream(sys.stdin.buffer, sys.stdout.buffer)
+        return
+
+    if watch:
+        if output is None:
+            raise click.UsageError("Option --watch requires --output <dir>")
+        watcher = lib3to6_watch.Watcher(cfg, sources, output, include_globs, exclude_globs)
+        watcher.run(_echo_poll_result)
+        return
+
+    if "," in target_version:
+        if output is None:
+            raise click.UsageError("Several --target-version values require --output <dir>")
+        source_paths = fileio.iter_source_paths(sources, include_globs, exclude_globs)
+        target_errors = _transpile_targets(cfg, source_paths, output, jobs)
+        for src_file_name, error in target_errors:
+            click.echo(f"{src_file_name}: {error}", err=True)
+        if target_errors:
+            sys.exit(1)
+        return
+
+    if wheel and dual:
+        packaging.build_dual_wheels(cfg, wheel, output, jobs)
+        return
+
+    if wheel:
+        if output is None:
+            raise click.UsageError("Option --wheel requires --output <out.whl>")
+        packaging.transpile_wheel(cfg, wheel, output, jobs)
+        return
+
+    source_paths_a, source_paths_b = itertools.tee(
+        fileio.iter_source_paths(sources, include_globs, exclude_globs)
+    )
+    sources_a, sources_b = itertools.tee(_iter_sources(source_paths_a))
+    if use_daemon:
+        results = _iter_daemon_results(cfg, sources_a, socket_path, jobs)
+    else:
+        source_datas = (source_data for _, _, source_data in sources_a)
+        results = packaging.iter_cached_transpiled_data(cfg, source_datas, jobs)
+
+    errors: typ.List[typ.Tuple[str, str]] = []
+    changed_paths: typ.List[str] = []
+
+    for (_, relpath), (path, coding, source_data), (fixed_source_data, fix_error) in zip(
+        source_paths_b, sources_b, results
+    ):
+        if fixed_source_data is None:
+            errors.append((path, fix_error or ""))
+            continue
+
+        is_changed = fixed_source_data != source_data
+        if is_changed:
+            changed_paths.append(path)
+
         if diff:
-            source_lines = source_text.splitlines()
-            fixed_source_lines = fixed_source_text.splitlines()
-            print("\n".join(differ.compare(source_lines, fixed_source_lines)))
-        elif in_place:
-            with io.open(src_file.name, mode="w") as fh:
-                fh.write(fixed_source_text)
+            if is_changed:
+                _write_unified_diff(path, coding, source_data, fixed_source_data)
+        elif check:
+            if is_changed:
+                print(path)
+        elif (in_place or output) and path != STDIN_SOURCE:
+            output_path = path if in_place else os.path.join(output or "", relpath)
+            output_dir = os.path.dirname(output_path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            fileio.write_atomic(output_path, fixed_source_data)
         else:
-            print(fixed_source_text)
+            print(fixed_source_data.decode(coding))
+
+    if errors:
+        for src_file_name, error in errors:
+            click.echo(f"{src_file_name}: {error}", err=True)
+        sys.exit(1)
+
+    if check and changed_paths:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
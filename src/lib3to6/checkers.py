@@ -9,6 +9,7 @@ import typing as typ
 
 from . import common
 from . import utils
+from . import prefilter
 
 
 class VersionInfo:
@@ -23,6 +24,10 @@ class CheckerBase:
 
     version_info: VersionInfo
 
+    # The checker can only fail for modules which contain one of
+    # these (pseudo) tokens, None if it may fail for any module.
+    trigger_tokens: prefilter.TriggerTokens = None
+
     def is_prohibited_for(self, version: str) -> bool:
         return (
             self.version_info.prohibited_until is None or
@@ -42,6 +47,7 @@ class VisitorCheckerBase(CheckerBase, ast.NodeVisitor):
 class NoStarImports(CheckerBase):
 
     version_info = VersionInfo()
+    trigger_tokens = frozenset([prefilter.STAR_IMPORT])
 
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
         for node in ast.walk(tree):
@@ -58,6 +64,7 @@ class NoOverriddenStdlibImportsChecker(CheckerBase):
 
     version_info = VersionInfo()
     prohibited_import_overrides = {"itertools", "six", "builtins"}
+    trigger_tokens = frozenset(prohibited_import_overrides)
 
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
         for node in ast.walk(tree):
@@ -80,6 +87,7 @@ class NoOverriddenBuiltinsChecker(CheckerBase):
     """Don't override names that fixers may reference."""
 
     version_info = VersionInfo()
+    trigger_tokens = frozenset([prefilter.BUILTIN_BINDING])
 
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
         for node in ast.walk(tree):
@@ -117,6 +125,7 @@ MODULE_BACKPORTS = {
 class NoThreeOnlyImports(CheckerBase):
 
     version_info = VersionInfo(prohibited_until="2.7")
+    trigger_tokens = frozenset()
 
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
         pass
@@ -128,6 +137,7 @@ PROHIBITED_OPEN_ARGUMENTS = {"encoding", "errors", "newline", "closefd", "opener
 class NoOpenWithEncodingChecker(CheckerBase):
 
     version_info = VersionInfo(prohibited_until="2.7")
+    trigger_tokens = frozenset(["open"])
 
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
         for node in ast.walk(tree):
@@ -191,6 +201,7 @@ ASYNC_AWAIT_NODE_TYPES = (
 class NoAsyncAwait(CheckerBase):
 
     version_info = VersionInfo(prohibited_until="3.4")
+    trigger_tokens = frozenset(["async", "await"])
 
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
         for node in ast.walk(tree):
@@ -201,6 +212,7 @@ class NoAsyncAwait(CheckerBase):
 class NoComplexNamedTuple(CheckerBase):
 
     version_info = VersionInfo(prohibited_until="3.4")
+    trigger_tokens = frozenset(["NamedTuple"])
 
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module):
         _typing_module_name: typ.Optional[str] = None
@@ -0,0 +1,979 @@
+# This file is part of the lib3to6 project
+# https://github.com/mbarkhau/lib3to6
+#
+# (C) 2018 Manuel Barkhau (@mbarkhau)
+# SPDX-License-Identifier: MIT
+
+"""Generate source code from an ast.
+
+Unlike astor, which is a general purpose pretty printer, the aim
+here is to generate valid and readable code as fast as possible.
+All output is appended to a single list of strings, expressions
+are only parenthesized where their precedence requires it and
+tuples always are.
+
+With write_source, the generated code is passed on in chunks
+of whole statements, so the output for a module doesn't have to
+be held in memory at once.
+"""
+
+import ast
+import typing as typ
+
+
+# Precedence levels of expressions, higher binds tighter.
+
+_NAMED_EXPR = 0
+_TUPLE = 1
+_YIELD = 2
+_TEST = 3
+_OR = 4
+_AND = 5
+_NOT = 6
+_CMP = 7
+_BOR = 8
+_BXOR = 9
+_BAND = 10
+_SHIFT = 11
+_ARITH = 12
+_TERM = 13
+_FACTOR = 14
+_POWER = 15
+_AWAIT = 16
+_ATOM = 17
+
+
+_BINOPS: typ.Dict[type, typ.Tuple[str, int]] = {
+    ast.Add     : (" + ", _ARITH),
+    ast.Sub     : (" - ", _ARITH),
+    ast.Mult    : (" * ", _TERM),
+    ast.MatMult : (" @ ", _TERM),
+    ast.Div     : (" / ", _TERM),
+    ast.FloorDiv: (" // ", _TERM),
+    ast.Mod     : (" % ", _TERM),
+    ast.Pow     : (" ** ", _POWER),
+    ast.LShift  : (" << ", _SHIFT),
+    ast.RShift  : (" >> ", _SHIFT),
+    ast.BitOr   : (" | ", _BOR),
+    ast.BitXor  : (" ^ ", _BXOR),
+    ast.BitAnd  : (" & ", _BAND),
+}
+
+_UNARYOPS: typ.Dict[type, typ.Tuple[str, int]] = {
+    ast.Invert: ("~", _FACTOR),
+    ast.Not   : ("not ", _NOT),
+    ast.UAdd  : ("+", _FACTOR),
+    ast.USub  : ("-", _FACTOR),
+}
+
+_BOOLOPS: typ.Dict[type, typ.Tuple[str, int]] = {
+    ast.And: (" and ", _AND),
+    ast.Or : (" or ", _OR),
+}
+
+_CMPOPS: typ.Dict[type, str] = {
+    ast.Eq   : " == ",
+    ast.NotEq: " != ",
+    ast.Lt   : " < ",
+    ast.LtE  : " <= ",
+    ast.Gt   : " > ",
+    ast.GtE  : " >= ",
+    ast.Is   : " is ",
+    ast.IsNot: " is not ",
+    ast.In   : " in ",
+    ast.NotIn: " not in ",
+}
+
+_DEF_NODE_TYPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+_FSTRING_QUOTES = ("'", '"', "'''", '"""')
+
+# number of parts after which they are passed on to write
+FLUSH_PARTS = 4096
+
+Write = typ.Callable[[str], typ.Any]
+
+
+def line_breaks(stmt: ast.stmt, depth: int = 0) -> int:
+    """Line breaks between stmt and its neighbours at depth.
+
+    The line breaks between two statements are the maximum of
+    theirs, so definitions are surrounded by blank lines.
+    """
+    if isinstance(stmt, _DEF_NODE_TYPES):
+        return 3 if depth == 0 else 2
+    else:
+        return 1
+
+
+def _is_docstring(stmt: ast.stmt) -> bool:
+    if not isinstance(stmt, ast.Expr):
+        return False
+    value = stmt.value
+    if not (isinstance(value, ast.Constant) and isinstance(value.value, str)):
+        return False
+    return getattr(value, 'kind', None) is None
+
+
+def _can_triple_quote(text: str) -> bool:
+    if '"""' in text or text.endswith(('"', "\\")):
+        return False
+    return all(char.isprintable() or char in "\n\t" for char in text)
+
+
+def _escape(text: str, quote: str) -> str:
+    if text.isprintable() and quote not in text and "\\" not in text:
+        return text
+
+    chars = []
+    for char in text:
+        if char == "\\" or char == quote:
+            chars.append("\\" + char)
+        elif char.isprintable():
+            chars.append(char)
+        else:
+            chars.append(repr(char)[1:-1])
+    return "".join(chars)
+
+
+class SourceGenerator:
+    """Generates source code for ast nodes.
+
+    Statement and pattern nodes are generated by visit_<name>(node),
+    expression nodes by visit_<name>(node, prec), where prec is the
+    precedence level which the context of the expression requires.
+    """
+
+    indent_with: str
+    depth: int
+    parts: typ.List[str]
+    write: typ.Optional[Write]
+
+    def __init__(
+        self, indent_with: str = " " * 4, depth: int = 0, write: typ.Optional[Write] = None
+    ) -> None:
+        self.indent_with = indent_with
+        self.depth = depth
+        self.parts = []
+        self.write = write
+
+    def source(self) -> str:
+        return "".join(self.parts)
+
+    def flush(self) -> None:
+        """Pass the generated parts on to write."""
+        if self.write and self.parts:
+            self.write("".join(self.parts))
+            del self.parts[:]
+
+    # helpers
+
+    def _line(self, text: str) -> None:
+        self.parts.append(self.indent_with * self.depth)
+        self.parts.append(text)
+
+    def _method(self, node: ast.AST) -> typ.Any:
+        return _METHODS.get(type(node).__name__)
+
+    def _fallback(self, node: ast.AST) -> str:
+        # NOTE (mb 2018-09-30): astor is only imported for nodes of
+        #   newer versions of python which aren't supported here.
+        import astor
+
+        return astor.to_source(node, indent_with=self.indent_with).strip("\n")
+
+    def expr(self, node: ast.expr, prec: int = _TUPLE) -> None:
+        method = self._method(node)
+        if method is None:
+            self.parts.append("(")
+            self.parts.append(self._fallback(node))
+            self.parts.append(")")
+        else:
+            method(self, node, prec)
+
+    def _exprs(self, nodes: typ.Sequence[ast.expr], prec: int = _TEST) -> None:
+        parts = self.parts
+        for i, node in enumerate(nodes):
+            if i > 0:
+                parts.append(", ")
+            self.expr(node, prec)
+
+    def _sub_source(self, node: ast.expr, prec: int) -> str:
+        parts = self.parts
+        self.parts = []
+        try:
+            self.expr(node, prec)
+            return "".join(self.parts)
+        finally:
+            self.parts = parts
+
+    def stmt(self, node: ast.stmt) -> None:
+        method = self._method(node)
+        if method is None:
+            indent = self.indent_with * self.depth
+            for line in self._fallback(node).splitlines():
+                self.parts.append(indent + line + "\n" if line else "\n")
+        else:
+            method(self, node)
+
+    def stmts(self, nodes: typ.Sequence[ast.stmt]) -> None:
+        parts = self.parts
+        prev_line_breaks = 0
+        for i, node in enumerate(nodes):
+            cur_line_breaks = line_breaks(node, self.depth)
+            if i > 0:
+                extra_line_breaks = max(prev_line_breaks, cur_line_breaks) - 1
+                if extra_line_breaks:
+                    parts.append("\n" * extra_line_breaks)
+            self.stmt(node)
+            prev_line_breaks = cur_line_breaks
+            if self.write and len(parts) > FLUSH_PARTS:
+                self.flush()
+
+    def _block(self, nodes: typ.Sequence[ast.stmt]) -> None:
+        self.parts.append(":\n")
+        self.depth += 1
+        if nodes:
+            self.stmts(nodes)
+        else:
+            self._line("pass\n")
+        self.depth -= 1
+
+    def _docstring(self, node: ast.Expr) -> None:
+        text = node.value.value    # type: ignore
+        if _can_triple_quote(text):
+            self._line('"""' + text.replace("\\", "\\\\") + '"""\n')
+        else:
+            self._line(repr(text) + "\n")
+
+    def _decorators(self, node: ast.stmt) -> None:
+        for decorator in node.decorator_list:    # type: ignore
+            self._line("@")
+            self.expr(decorator, _TEST)
+            self.parts.append("\n")
+
+    def _arg(self, node: ast.arg) -> None:
+        self.parts.append(node.arg)
+        if node.annotation:
+            self.parts.append(": ")
+            self.expr(node.annotation, _TEST)
+
+    def _default(self, node: ast.arg, default: typ.Optional[ast.expr]) -> None:
+        if default is None:
+            return
+        self.parts.append(" = " if node.annotation else "=")
+        self.expr(default, _TEST)
+
+    def _arguments(self, node: ast.arguments) -> None:
+        parts = self.parts
+        sep = ""
+        posonlyargs = getattr(node, 'posonlyargs', [])
+        positional = posonlyargs + node.args
+        defaults: typ.List[typ.Optional[ast.expr]] = [None] * (
+            len(positional) - len(node.defaults)
+        )
+        defaults.extend(node.defaults)
+
+        for i, (arg, default) in enumerate(zip(positional, defaults)):
+            parts.append(sep)
+            self._arg(arg)
+            self._default(arg, default)
+            sep = ", "
+            if i + 1 == len(posonlyargs):
+                parts.append(", /")
+
+        if node.vararg:
+            parts.append(sep + "*")
+            self._arg(node.vararg)
+            sep = ", "
+        elif node.kwonlyargs:
+            parts.append(sep + "*")
+            sep = ", "
+
+        for arg, default in zip(node.kwonlyargs, node.kw_defaults):
+            parts.append(sep)
+            self._arg(arg)
+            self._default(arg, default)
+
+        if node.kwarg:
+            parts.append(sep + "**")
+            self._arg(node.kwarg)
+
+    def _call_args(self, args: typ.Sequence[ast.expr], keywords: typ.Sequence[ast.keyword]) -> None:
+        parts = self.parts
+        self._exprs(args)
+        for i, keyword in enumerate(keywords):
+            if i > 0 or args:
+                parts.append(", ")
+            if keyword.arg is None:
+                parts.append("**")
+                self.expr(keyword.value, _BOR)
+            else:
+                parts.append(keyword.arg + "=")
+                self.expr(keyword.value, _TEST)
+
+    # modules
+
+    def visit_Module(self, node: ast.Module) -> None:
+        self.stmts(node.body)
+
+    def visit_Interactive(self, node: ast.Interactive) -> None:
+        self.stmts(node.body)
+
+    def visit_Expression(self, node: ast.Expression) -> None:
+        self.expr(node.body)
+
+    # statements
+
+    def visit_FunctionDef(self, node: ast.FunctionDef, prefix: str = "def ") -> None:
+        self._decorators(node)
+        self._line(prefix + node.name + "(")
+        self._arguments(node.args)
+        self.parts.append(")")
+        if node.returns:
+            self.parts.append(" -> ")
+            self.expr(node.returns, _TEST)
+        self._block(node.body)
+
+    def visit_AsyncFunctionDef(self, node: ast.AsyncFunctionDef) -> None:
+        self.visit_FunctionDef(node, "async def ")    # type: ignore
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> None:
+        self._decorators(node)
+        self._line("class " + node.name)
+        if node.bases or node.keywords:
+            self.parts.append("(")
+            self._call_args(node.bases, node.keywords)
+            self.parts.append(")")
+        self._block(node.body)
+
+    def visit_Return(self, node: ast.Return) -> None:
+        if node.value is None:
+            self._line("return\n")
+        else:
+            self._line("return ")
+            self.expr(node.value, _TEST)
+            self.parts.append("\n")
+
+    def visit_Delete(self, node: ast.Delete) -> None:
+        self._line("del ")
+        self._exprs(node.targets)
+        self.parts.append("\n")
+
+    def visit_Assign(self, node: ast.Assign) -> None:
+        self._line("")
+        for target in node.targets:
+            self.expr(target, _TUPLE)
+            self.parts.append(" = ")
+        self.expr(node.value, _TUPLE)
+        self.parts.append("\n")
+
+    def visit_AugAssign(self, node: ast.AugAssign) -> None:
+        self._line("")
+        self.expr(node.target, _TUPLE)
+        self.parts.append(" " + _BINOPS[type(node.op)][0].strip() + "= ")
+        self.expr(node.value, _TUPLE)
+        self.parts.append("\n")
+
+    def visit_AnnAssign(self, node: ast.AnnAssign) -> None:
+        self._line("")
+        if node.simple:
+            self.expr(node.target, _TUPLE)
+        else:
+            self.parts.append("(")
+            self.expr(node.target, _TUPLE)
+            self.parts.append(")")
+        self.parts.append(": ")
+        self.expr(node.annotation, _TEST)
+        if node.value:
+            self.parts.append(" = ")
+            self.expr(node.value, _TUPLE)
+        self.parts.append("\n")
+
+    def visit_For(self, node: ast.For, prefix: str = "for ") -> None:
+        self._line(prefix)
+        self.expr(node.target, _TUPLE)
+        self.parts.append(" in ")
+        self.expr(node.iter, _TEST)
+        self._block(node.body)
+        if node.orelse:
+            self._line("else")
+            self._block(node.orelse)
+
+    def visit_AsyncFor(self, node: ast.AsyncFor) -> None:
+        self.visit_For(node, "async for ")    # type: ignore
+
+    def visit_While(self, node: ast.While) -> None:
+        self._line("while ")
+        self.expr(node.test, _TEST)
+        self._block(node.body)
+        if node.orelse:
+            self._line("else")
+            self._block(node.orelse)
+
+    def visit_If(self, node: ast.If) -> None:
+        self._line("if ")
+        self.expr(node.test, _TEST)
+        self._block(node.body)
+        orelse = node.orelse
+        while len(orelse) == 1 and isinstance(orelse[0], ast.If):
+            elif_node = orelse[0]
+            self._line("elif ")
+            self.expr(elif_node.test, _TEST)
+            self._block(elif_node.body)
+            orelse = elif_node.orelse
+        if orelse:
+            self._line("else")
+            self._block(orelse)
+
+    def visit_With(self, node: ast.With, prefix: str = "with ") -> None:
+        self._line(prefix)
+        for i, item in enumerate(node.items):
+            if i > 0:
+                self.parts.append(", ")
+            self.expr(item.context_expr, _TEST)
+            if item.optional_vars:
+                self.parts.append(" as ")
+                self.expr(item.optional_vars, _TEST)
+        self._block(node.body)
+
+    def visit_AsyncWith(self, node: ast.AsyncWith) -> None:
+        self.visit_With(node, "async with ")    # type: ignore
+
+    def visit_Raise(self, node: ast.Raise) -> None:
+        self._line("raise")
+        if node.exc:
+            self.parts.append(" ")
+            self.expr(node.exc, _TEST)
+        if node.cause:
+            self.parts.append(" from ")
+            self.expr(node.cause, _TEST)
+        self.parts.append("\n")
+
+    def visit_Try(self, node: ast.Try, handler_prefix: str = "except") -> None:
+        self._line("try")
+        self._block(node.body)
+        for handler in node.handlers:
+            self._line(handler_prefix)
+            if handler.type:
+                self.parts.append(" ")
+                self.expr(handler.type, _TEST)
+            if handler.name:
+                self.parts.append(" as " + handler.name)
+            self._block(handler.body)
+        if node.orelse:
+            self._line("else")
+            self._block(node.orelse)
+        if node.finalbody:
+            self._line("finally")
+            self._block(node.finalbody)
+
+    def visit_TryStar(self, node: ast.Try) -> None:
+        self.visit_Try(node, "except*")
+
+    def visit_Assert(self, node: ast.Assert) -> None:
+        self._line("assert ")
+        self.expr(node.test, _TEST)
+        if node.msg:
+            self.parts.append(", ")
+            self.expr(node.msg, _TEST)
+        self.parts.append("\n")
+
+    def _aliases(self, names: typ.Sequence[ast.alias]) -> str:
+        return ", ".join(
+            alias.name + " as " + alias.asname if alias.asname else alias.name
+            for alias in names
+        )
+
+    def visit_Import(self, node: ast.Import) -> None:
+        self._line("import " + self._aliases(node.names) + "\n")
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        module = "." * (node.level or 0) + (node.module or "")
+        self._line("from " + module + " import " + self._aliases(node.names) + "\n")
+
+    def visit_Global(self, node: ast.Global) -> None:
+        self._line("global " + ", ".join(node.names) + "\n")
+
+    def visit_Nonlocal(self, node: ast.Nonlocal) -> None:
+        self._line("nonlocal " + ", ".join(node.names) + "\n")
+
+    def visit_Expr(self, node: ast.Expr) -> None:
+        if _is_docstring(node):
+            self._docstring(node)
+            return
+
+        self._line("")
+        self.expr(node.value, _YIELD)
+        self.parts.append("\n")
+
+    def visit_Pass(self, node: ast.Pass) -> None:
+        self._line("pass\n")
+
+    def visit_Break(self, node: ast.Break) -> None:
+        self._line("break\n")
+
+    def visit_Continue(self, node: ast.Continue) -> None:
+        self._line("continue\n")
+
+    def visit_Match(self, node: typ.Any) -> None:
+        self._line("match ")
+        self.expr(node.subject, _TEST)
+        self.parts.append(":\n")
+        self.depth += 1
+        for case in node.cases:
+            self._line("case ")
+            self.visit(case.pattern)
+            if case.guard:
+                self.parts.append(" if ")
+                self.expr(case.guard, _TEST)
+            self._block(case.body)
+        self.depth -= 1
+
+    def visit(self, node: ast.AST) -> None:
+        """Generate a module, statement or pattern node."""
+        method = self._method(node)
+        if method is None:
+            self.parts.append(self._fallback(node))
+        else:
+            method(self, node)
+
+    # patterns
+
+    def _patterns(self, nodes: typ.Sequence[typ.Any]) -> None:
+        for i, node in enumerate(nodes):
+            if i > 0:
+                self.parts.append(", ")
+            self.visit(node)
+
+    def visit_MatchValue(self, node: typ.Any) -> None:
+        self.expr(node.value, _BOR)
+
+    def visit_MatchSingleton(self, node: typ.Any) -> None:
+        self.parts.append(repr(node.value))
+
+    def visit_MatchSequence(self, node: typ.Any) -> None:
+        self.parts.append("[")
+        self._patterns(node.patterns)
+        self.parts.append("]")
+
+    def visit_MatchMapping(self, node: typ.Any) -> None:
+        parts = self.parts
+        parts.append("{")
+        for i, (key, pattern) in enumerate(zip(node.keys, node.patterns)):
+            if i > 0:
+                parts.append(", ")
+            self.expr(key, _BOR)
+            parts.append(": ")
+            self.visit(pattern)
+        if node.rest:
+            parts.append(", **" + node.rest if node.keys else "**" + node.rest)
+        parts.append("}")
+
+    def visit_MatchClass(self, node: typ.Any) -> None:
+        parts = self.parts
+        self.expr(node.cls, _ATOM)
+        parts.append("(")
+        self._patterns(node.patterns)
+        for i, (attr, pattern) in enumerate(zip(node.kwd_attrs, node.kwd_patterns)):
+            if i > 0 or node.patterns:
+                parts.append(", ")
+            parts.append(attr + "=")
+            self.visit(pattern)
+        parts.append(")")
+
+    def visit_MatchStar(self, node: typ.Any) -> None:
+        self.parts.append("*" + (node.name or "_"))
+
+    def visit_MatchAs(self, node: typ.Any) -> None:
+        if node.pattern is None:
+            self.parts.append(node.name or "_")
+        else:
+            self.parts.append("(")
+            self.visit(node.pattern)
+            self.parts.append(" as " + node.name + ")")
+
+    def visit_MatchOr(self, node: typ.Any) -> None:
+        self.parts.append("(")
+        for i, pattern in enumerate(node.patterns):
+            if i > 0:
+                self.parts.append(" | ")
+            self.visit(pattern)
+        self.parts.append(")")
+
+    # expressions
+
+    def visit_BoolOp(self, node: ast.BoolOp, prec: int) -> None:
+        op, op_prec = _BOOLOPS[type(node.op)]
+        parts = self.parts
+        if op_prec < prec:
+            parts.append("(")
+        for i, value in enumerate(node.values):
+            if i > 0:
+                parts.append(op)
+            self.expr(value, op_prec + 1)
+        if op_prec < prec:
+            parts.append(")")
+
+    def visit_NamedExpr(self, node: typ.Any, prec: int) -> None:
+        if _NAMED_EXPR < prec:
+            self.parts.append("(")
+        self.expr(node.target, _ATOM)
+        self.parts.append(" := ")
+        self.expr(node.value, _TEST)
+        if _NAMED_EXPR < prec:
+            self.parts.append(")")
+
+    def visit_BinOp(self, node: ast.BinOp, prec: int) -> None:
+        op, op_prec = _BINOPS[type(node.op)]
+        parts = self.parts
+        if op_prec < prec:
+            parts.append("(")
+        # ** is right associative, all others are left associative
+        if op_prec == _POWER:
+            self.expr(node.left, op_prec + 1)
+            parts.append(op)
+            self.expr(node.right, op_prec)
+        else:
+            self.expr(node.left, op_prec)
+            parts.append(op)
+            self.expr(node.right, op_prec + 1)
+        if op_prec < prec:
+            parts.append(")")
+
+    def visit_UnaryOp(self, node: ast.UnaryOp, prec: int) -> None:
+        op, op_prec = _UNARYOPS[type(node.op)]
+        parts = self.parts
+        if op_prec < prec:
+            parts.append("(")
+        parts.append(op)
+        self.expr(node.operand, op_prec)
+        if op_prec < prec:
+            parts.append(")")
+
+    def visit_Lambda(self, node: ast.Lambda, prec: int) -> None:
+        parts = self.parts
+        if _TEST < prec:
+            parts.append("(")
+        args = node.args
+        arg_lists = [getattr(args, 'posonlyargs', None), args.args, args.kwonlyargs]
+        has_args = any(arg_lists) or args.vararg or args.kwarg
+        if has_args:
+            parts.append("lambda ")
+            self._arguments(args)
+            parts.append(": ")
+        else:
+            parts.append("lambda: ")
+        self.expr(node.body, _TEST)
+        if _TEST < prec:
+            parts.append(")")
+
+    def visit_IfExp(self, node: ast.IfExp, prec: int) -> None:
+        parts = self.parts
+        if _TEST < prec:
+            parts.append("(")
+        self.expr(node.body, _OR)
+        parts.append(" if ")
+        self.expr(node.test, _OR)
+        parts.append(" else ")
+        self.expr(node.orelse, _TEST)
+        if _TEST < prec:
+            parts.append(")")
+
+    def visit_Dict(self, node: ast.Dict, prec: int) -> None:
+        parts = self.parts
+        parts.append("{")
+        for i, (key, value) in enumerate(zip(node.keys, node.values)):
+            if i > 0:
+                parts.append(", ")
+            if key is None:
+                parts.append("**")
+                self.expr(value, _BOR)
+            else:
+                self.expr(key, _TEST)
+                parts.append(": ")
+                self.expr(value, _TEST)
+        parts.append("}")
+
+    def visit_Set(self, node: ast.Set, prec: int) -> None:
+        if node.elts:
+            self.parts.append("{")
+            self._exprs(node.elts)
+            self.parts.append("}")
+        else:
+            # there is no literal for an empty set
+            self.parts.append("{*()}")
+
+    def _comprehensions(self, generators: typ.Sequence[ast.comprehension]) -> None:
+        parts = self.parts
+        for comp in generators:
+            parts.append(" async for " if comp.is_async else " for ")
+            self.expr(comp.target, _TUPLE)
+            parts.append(" in ")
+            self.expr(comp.iter, _OR)
+            for if_node in comp.ifs:
+                parts.append(" if ")
+                self.expr(if_node, _OR)
+
+    def visit_ListComp(self, node: ast.ListComp, prec: int) -> None:
+        self.parts.append("[")
+        self.expr(node.elt, _TEST)
+        self._comprehensions(node.generators)
+        self.parts.append("]")
+
+    def visit_SetComp(self, node: ast.SetComp, prec: int) -> None:
+        self.parts.append("{")
+        self.expr(node.elt, _TEST)
+        self._comprehensions(node.generators)
+        self.parts.append("}")
+
+    def visit_DictComp(self, node: ast.DictComp, prec: int) -> None:
+        self.parts.append("{")
+        self.expr(node.key, _TEST)
+        self.parts.append(": ")
+        self.expr(node.value, _TEST)
+        self._comprehensions(node.generators)
+        self.parts.append("}")
+
+    def visit_GeneratorExp(self, node: ast.GeneratorExp, prec: int) -> None:
+        self.parts.append("(")
+        self.expr(node.elt, _TEST)
+        self._comprehensions(node.generators)
+        self.parts.append(")")
+
+    def visit_Await(self, node: typ.Any, prec: int) -> None:
+        if _AWAIT < prec:
+            self.parts.append("(")
+        self.parts.append("await ")
+        self.expr(node.value, _ATOM)
+        if _AWAIT < prec:
+            self.parts.append(")")
+
+    def visit_Yield(self, node: ast.Yield, prec: int) -> None:
+        parts = self.parts
+        if _YIELD < prec:
+            parts.append("(")
+        if node.value is None:
+            parts.append("yield")
+        else:
+            parts.append("yield ")
+            self.expr(node.value, _TUPLE)
+        if _YIELD < prec:
+            parts.append(")")
+
+    def visit_YieldFrom(self, node: ast.YieldFrom, prec: int) -> None:
+        parts = self.parts
+        if _YIELD < prec:
+            parts.append("(")
+        parts.append("yield from ")
+        self.expr(node.value, _TEST)
+        if _YIELD < prec:
+            parts.append(")")
+
+    def visit_Compare(self, node: ast.Compare, prec: int) -> None:
+        parts = self.parts
+        if _CMP < prec:
+            parts.append("(")
+        self.expr(node.left, _CMP + 1)
+        for op, comparator in zip(node.ops, node.comparators):
+            parts.append(_CMPOPS[type(op)])
+            self.expr(comparator, _CMP + 1)
+        if _CMP < prec:
+            parts.append(")")
+
+    def visit_Call(self, node: ast.Call, prec: int) -> None:
+        self.expr(node.func, _ATOM)
+        self.parts.append("(")
+        self._call_args(node.args, node.keywords)
+        self.parts.append(")")
+
+    def _fstring_segments(
+        self, values: typ.Sequence[ast.expr], segments: typ.List[typ.Tuple[str, bool]]
+    ) -> None:
+        # segments are (text, is_expr), only the text of expressions
+        # isn't escaped
+        for value in values:
+            if isinstance(value, ast.FormattedValue):
+                segments.append(("{", False))
+                expr_source = self._sub_source(value.value, _TEST + 1)
+                if expr_source.startswith("{"):
+                    expr_source = " " + expr_source
+                segments.append((expr_source, True))
+                if value.conversion is not None and value.conversion != -1:
+                    segments.append(("!" + chr(value.conversion), False))
+                if value.format_spec:
+                    segments.append((":", False))
+                    self._fstring_segments(value.format_spec.values, segments)    # type: ignore
+                segments.append(("}", False))
+            else:
+                text = _const_value(value)
+                segments.append((text.replace("{", "{{").replace("}", "}}"), False))
+
+    def visit_JoinedStr(self, node: ast.JoinedStr, prec: int) -> None:
+        segments: typ.List[typ.Tuple[str, bool]] = []
+        self._fstring_segments(node.values, segments)
+        expr_sources = [text for text, is_expr in segments if is_expr]
+
+        # NOTE (mb 2018-09-30): The expressions of an f-string can
+        #   contain neither backslashes nor the quotes of the string.
+        quote = None
+        if not any("\\" in expr_source for expr_source in expr_sources):
+            for candidate in _FSTRING_QUOTES:
+                if not any(candidate[0] in expr_source for expr_source in expr_sources):
+                    quote = candidate
+                    break
+
+        if quote is None:
+            self.parts.append("(")
+            self.parts.append(self._fallback(node))
+            self.parts.append(")")
+            return
+
+        parts = self.parts
+        parts.append("f" + quote)
+        for text, is_expr in segments:
+            parts.append(text if is_expr else _escape(text, quote[0]))
+        parts.append(quote)
+
+    def visit_FormattedValue(self, node: ast.FormattedValue, prec: int) -> None:
+        self.visit_JoinedStr(ast.JoinedStr(values=[node]), prec)
+
+    def visit_Constant(self, node: typ.Any, prec: int) -> None:
+        value = node.value
+        if value is Ellipsis:
+            self.parts.append("...")
+        elif isinstance(value, (str, bytes)):
+            if getattr(node, 'kind', None) == "u":
+                self.parts.append("u")
+            self.parts.append(repr(value))
+        elif isinstance(value, (int, float, complex)) and not isinstance(value, bool):
+            self._number(value, prec)
+        else:
+            self.parts.append(repr(value))
+
+    def _number(self, value: typ.Union[int, float, complex], prec: int) -> None:
+        # inf can only be written as a literal that overflows
+        text = repr(value).replace("inf", "1e309")
+        if text.startswith("-") and _FACTOR < prec:
+            self.parts.append("(" + text + ")")
+        else:
+            self.parts.append(text)
+
+    def visit_Attribute(self, node: ast.Attribute, prec: int) -> None:
+        value = node.value
+        if isinstance(_const_value(value, None), int):
+            # "1.real" would be parsed as a float
+            self.parts.append("(")
+            self.expr(value, _ATOM)
+            self.parts.append(")")
+        else:
+            self.expr(value, _ATOM)
+        self.parts.append("." + node.attr)
+
+    def visit_Subscript(self, node: ast.Subscript, prec: int) -> None:
+        parts = self.parts
+        self.expr(node.value, _ATOM)
+        parts.append("[")
+        index: ast.AST = node.slice
+        if isinstance(index, ast.Index):
+            index = index.value    # type: ignore
+        if isinstance(index, ast.Tuple) and index.elts:
+            # slices can't be parenthesized
+            self._exprs(index.elts)
+            if len(index.elts) == 1:
+                parts.append(",")
+        else:
+            # before python 3.9, slices weren't typed as expressions
+            self.expr(typ.cast(ast.expr, index), _TUPLE)
+        parts.append("]")
+
+    def visit_Starred(self, node: ast.Starred, prec: int) -> None:
+        self.parts.append("*")
+        self.expr(node.value, _BOR)
+
+    def visit_Name(self, node: ast.Name, prec: int) -> None:
+        self.parts.append(node.id)
+
+    def visit_List(self, node: ast.List, prec: int) -> None:
+        self.parts.append("[")
+        self._exprs(node.elts)
+        self.parts.append("]")
+
+    def visit_Tuple(self, node: ast.Tuple, prec: int) -> None:
+        self.parts.append("(")
+        self._exprs(node.elts)
+        self.parts.append(",)" if len(node.elts) == 1 else ")")
+
+    def visit_Slice(self, node: ast.Slice, prec: int) -> None:
+        parts = self.parts
+        if node.lower:
+            self.expr(node.lower, _TEST)
+        parts.append(":")
+        if node.upper:
+            self.expr(node.upper, _TEST)
+        if node.step:
+            parts.append(":")
+            self.expr(node.step, _TEST)
+
+    # nodes of python < 3.8/3.9
+
+    def visit_Num(self, node: typ.Any, prec: int) -> None:
+        self._number(node.n, prec)
+
+    def visit_Str(self, node: typ.Any, prec: int) -> None:
+        self.parts.append(repr(node.s))
+
+    def visit_Bytes(self, node: typ.Any, prec: int) -> None:
+        self.parts.append(repr(node.s))
+
+    def visit_NameConstant(self, node: typ.Any, prec: int) -> None:
+        self.parts.append(repr(node.value))
+
+    def visit_Ellipsis(self, node: typ.Any, prec: int) -> None:
+        self.parts.append("...")
+
+    def visit_Index(self, node: typ.Any, prec: int) -> None:
+        self.expr(node.value, prec)
+
+    def visit_ExtSlice(self, node: typ.Any, prec: int) -> None:
+        self._exprs(node.dims)
+
+
+def _const_value(node: ast.expr, default: typ.Any = "") -> typ.Any:
+    if isinstance(node, ast.Constant):
+        value = node.value
+        return default if isinstance(value, bool) else value
+    if isinstance(node, ast.Str):
+        return node.s
+    if isinstance(node, ast.Num):
+        return node.n
+    return default
+
+
+_METHODS: typ.Dict[str, typ.Any] = {
+    name[len("visit_"):]: method
+    for name, method in vars(SourceGenerator).items()
+    if name.startswith("visit_")
+}
+
+
+def to_source(node: ast.AST, indent_with: str = " " * 4, depth: int = 0) -> str:
+    """Generate the source of a module, statement or expression.
+
+    Statements are indented depth times by indent_with.
+    """
+    generator = SourceGenerator(indent_with, depth)
+    if isinstance(node, ast.stmt):
+        generator.stmt(node)
+    elif isinstance(node, ast.expr):
+        generator.expr(node)
+    else:
+        generator.visit(node)
+    return generator.source()
+
+
+def write_source(node: ast.AST, write: Write, indent_with: str = " " * 4) -> None:
+    """Generate the source of a module, passing it to write in chunks."""
+    generator = SourceGenerator(indent_with, write=write)
+    generator.visit(node)
+    generator.flush()
@@ -0,0 +1,245 @@
+# This file is part of the lib3to6 project
+# https://github.com/mbarkhau/lib3to6
+#
+# (C) 2018 Manuel Barkhau (@mbarkhau)
+# SPDX-License-Identifier: MIT
+
+import os
+import mmap
+import fnmatch
+import typing as typ
+import hashlib as hl
+import contextlib
+
+
+# NOTE (mb 2018-09-26): Files at least this large are hashed
+#   directly from a memory map instead of being read into a
+#   buffer first.
+MMAP_THRESHOLD = 1024 * 1024
+
+INITIAL_BUFFER_SIZE = 64 * 1024
+
+# Directories with these names are pruned when walking sources
+IGNORED_DIR_NAMES = {"build", "dist", "__pycache__"}
+
+# (path, size in bytes)
+FileEntry = typ.Tuple[str, int]
+
+# (path, path relative to the source argument it was found in)
+SourcePath = typ.Tuple[str, str]
+
+
+def ignore_tmp_files(src: str, names: typ.List[str]) -> typ.List[str]:
+    """The names in src which shutil.copytree should skip.
+
+    Directories are pruned by the same names as in iter_files.
+    """
+    return [
+        name
+        for name in names
+        if name.endswith(".pyc") or (name in IGNORED_DIR_NAMES and os.path.isdir(os.path.join(src, name)))
+    ]
+
+
+def _relpath(path: str, root: str) -> str:
+    return os.path.relpath(path, root).replace(os.sep, "/")
+
+
+def matches_any(relpath: str, globs: typ.Iterable[str]) -> bool:
+    """Match a (posix style) relative path against glob patterns.
+
+    A pattern matches either the whole relative path or just
+    the last component, so "*.py" matches modules at any depth.
+    """
+    basename = relpath.rsplit("/", 1)[-1]
+    return any(
+        fnmatch.fnmatchcase(relpath, glob) or fnmatch.fnmatchcase(basename, glob)
+        for glob in globs
+    )
+
+
+def _iter_file_entries(root: str, exclude_globs: typ.Sequence[str] = ()) -> typ.Iterable[os.DirEntry]:
+    dirpaths = [root]
+    while dirpaths:
+        dirpath = dirpaths.pop()
+        with os.scandir(dirpath) as entries:
+            subdirs: typ.List[str] = []
+            for entry in entries:
+                # NOTE (mb 2018-09-30): Symlinks to directories are
+                #   not followed, they could form loops.
+                if entry.is_dir(follow_symlinks=False):
+                    is_ignored_dir = entry.name in IGNORED_DIR_NAMES
+                    is_excluded_dir = matches_any(_relpath(entry.path, root), exclude_globs)
+                    if not (is_ignored_dir or is_excluded_dir):
+                        subdirs.append(entry.path)
+                elif entry.is_file():
+                    yield entry
+
+        dirpaths.extend(sorted(subdirs, reverse=True))
+
+
+def iter_files(root: str, suffix: str = ".py") -> typ.Iterable[FileEntry]:
+    """Yield all files below root which end with suffix.
+
+    Directories named in IGNORED_DIR_NAMES are pruned without
+    listing their contents. The size of each file is taken from
+    DirEntry.stat(), which needs no extra system call on windows,
+    but does one stat call per file on posix.
+    """
+    for entry in _iter_file_entries(root):
+        if entry.name.endswith(suffix):
+            yield entry.path, entry.stat().st_size
+
+
+def iter_matching_files(
+    root: str, include_globs: typ.Sequence[str] = ("*.py",), exclude_globs: typ.Sequence[str] = ()
+) -> typ.Iterable[str]:
+    """Yield paths below root which match include_globs but not exclude_globs.
+
+    Excluded directories are pruned, just like those named in
+    IGNORED_DIR_NAMES.
+    """
+    for entry in _iter_file_entries(root, exclude_globs):
+        relpath = _relpath(entry.path, root)
+        if matches_any(relpath, include_globs) and not matches_any(relpath, exclude_globs):
+            yield entry.path
+
+
+def iter_source_paths(
+    sources: typ.Sequence[str], include_globs: typ.Sequence[str], exclude_globs: typ.Sequence[str]
+) -> typ.Iterable[SourcePath]:
+    """Expand files and directories given by the user.
+
+    Files are always included, directories are walked using
+    iter_matching_files.
+    """
+    for source in sources:
+        if os.path.isdir(source):
+            for path in iter_matching_files(source, include_globs, exclude_globs):
+                yield path, os.path.relpath(path, source)
+        else:
+            yield source, os.path.basename(source)
+
+
+def user_cache_dir() -> str:
+    """The cache directory of lib3to6 for the current user.
+
+    This is $XDG_CACHE_HOME/lib3to6, or ~/.cache/lib3to6 if
+    XDG_CACHE_HOME is not set.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "lib3to6")
+
+
+def is_owned(path: str) -> bool:
+    """Check that path is owned by the current user."""
+    if not hasattr(os, "getuid"):
+        # NOTE (mb 2018-09-30): No uids on windows, where the
+        #   user directories are private anyway.
+        return True
+    return os.stat(path).st_uid == os.getuid()
+
+
+def make_private_dir(path: str) -> None:
+    """Create path (if needed), accessible only to the current user.
+
+    Files in the caches of lib3to6 are loaded without further
+    checks, so this raises an OSError if path belongs to another
+    user, rather than use a directory they could write to.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if not is_owned(path):
+        raise OSError(f"Directory not owned by the current user: {path}")
+    if hasattr(os, "getuid") and os.stat(path).st_mode & 0o077:
+        os.chmod(path, 0o700)
+
+
+def hash_data(data: typ.Union[bytes, bytearray, memoryview, mmap.mmap]) -> str:
+    return hl.blake2b(data, digest_size=20).hexdigest()
+
+
+def read_file(path: str) -> bytes:
+    with open(path, mode="rb") as fh:
+        return fh.read()
+
+
+@contextlib.contextmanager
+def open_atomic(path: str) -> typ.Iterator[typ.BinaryIO]:
+    """Open a file for writing, which replaces path once it is complete.
+
+    If writing fails, path is left as it was.
+    """
+    # NOTE (mb 2018-09-22): Concurrent builds may write the
+    #   same cache entry, readers must never see partial files.
+    dirname, basename = os.path.split(path)
+    tmp_path = os.path.join(dirname, f".{basename}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, mode="wb") as fh:
+            yield fh
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    with open_atomic(path) as fh:
+        fh.write(data)
+
+
+class FileReader:
+    """Reads and hashes files, reusing one buffer for all reads.
+
+    A FileReader is not thread safe, every thread should have
+    its own instance.
+    """
+
+    _buf: bytearray
+    mmap_threshold: int
+
+    def __init__(self, mmap_threshold: int = MMAP_THRESHOLD) -> None:
+        self._buf = bytearray(INITIAL_BUFFER_SIZE)
+        self.mmap_threshold = mmap_threshold
+
+    def _read_into_buffer(self, path: str, size_hint: int) -> memoryview:
+        if len(self._buf) < size_hint + 1:
+            self._buf = bytearray(size_hint + 1)
+
+        total = 0
+        with open(path, mode="rb", buffering=0) as fh:
+            while True:
+                if total == len(self._buf):
+                    # the file grew since we got its size
+                    self._buf.extend(bytes(len(self._buf)))
+                num_read = fh.readinto(memoryview(self._buf)[total:])
+                if not num_read:
+                    break
+                total += num_read
+
+        return memoryview(self._buf)[:total]
+
+    def read_hashed(
+        self, path: str, size_hint: int, is_data_needed: typ.Callable[[str], bool]
+    ) -> typ.Tuple[str, typ.Optional[bytes]]:
+        """Hash the contents of path.
+
+        The contents are only copied out of the buffer if
+        is_data_needed(filehash) returns True, otherwise None is
+        returned in place of the contents.
+        """
+        if size_hint >= self.mmap_threshold:
+            with open(path, mode="rb") as fh:
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    filehash = hash_data(mapped)
+                    if is_data_needed(filehash):
+                        return filehash, mapped[:]
+                    return filehash, None
+
+        data_view = self._read_into_buffer(path, size_hint)
+        try:
+            filehash = hash_data(data_view)
+            if is_data_needed(filehash):
+                return filehash, data_view.tobytes()
+            return filehash, None
+        finally:
+            data_view.release()
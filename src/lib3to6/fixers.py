@@ -10,6 +10,7 @@ import typing as typ
 
 from . import common
 from . import utils
+from . import prefilter
 
 
 ContainerNodes = (ast.List, ast.Set, ast.Tuple)
@@ -49,10 +50,22 @@ class FixerBase:
     version_info: VersionInfo
     required_imports: typ.Set[common.ImportDecl]
     module_declarations: typ.Set[str]
+    # Nodes which the fixer has modified or which replace a node
+    # of the original tree (at its location). Adding required
+    # imports or module declarations doesn't count as a change.
+    changed_nodes: typ.List[ast.AST]
+
+    # The fixer only changes modules which contain one of these
+    # (pseudo) tokens, None if it may change any module.
+    trigger_tokens: prefilter.TriggerTokens = None
 
     def __init__(self) -> None:
         self.required_imports = set()
         self.module_declarations = set()
+        self.changed_nodes = []
+
+    def mark_changed(self, node: ast.AST) -> None:
+        self.changed_nodes.append(node)
 
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> ast.Module:
         raise NotImplementedError()
@@ -78,6 +91,18 @@ class FixerBase:
 
 class TransformerFixerBase(FixerBase, ast.NodeTransformer):
 
+    def visit(self, node: ast.AST) -> typ.Any:
+        new_node = super().visit(node)
+        if isinstance(new_node, ast.AST) and new_node is not node:
+            # The replacement takes over the location of the original
+            # node, including any decorators.
+            ast.copy_location(new_node, node)
+            decorator_list = getattr(node, "decorator_list", None)
+            if decorator_list and isinstance(new_node, ast.stmt) and not hasattr(new_node, "decorator_list"):
+                new_node.lineno = min(decorator.lineno for decorator in decorator_list)
+            self.mark_changed(new_node)
+        return new_node
+
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> ast.Module:
         try:
             return self.visit(tree)
@@ -95,6 +120,10 @@ class FutureImportFixerBase(FixerBase):
 
     future_name: str
 
+    # NOTE (mb 2018-09-30): Future imports don't depend on the
+    #   module, they are added by the prefilter without parsing.
+    trigger_tokens = frozenset()
+
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> ast.Module:
         self.required_imports.add(common.ImportDecl("__future__", self.future_name))
         return tree
@@ -195,6 +224,10 @@ class ModuleImportFallbackFixerBase(TransformerFixerBase):
     new_name: str
     old_name: str
 
+    @property
+    def trigger_tokens(self) -> prefilter.TriggerTokens:    # type: ignore
+        return frozenset([self.new_name.split(".")[0]])
+
     def _try_fallback(self, node: ast.stmt, fallback_node: ast.stmt) -> ast.Try:
         return ast.Try(
             body=[node],
@@ -528,6 +561,10 @@ class BuiltinsRenameFixerBase(FixerBase):
     new_name: str
     old_name: str
 
+    @property
+    def trigger_tokens(self) -> prefilter.TriggerTokens:    # type: ignore
+        return frozenset([self.new_name])
+
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> ast.Module:
         for node in ast.walk(tree):
             if not (isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load)):
@@ -596,18 +633,25 @@ class RemoveFunctionDefAnnotationsFixer(FixerBase):
         apply_until="2.7",
     )
 
+    trigger_tokens = frozenset([prefilter.ANNOTATION])
+
     def __call__(self, cfg: common.BuildConfig, tree: ast.Module) -> ast.Module:
         for node in ast.walk(tree):
-            if isinstance(node, ast.FunctionDef):
-                node.returns = None
-                for arg in node.args.args:
-                    arg.annotation = None
-                for arg in node.args.kwonlyargs:
-                    arg.annotation = None
-                if node.args.vararg:
-                    node.args.vararg.annotation = None
-                if node.args.kwarg:
-                    node.args.kwarg.annotation = None
+            if not isinstance(node, ast.FunctionDef):
+                continue
+
+            args = node.args.args + node.args.kwonlyargs
+            if node.args.vararg:
+                args.append(node.args.vararg)
+            if node.args.kwarg:
+                args.append(node.args.kwarg)
+
+            if node.returns or any(arg.annotation for arg in args):
+                self.mark_changed(node)
+
+            node.returns = None
+            for arg in args:
+                arg.annotation = None
 
         return tree
 
@@ -619,6 +663,8 @@ class RemoveAnnAssignFixer(TransformerFixerBase):
         apply_until="3.5",
     )
 
+    trigger_tokens = frozenset([prefilter.ANNOTATION])
+
     def visit_AnnAssign(self, node: ast.AnnAssign) -> ast.Assign:
         tgt_node = node.target
         if not isinstance(tgt_node, (ast.Name, ast.Attribute)):
@@ -639,6 +685,8 @@ class ShortToLongFormSuperFixer(TransformerFixerBase):
         apply_until="2.7",
     )
 
+    trigger_tokens = frozenset(["super"])
+
     def visit_ClassDef(self, node: ast.ClassDef) -> ast.ClassDef:
         for maybe_method in ast.walk(node):
             if not isinstance(maybe_method, ast.FunctionDef):
@@ -663,6 +711,7 @@ class ShortToLongFormSuperFixer(TransformerFixerBase):
                 if len(super_call.args) > 0:
                     continue
 
+                self.mark_changed(super_call)
                 super_call.args = [
                     ast.Name(id=node.name, ctx=ast.Load()),
                     ast.Name(id=self_arg.arg, ctx=ast.Load()),
@@ -677,10 +726,13 @@ class InlineKWOnlyArgsFixer(TransformerFixerBase):
         apply_until="3.5",
     )
 
+    trigger_tokens = frozenset([prefilter.KWONLY_ARGS])
+
     def visit_FunctionDef(self, node: ast.FunctionDef) -> ast.FunctionDef:
         if not node.args.kwonlyargs:
             return node
 
+        self.mark_changed(node)
         if node.args.kwarg:
             kw_name = node.args.kwarg.arg
         else:
@@ -731,6 +783,7 @@ class InlineKWOnlyArgsFixer(TransformerFixerBase):
             node.body.insert(0, new_node)
 
         node.args.kwonlyargs = []
+        node.args.kw_defaults = []
 
         return node
 
@@ -744,6 +797,8 @@ if sys.version_info >= (3, 6):
             apply_until="3.5",
         )
 
+        trigger_tokens = frozenset([prefilter.FSTRING])
+
         def _formatted_value_str(
             self,
             fmt_val_node: ast.FormattedValue,
@@ -796,8 +851,11 @@ class NewStyleClassesFixer(TransformerFixerBase):
         apply_until="2.7",
     )
 
+    trigger_tokens = frozenset(["class"])
+
     def visit_ClassDef(self, node: ast.ClassDef) -> ast.ClassDef:
         if len(node.bases) == 0:
+            self.mark_changed(node)
             node.bases.append(ast.Name(id="object", ctx=ast.Load()))
         return node
 
@@ -810,6 +868,8 @@ class ItertoolsBuiltinsFixer(TransformerFixerBase):
         works_until="3.7",
     )
 
+    trigger_tokens = frozenset(["map", "zip", "filter"])
+
     # WARNING (mb 2018-06-09): This fix is very broad, and should
     #   only be used in combination with a sanity check that the
     #   builtin names are not being overridden.
@@ -841,6 +901,8 @@ class UnpackingGeneralizationsFixer(FixerBase):
         apply_until="3.4",
     )
 
+    trigger_tokens = frozenset(["*", "**"])
+
     def _has_stararg_g12n(self, node: ast.expr) -> bool:
         if isinstance(node, ast.Call):
             elts = node.args
@@ -882,11 +944,11 @@ class UnpackingGeneralizationsFixer(FixerBase):
             node.args = new_elts
             return node
         elif isinstance(node, ast.List):
-            return ast.List(elts=new_elts)
+            return ast.List(elts=new_elts, ctx=ast.Load())
         elif isinstance(node, ast.Set):
             return ast.Set(elts=new_elts)
         elif isinstance(node, ast.Tuple):
-            return ast.Tuple(elts=new_elts)
+            return ast.Tuple(elts=new_elts, ctx=ast.Load())
         else:
             raise TypeError(f"Unexpected node type {type(node)}")
 
@@ -929,7 +991,7 @@ class UnpackingGeneralizationsFixer(FixerBase):
         else:
             raise TypeError(f"Unexpected node: {node}")
 
-        operands: typ.List[ast.expr] = [ast.List(elts=[])]
+        operands: typ.List[ast.expr] = [ast.List(elts=[], ctx=ast.Load())]
 
         for elt in elts:
             tail_list = operands[-1]
@@ -963,7 +1025,7 @@ class UnpackingGeneralizationsFixer(FixerBase):
             else:
                 operands.append(new_val_node)
 
-            operands.append(ast.List(elts=[]))
+            operands.append(ast.List(elts=[], ctx=ast.Load()))
 
         tail_list = operands[-1]
         assert isinstance(tail_list, ast.List)
@@ -1113,8 +1175,10 @@ class UnpackingGeneralizationsFixer(FixerBase):
         new_node = node
         if isinstance(node, ArgUnpackNodes) and self._has_stararg_g12n(node):
             new_node = self.expand_stararg_g12n(new_node, parent, field_name)
+            self.mark_changed(ast.copy_location(new_node, node))
         if isinstance(node, KwArgUnpackNodes) and self._has_starstarargs_g12n(node):
             new_node = self.expand_starstararg_g12n(new_node, parent, field_name)
+            self.mark_changed(ast.copy_location(new_node, node))
         return new_node
 
     def is_stmtlist(self, nodelist: typ.Any):
@@ -1186,6 +1250,7 @@ class UnpackingGeneralizationsFixer(FixerBase):
             if is_single_dict_splat:
                 keyword_node = new_expr_node.keywords[0]
                 if is_dict_call(keyword_node.value) or isinstance(keyword_node.value, ast.Dict):
+                    self.mark_changed(ast.copy_location(keyword_node.value, node))
                     return keyword_node.value
 
         return new_expr_node
@@ -1237,6 +1302,8 @@ class NamedTupleClassToAssignFixer(TransformerFixerBase):
         apply_until="3.4",
     )
 
+    trigger_tokens = frozenset(["NamedTuple"])
+
     _typing_module_name: typ.Optional[str]
     _namedtuple_class_name: typ.Optional[str]
 
@@ -0,0 +1,142 @@
+# This file is part of the lib3to6 project
+# https://github.com/mbarkhau/lib3to6
+#
+# (C) 2018 Manuel Barkhau (@mbarkhau)
+# SPDX-License-Identifier: MIT
+
+import sys
+import types
+import marshal
+import typing as typ
+import pathlib2 as pl
+import importlib.abc
+import importlib.util
+import importlib.machinery
+
+from . import common
+from . import fileio
+from . import transpile
+from . import packaging
+
+
+class Lib3to6Loader(importlib.machinery.SourceFileLoader):
+    """Loads the transpiled code of a module.
+
+    Code objects keep the line numbers of the original source.
+    They are cached like pyc files, in a directory private to the
+    user and specific to the config. Cache entries are keyed by
+    the path of the module and the hash of its source, and they
+    are validated against that hash when they are loaded.
+    """
+
+    cfg: common.BuildConfig
+    cache_dir: pl.Path
+
+    def __init__(
+        self, fullname: str, path: str, cfg: common.BuildConfig, cache_dir: pl.Path
+    ) -> None:
+        super().__init__(fullname, path)
+        self.cfg = cfg
+        self.cache_dir = cache_dir
+
+    def _cache_path(self, module_source_data: bytes) -> pl.Path:
+        # NOTE (mb 2018-09-30): The path of the module is part of
+        #   the key, so that code objects always have the filename
+        #   they were compiled with.
+        path_data = self.path.encode("utf-8", "surrogateescape")
+        cache_key = fileio.hash_data(path_data + b"\0" + module_source_data)
+        # marshal data is specific to the interpreter version
+        return self.cache_dir / f"{cache_key}.{sys.implementation.cache_tag}.pyc"
+
+    def _load_cached(self, cache_path: pl.Path, source_hash: bytes) -> typ.Optional[types.CodeType]:
+        if not (cache_path.exists() and fileio.is_owned(str(cache_path))):
+            return None
+
+        pyc_data = cache_path.read_bytes()
+        header = importlib.util.MAGIC_NUMBER + source_hash
+        if not pyc_data.startswith(header):
+            return None
+
+        code = marshal.loads(pyc_data[len(header):])
+        if not isinstance(code, types.CodeType):
+            return None
+        return code
+
+    def get_code(self, fullname: str) -> types.CodeType:
+        module_source_data = self.get_data(self.path)
+        source_hash = fileio.hash_data(module_source_data).encode("ascii")
+        cache_path = self._cache_path(module_source_data)
+        code = self._load_cached(cache_path, source_hash)
+        if code is not None:
+            return code
+
+        code = transpile.transpile_to_code(self.cfg, module_source_data, self.path)
+        pyc_data = importlib.util.MAGIC_NUMBER + source_hash + marshal.dumps(code)
+        fileio.write_atomic(str(cache_path), pyc_data)
+        return code
+
+
+class Lib3to6Finder(importlib.abc.MetaPathFinder):
+    """Finds modules of the given packages for Lib3to6Loader."""
+
+    cfg: common.BuildConfig
+    packages: typ.Sequence[str]
+    cache_dir: pl.Path
+
+    def __init__(
+        self, cfg: common.BuildConfig, packages: typ.Sequence[str], cache_dir: pl.Path
+    ) -> None:
+        self.cfg = cfg
+        self.packages = packages
+        self.cache_dir = cache_dir
+
+    def _is_selected(self, fullname: str) -> bool:
+        return any(
+            fullname == package or fullname.startswith(package + ".")
+            for package in self.packages
+        )
+
+    def find_spec(
+        self, fullname: str, path: typ.Optional[typ.Sequence[str]], target: typ.Any = None
+    ) -> typ.Optional[importlib.machinery.ModuleSpec]:
+        if not self._is_selected(fullname):
+            return None
+
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path)
+        if spec is None or not isinstance(spec.loader, importlib.machinery.SourceFileLoader):
+            return None
+        if spec.origin is None:
+            return None
+
+        loader = Lib3to6Loader(fullname, spec.origin, self.cfg, self.cache_dir)
+        return importlib.util.spec_from_file_location(
+            fullname,
+            spec.origin,
+            loader=loader,
+            submodule_search_locations=spec.submodule_search_locations,
+        )
+
+
+def install_import_hook(
+    cfg: common.BuildConfig, packages: typ.Sequence[str], cache_dir: pl.Path = None
+) -> Lib3to6Finder:
+    """Transpile modules of packages when they are imported.
+
+    Only modules which are imported after the hook is installed
+    are transpiled. The returned finder can be passed to
+    uninstall_import_hook.
+    """
+    if cache_dir is None:
+        cache_dir = packaging.build_cache_dir(cfg)
+        packaging.init_cache_dir(cache_dir)
+    else:
+        fileio.make_private_dir(str(cache_dir))
+
+    finder = Lib3to6Finder(cfg, packages, cache_dir)
+    sys.meta_path.insert(0, finder)
+    return finder
+
+
+def uninstall_import_hook(finder: Lib3to6Finder) -> None:
+    if finder in sys.meta_path:
+        sys.meta_path.remove(finder)
@@ -0,0 +1,328 @@
+# This file is part of the lib3to6 project
+# https://github.com/mbarkhau/lib3to6
+#
+# (C) 2018 Manuel Barkhau (@mbarkhau)
+# SPDX-License-Identifier: MIT
+
+"""Statement level incremental transpilation.
+
+The fixed output of each top-level statement is cached, so when
+a module is transpiled again after a small change, only the
+statements which have actually changed go through the checkers,
+fixers and code generation. The module is still parsed as a
+whole, which is cheap in comparison.
+
+The only state which fixers carry from one statement to the next
+are imports (e.g. of typing.NamedTuple), so a statement is fixed
+together with the imports that precede it and the cache key
+includes a digest of these imports.
+
+The spliced chunks of a statement are cached with line numbers
+relative to its first line, so they remain valid if lines are
+added or removed before it.
+"""
+
+import ast
+import copy
+import hashlib
+import collections
+import typing as typ
+
+from . import common
+from . import codegen
+from . import splice
+from . import prefilter
+from . import transpile
+
+
+MAX_CACHED_STATEMENTS = 50000
+
+
+class _FixedStatement(typ.NamedTuple):
+    stmts: typ.List[ast.stmt]
+    # None if the statement can't be spliced
+    chunks: typ.Optional[typ.List[splice.Chunk]]
+    # generated on demand, only needed if splicing isn't possible
+    sources: typ.List[str]
+    required_imports: typ.Set[common.ImportDecl]
+    module_declarations: typ.Set[str]
+
+
+def _stmt_source(stmt: ast.stmt) -> str:
+    return splice.stmt_source(stmt).strip("\n")
+
+
+def _stmt_sources(fixed_stmt: _FixedStatement) -> typ.List[str]:
+    if len(fixed_stmt.sources) < len(fixed_stmt.stmts):
+        fixed_stmt.sources[:] = [_stmt_source(stmt) for stmt in fixed_stmt.stmts]
+    return fixed_stmt.sources
+
+
+def _iter_imports(stmt: ast.stmt) -> typ.Iterable[ast.stmt]:
+    for node in ast.walk(stmt):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            yield node
+
+
+class IncrementalTranspiler:
+    """Transpiles modules, reusing the output of unchanged statements.
+
+    The output is the same as that of transpile.transpile_module,
+    and as there, all checkers run before any fixer. Only if several
+    statements fail the same checker, the error may be reported for
+    a different one of them. An instance is specific to one config
+    and should be reused for every (version of a) module that is
+    transpiled with it.
+    """
+
+    cfg: common.BuildConfig
+
+    _fixed_stmts: typ.MutableMapping[str, _FixedStatement]
+    # stmt key -> number of import nodes in the statement
+    _import_counts: typ.MutableMapping[str, int]
+
+    def __init__(self, cfg: common.BuildConfig) -> None:
+        self.cfg = cfg
+        self._fixed_stmts = collections.OrderedDict()
+        self._import_counts = collections.OrderedDict()
+
+    def _stmt_key(
+        self,
+        module_source: str,
+        offsets: typ.List[int],
+        stmt: ast.stmt,
+        next_stmt: typ.Optional[ast.stmt],
+    ) -> str:
+        # NOTE (mb 2018-09-30): End positions are only available since
+        #   python 3.8, so the key covers the lines up to and including
+        #   the one where the next statement starts (in case they are
+        #   separated by ";").
+        first_lineno = splice.first_lineno(stmt)
+        if next_stmt is None:
+            stmt_lines = module_source[offsets[first_lineno - 1]:]
+            position = f"{stmt.col_offset}::"
+        else:
+            next_lineno = splice.first_lineno(next_stmt)
+            stmt_lines = module_source[offsets[first_lineno - 1]:offsets[next_lineno]]
+            position = f"{stmt.col_offset}:{next_stmt.col_offset}:"
+        return hashlib.sha1((position + stmt_lines).encode("utf-8")).hexdigest()
+
+    def _import_count(self, stmt_key: str, stmt: ast.stmt) -> int:
+        import_count = self._import_counts.get(stmt_key)
+        if import_count is None:
+            import_count = sum(1 for _ in _iter_imports(stmt))
+            self._import_counts[stmt_key] = import_count
+            while len(self._import_counts) > MAX_CACHED_STATEMENTS:
+                self._import_counts.popitem(last=False)    # type: ignore
+        return import_count
+
+    def _fix_stmt(
+        self,
+        module_source: str,
+        offsets: typ.List[int],
+        stmt: ast.stmt,
+        context_imports: typ.List[ast.stmt],
+    ) -> _FixedStatement:
+        _, selected_fixers = transpile.select_checkers_and_fixers(self.cfg)
+
+        # NOTE (mb 2018-09-30): Fixers replace each import with exactly
+        #   one statement, so whatever comes after them was produced
+        #   from stmt.
+        prefix = [copy.deepcopy(import_node) for import_node in context_imports]
+        module_tree = ast.Module(body=prefix + [stmt], type_ignores=[])
+        # the statement was checked by _check_stmts
+        fixed_tree, required_imports, module_declarations = transpile.apply_checkers_and_fixers(
+            self.cfg, module_tree, [], selected_fixers
+        )
+        fixed_stmts = fixed_tree.body[len(prefix):]
+
+        changed_nodes = [node for fixer in selected_fixers for node in fixer.changed_nodes]
+        chunks: typ.Optional[typ.List[splice.Chunk]]
+        try:
+            splicer = splice.Splicer(module_source, changed_nodes, offsets)
+            line_delta = 1 - splice.first_lineno(stmt)
+            chunks = [
+                splice.shift_chunk(chunk, line_delta)
+                for chunk in splicer.module_chunks([stmt], fixed_stmts)
+            ]
+        except splice.SpliceError:
+            chunks = None
+
+        return _FixedStatement(fixed_stmts, chunks, [], required_imports, module_declarations)
+
+    def _context_imports(
+        self, prev_stmts: typ.Sequence[ast.stmt], prev_keys: typ.Sequence[str]
+    ) -> typ.List[ast.stmt]:
+        return [
+            import_node
+            for prev_stmt, prev_key in zip(prev_stmts, prev_keys)
+            if self._import_count(prev_key, prev_stmt)
+            for import_node in _iter_imports(prev_stmt)
+        ]
+
+    def _cache_keys(self, stmts: typ.Sequence[ast.stmt], stmt_keys: typ.Sequence[str]) -> typ.List[str]:
+        cache_keys: typ.List[str] = []
+        context_hash = hashlib.sha1()
+        for stmt, stmt_key in zip(stmts, stmt_keys):
+            cache_keys.append(stmt_key + context_hash.hexdigest())
+            if self._import_count(stmt_key, stmt):
+                context_hash.update(stmt_key.encode("ascii"))
+        return cache_keys
+
+    def _check_stmts(
+        self, stmts: typ.Sequence[ast.stmt], stmt_keys: typ.Sequence[str], cache_keys: typ.Sequence[str]
+    ) -> None:
+        selected_checkers, _ = transpile.select_checkers_and_fixers(self.cfg)
+
+        # checker index -> error of the first statement which fails it
+        errors: typ.Dict[int, Exception] = {}
+        for i, (stmt, cache_key) in enumerate(zip(stmts, cache_keys)):
+            if cache_key in self._fixed_stmts:
+                # cached statements were checked before they were fixed
+                continue
+
+            context_imports = self._context_imports(stmts[:i], stmt_keys[:i])
+            module_tree = ast.Module(body=context_imports + [stmt], type_ignores=[])
+            for checker_index, checker in enumerate(selected_checkers):
+                if checker_index in errors:
+                    continue
+                try:
+                    checker(self.cfg, module_tree)
+                except Exception as ex:
+                    errors[checker_index] = ex
+
+        if errors:
+            raise errors[min(errors)]
+
+    def _iter_fixed_stmts(
+        self, module_source: str, offsets: typ.List[int], module_tree: ast.Module
+    ) -> typ.Iterable[_FixedStatement]:
+        stmts = module_tree.body
+        next_stmts: typ.List[typ.Optional[ast.stmt]] = list(stmts[1:])
+        next_stmts.append(None)
+        stmt_keys = [
+            self._stmt_key(module_source, offsets, stmt, next_stmt)
+            for stmt, next_stmt in zip(stmts, next_stmts)
+        ]
+        cache_keys = self._cache_keys(stmts, stmt_keys)
+        self._check_stmts(stmts, stmt_keys, cache_keys)
+
+        for i, (stmt, cache_key) in enumerate(zip(stmts, cache_keys)):
+            fixed_stmt = self._fixed_stmts.get(cache_key)
+            if fixed_stmt is None:
+                context_imports = self._context_imports(stmts[:i], stmt_keys[:i])
+                fixed_stmt = self._fix_stmt(module_source, offsets, stmt, context_imports)
+                self._fixed_stmts[cache_key] = fixed_stmt
+                while len(self._fixed_stmts) > MAX_CACHED_STATEMENTS:
+                    self._fixed_stmts.popitem(last=False)    # type: ignore
+            else:
+                self._fixed_stmts.move_to_end(cache_key)    # type: ignore
+
+            yield fixed_stmt
+
+    def transpile_module(
+        self, module_source: str, module_header: transpile.ModuleHeader = None
+    ) -> str:
+        if module_header is None:
+            module_header = transpile.read_module_header(module_source)
+
+        selected_checkers, selected_fixers = transpile.select_checkers_and_fixers(self.cfg)
+        scan = prefilter.scan_module(module_source)
+        prefiltered_source = transpile.transpile_prefiltered(
+            module_source, scan, selected_checkers, selected_fixers, module_header
+        )
+        if prefiltered_source is not None:
+            return prefiltered_source
+
+        module_tree = transpile.parse_module(module_source)
+        offsets = splice.line_offsets(module_source)
+        fixed_tree = ast.Module(body=[], type_ignores=[])
+        fixed_stmts: typ.List[_FixedStatement] = []
+        required_imports: typ.Set[common.ImportDecl] = set()
+        module_declarations: typ.Set[str] = set()
+
+        for fixed_stmt in self._iter_fixed_stmts(module_source, offsets, module_tree):
+            fixed_stmts.append(fixed_stmt)
+            fixed_tree.body.extend(fixed_stmt.stmts)
+            required_imports.update(fixed_stmt.required_imports)
+            module_declarations.update(fixed_stmt.module_declarations)
+
+        if any(required_imports):
+            transpile.add_required_imports(fixed_tree, required_imports)
+        if any(module_declarations):
+            transpile.add_module_declarations(fixed_tree, module_declarations)
+
+        header = module_header.header
+
+        if prefilter.can_copy_source(scan):
+            spliced_source = self._splice_module(
+                module_source, offsets, header, module_tree, fixed_tree, fixed_stmts
+            )
+            if spliced_source is not None:
+                return spliced_source
+
+        return header + self._join_sources(fixed_tree, fixed_stmts)
+
+    def _splice_module(
+        self,
+        module_source: str,
+        offsets: typ.List[int],
+        header: str,
+        module_tree: ast.Module,
+        fixed_tree: ast.Module,
+        fixed_stmts: typ.List[_FixedStatement],
+    ) -> typ.Optional[str]:
+        # chunks of the cached statements, in order and at their
+        # current line numbers
+        stmt_chunks: typ.List[typ.Tuple[ast.stmt, splice.Chunk]] = []
+        for stmt, fixed_stmt in zip(module_tree.body, fixed_stmts):
+            if fixed_stmt.chunks is None:
+                return None
+            line_delta = splice.first_lineno(stmt) - 1
+            for fixed_body_stmt, chunk in zip(fixed_stmt.stmts, fixed_stmt.chunks):
+                stmt_chunks.append((fixed_body_stmt, splice.shift_chunk(chunk, line_delta)))
+
+        # NOTE (mb 2018-09-30): The same cached statement may occur
+        #   more than once (e.g. two "pass" statements), so the chunks
+        #   are matched by position rather than by the id of the stmt.
+        chunks: typ.List[splice.Chunk] = []
+        index = 0
+        for stmt in fixed_tree.body:
+            if index < len(stmt_chunks) and stmt is stmt_chunks[index][0]:
+                chunks.append(stmt_chunks[index][1])
+                index += 1
+            else:
+                # added imports and declarations
+                chunks.append(splice.Chunk(None, splice.stmt_source(stmt)))
+
+        try:
+            splicer = splice.Splicer(module_source, [], offsets)
+            return splicer.join_module_chunks(header, chunks)
+        except splice.SpliceError:
+            return None
+
+    def _join_sources(self, fixed_tree: ast.Module, fixed_stmts: typ.List[_FixedStatement]) -> str:
+        stmt_sources: typ.Dict[int, str] = {}
+        for fixed_stmt in fixed_stmts:
+            for stmt, stmt_source in zip(fixed_stmt.stmts, _stmt_sources(fixed_stmt)):
+                stmt_sources[id(stmt)] = stmt_source
+
+        chunks: typ.List[str] = []
+        prev_line_breaks = 0
+        for stmt in fixed_tree.body:
+            fixed_source = stmt_sources.get(id(stmt))
+            if fixed_source is None:
+                fixed_source = _stmt_source(stmt)
+            if chunks:
+                chunks.append("\n" * max(prev_line_breaks, codegen.line_breaks(stmt)))
+            chunks.append(fixed_source)
+            prev_line_breaks = codegen.line_breaks(stmt)
+        if chunks:
+            chunks.append("\n")
+
+        return "".join(chunks)
+
+    def transpile_module_data(self, module_source_data: bytes) -> bytes:
+        module_source, module_header = transpile.decode_module(module_source_data)
+        fixed_module_source = self.transpile_module(module_source, module_header)
+        return fixed_module_source.encode(module_header.coding)
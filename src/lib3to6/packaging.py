@@ -6,14 +6,25 @@
 
 import os
 import sys
+import time
+import json
+import base64
 import shutil
-import tempfile
+import queue
+import zipfile
+import threading
+import py_compile
+import collections
+import subprocess as sp
 import typing as typ
 import hashlib as hl
 import pathlib2 as pl
+import importlib.util
+import concurrent.futures as cf
 
 from . import transpile
 from . import common
+from . import fileio
 
 
 ENV_PATH = str(pl.Path(sys.executable).parent.parent)
@@ -28,10 +39,10 @@ PYTHON_TAG_PREFIXES = {
 }
 
 
-CACHE_DIR = pl.Path(tempfile.gettempdir()) / ".lib3to6_cache"
+CACHE_DIR = pl.Path(fileio.user_cache_dir())
 
 
-def eval_build_config() -> common.BuildConfig:
+def eval_build_config(**kwargs: str) -> common.BuildConfig:
     # TODO (mb 2018-06-07): Get options from setup.cfg
     # python_tags = "py2.py3"
     # for argi, arg in enumerate(sys.argv):
@@ -41,26 +52,86 @@ def eval_build_config() -> common.BuildConfig:
     #         else:
     #             python_tags = sys.argv[argi + 1]
 
-    return {
+    cfg: common.BuildConfig = {
         "target_version"  : "2.7",
         "force_transpile" : "1",
         "fixers"          : "",
         "checkers"        : "",
+        "precompile"      : "0",
+    }
+    cfg.update(kwargs)
+    return cfg
+
+
+def config_fingerprint(cfg: common.BuildConfig) -> str:
+    """Digest of the effective config of a build.
+
+    Builds with the same fingerprint produce the same output
+    for the same input, independent of how the fixers and
+    checkers were selected. Options which don't change the
+    output (output_dir, precompile, ...) are ignored.
+    The version of lib3to6 is included, since the output of the
+    fixers may change with it.
+    """
+    # NOTE (mb 2018-09-30): Imported here, since the package
+    #   imports this module before __version__ is defined.
+    from . import __version__
+
+    ver = sys.version_info
+    src_version = f"{ver.major}.{ver.minor}"
+    tgt_version = cfg.get("target_version", transpile.DEFAULT_TARGET_VERSION)
+
+    fixer_names = sorted(
+        type(fixer).__name__
+        for fixer in transpile.iter_fuzzy_selected_fixers(cfg.get("fixers", ""))
+        if fixer.is_applicable_to(src_version, tgt_version)
+    )
+    checker_names = sorted(
+        type(checker).__name__
+        for checker in transpile.iter_fuzzy_selected_checkers(cfg.get("checkers", ""))
+        if checker.is_prohibited_for(tgt_version)
+    )
+    effective_cfg = {
+        "lib3to6"       : __version__,
+        "src_version"   : src_version,
+        "target_version": tgt_version,
+        "fixers"        : ",".join(fixer_names),
+        "checkers"      : ",".join(checker_names),
     }
+    cfg_data = json.dumps(effective_cfg, sort_keys=True).encode("utf-8")
+    return fileio.hash_data(cfg_data)
+
+
+def build_output_dir(cfg: common.BuildConfig) -> pl.Path:
+    """Directory for the output of a build with this cfg.
+
+    Unless "output_dir" is set explicitly, every effective
+    config gets its own subdirectory of build/lib3to6_out, so
+    that builds for different targets can run concurrently.
+    """
+    if cfg.get("output_dir"):
+        return pl.Path(cfg["output_dir"])
+
+    tgt_version = cfg.get("target_version", transpile.DEFAULT_TARGET_VERSION)
+    tgt_tag = "py" + tgt_version.replace(".", "")
+    return pl.Path("build") / "lib3to6_out" / (tgt_tag + "_" + config_fingerprint(cfg)[:8])
 
 
-def _ingore_tmp_files(src: str, names: typ.List[str]) -> typ.List[str]:
-    if src.endswith("build"):
-        return names
-    if src.endswith("dist"):
-        return names
-    if src.endswith("__pycache__"):
-        return names
-    return [name for name in names if name.endswith(".pyc")]
+def build_cache_dir(cfg: common.BuildConfig) -> pl.Path:
+    return CACHE_DIR / config_fingerprint(cfg)
 
 
-def init_build_package_dir(local_package_dir: common.PackageDir) -> common.PackageDir:
-    output_dir = pl.Path("build") / "lib3to6_out"
+def init_cache_dir(cache_dir: pl.Path) -> None:
+    """Create cache_dir below CACHE_DIR, both private to the current user."""
+    fileio.make_private_dir(str(CACHE_DIR))
+    fileio.make_private_dir(str(cache_dir))
+
+
+def init_build_package_dir(
+    local_package_dir: common.PackageDir, output_dir: pl.Path = None
+) -> common.PackageDir:
+    if output_dir is None:
+        output_dir = pl.Path("build") / "lib3to6_out"
     try:
         output_dir.mkdir(parents=True)
     except Exception:
@@ -87,7 +158,7 @@ def init_build_package_dir(local_package_dir: common.PackageDir) -> common.Packa
         shutil.copytree(
             src_package_dir,
             str(build_package_subdir),
-            ignore=_ingore_tmp_files,
+            ignore=fileio.ignore_tmp_files,
         )
 
         build_package_dir[package] = str(build_package_subdir)
@@ -95,39 +166,748 @@ def init_build_package_dir(local_package_dir: common.PackageDir) -> common.Packa
     return build_package_dir
 
 
-def build_package(cfg: common.BuildConfig, package: str, build_dir: str) -> None:
-    for root, dirs, files in os.walk(build_dir):
-        for filename in files:
-            filepath = pl.Path(root) / filename
-            if filepath.suffix != ".py":
-                continue
+# Maps paths of transpiled modules to the hash of their source
+ModuleHashes = typ.Dict[str, str]
+
+
+# NOTE (mb 2018-09-24): Upper bound for the number of modules
+#   held in memory between two stages of the build pipeline.
+PIPELINE_BUFFER_SIZE = 16
+
+T = typ.TypeVar("T")
+
+_STAGE_DONE = object()
+
+
+def _iter_threaded(items: typ.Iterable[T], maxsize: int = PIPELINE_BUFFER_SIZE) -> typ.Iterable[T]:
+    """Consume items on a background thread.
+
+    Items are passed on through a bounded queue, so the
+    producer runs at most maxsize items ahead of the consumer.
+    Exceptions of the producer are raised in the consumer.
+    """
+    buf: queue.Queue = queue.Queue(maxsize)
+    errors: typ.List[Exception] = []
+    stopped = threading.Event()
+
+    def produce() -> None:
+        try:
+            for item in items:
+                if stopped.is_set():
+                    break
+                buf.put(item)
+        except Exception as ex:
+            errors.append(ex)
+        finally:
+            buf.put(_STAGE_DONE)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buf.get()
+            if item is _STAGE_DONE:
+                break
+            yield item
+    finally:
+        # unblock the producer in case we stopped early
+        stopped.set()
+        while thread.is_alive():
+            try:
+                buf.get(timeout=0.01)
+            except queue.Empty:
+                pass
+
+    if errors:
+        raise errors[0]
+
 
-            with open(filepath, mode="rb") as fh:
-                module_source_data = fh.read()
+# (path, source hash, source data), data is None if the cache is
+# up to date
+ReadModule = typ.Tuple[pl.Path, str, typ.Optional[bytes]]
 
-            filehash = hl.sha1(module_source_data).hexdigest()
-            cache_path = CACHE_DIR / (filehash + ".py")
+# (path, source hash, transpile duration), the fixed module is
+# written to the cache, duration is None if it was up to date
+FixedModule = typ.Tuple[pl.Path, str, typ.Optional[float]]
 
-            if int(cfg["force_transpile"]) or not cache_path.exists():
-                fixed_module_source_data = transpile.transpile_module_data(cfg, module_source_data)
-                with open(cache_path, mode="wb") as fh:
-                    fh.write(fixed_module_source_data)
+# Maps module paths to their last measured transpile duration
+Durations = typ.Dict[str, float]
 
-            shutil.copy(cache_path, filepath)
 
+def read_build_manifest(manifest_path: pl.Path) -> typ.Dict[str, typ.Any]:
+    try:
+        with open(manifest_path, mode="rb") as fh:
+            manifest = json.loads(fh.read().decode("utf-8"))
+        if isinstance(manifest, dict) and isinstance(manifest.get("modules"), dict):
+            return manifest
+    except (IOError, ValueError):
+        # a missing or broken manifest only means we have no history
+        pass
+    return {"modules": {}}
+
+
+def write_build_manifest(manifest_path: pl.Path, manifest: typ.Dict[str, typ.Any]) -> None:
+    manifest_data = json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8")
+    fileio.write_atomic(str(manifest_path), manifest_data)
+
+
+def build_manifest_path(cfg: common.BuildConfig) -> pl.Path:
+    output_dir = build_output_dir(cfg)
+    return output_dir.parent / (output_dir.name + ".manifest.json")
+
+
+def _schedule_module_files(
+    module_files: typ.Iterable[fileio.FileEntry], durations: Durations
+) -> typ.List[fileio.FileEntry]:
+    """Order modules by their expected transpile duration, longest first.
+
+    Starting with the most expensive modules (longest processing
+    time first) avoids a single large module holding up the end
+    of a parallel build. Modules without a measured duration are
+    estimated by their size, using the average duration per byte
+    of the modules that do have one.
+    """
+    module_files = list(module_files)
+
+    known_size = sum(size for filepath, size in module_files if filepath in durations)
+    known_duration = sum(durations[filepath] for filepath, _ in module_files if filepath in durations)
+    duration_per_byte = known_duration / known_size if known_size and known_duration else 1.0
+
+    def expected_duration(module_file: fileio.FileEntry) -> float:
+        filepath, size = module_file
+        if filepath in durations:
+            return durations[filepath]
+        return size * duration_per_byte
+
+    return sorted(module_files, key=expected_duration, reverse=True)
+
+
+def _iter_read_modules(
+    cfg: common.BuildConfig, module_files: typ.Iterable[fileio.FileEntry]
+) -> typ.Iterable[ReadModule]:
+    cache_dir = build_cache_dir(cfg)
+    force_transpile = int(cfg["force_transpile"])
+
+    def is_data_needed(filehash: str) -> bool:
+        return bool(force_transpile) or not (cache_dir / (filehash + ".py")).exists()
+
+    reader = fileio.FileReader()
+    for filepath, size in module_files:
+        filehash, module_source_data = reader.read_hashed(filepath, size, is_data_needed)
+        yield pl.Path(filepath), filehash, module_source_data
+
+
+def _timed_transpile(cfg: common.BuildConfig, module_source_data: bytes, cache_path: str) -> float:
+    # NOTE (mb 2018-09-22): The fixed module is written to the
+    #   cache as it is generated, rather than being passed back
+    #   from the worker process.
+    tzero = time.time()
+    with fileio.open_atomic(cache_path) as fh:
+        transpile.transpile_to_file(cfg, module_source_data, fh)
+    return time.time() - tzero
+
+
+def _iter_fixed_modules(
+    cfg: common.BuildConfig, read_modules: typ.Iterable[ReadModule], jobs: int = 0
+) -> typ.Iterable[FixedModule]:
+    cache_dir = build_cache_dir(cfg)
+    if jobs == 1:
+        for filepath, filehash, module_source_data in read_modules:
+            if module_source_data is None:
+                yield filepath, filehash, None
+            else:
+                cache_path = str(cache_dir / (filehash + ".py"))
+                duration = _timed_transpile(cfg, module_source_data, cache_path)
+                yield filepath, filehash, duration
+        return
+
+    max_workers = jobs or os.cpu_count() or 1
+    with cf.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # NOTE (mb 2018-09-30): Workers are started by the first
+        #   submit. This happens before read_modules starts its
+        #   thread, so workers are never forked from a process
+        #   with other threads running.
+        executor.submit(os.getpid).result()
+
+        pending: typ.Dict[cf.Future, typ.Tuple[pl.Path, str]] = {}
+
+        def iter_done(return_when: str) -> typ.Iterable[FixedModule]:
+            done, _ = cf.wait(pending, return_when=return_when)
+            for future in done:
+                filepath, filehash = pending.pop(future)
+                yield filepath, filehash, future.result()
+
+        for filepath, filehash, module_source_data in read_modules:
+            if module_source_data is None:
+                yield filepath, filehash, None
+                continue
 
-def build_packages(cfg: common.BuildConfig, build_package_dir: common.PackageDir) -> None:
-    CACHE_DIR.mkdir(exist_ok=True)
+            cache_path = str(cache_dir / (filehash + ".py"))
+            future = executor.submit(_timed_transpile, cfg, module_source_data, cache_path)
+            pending[future] = (filepath, filehash)
+            if len(pending) > max_workers * 2:
+                for fixed_module in iter_done(cf.FIRST_COMPLETED):
+                    yield fixed_module
+
+        for fixed_module in iter_done(cf.ALL_COMPLETED):
+            yield fixed_module
+
+
+def build_package(
+    cfg: common.BuildConfig,
+    package: str,
+    build_dir: str,
+    jobs: int = 0,
+    durations: Durations = None,
+) -> ModuleHashes:
+    """Transpile all modules in build_dir (in place).
+
+    The build is a pipeline of stages: discovery, read, hash
+    and cache lookup, transpile, write. Reading is done
+    on a background thread, transpiling on worker processes
+    (unless jobs == 1) and writing on the calling thread. The
+    stages are connected by bounded queues, so memory usage is
+    independent of the size of the package.
+
+    Modules are scheduled according to the durations of
+    previous builds, which are updated with new measurements.
+    """
+    if durations is None:
+        durations = {}
+
+    cache_dir = build_cache_dir(cfg)
+    module_hashes: ModuleHashes = {}
+
+    module_files = _schedule_module_files(fileio.iter_files(build_dir), durations)
+    read_modules = _iter_threaded(_iter_read_modules(cfg, module_files))
+    # the process pool is created on this thread
+    fixed_modules = _iter_fixed_modules(cfg, read_modules, jobs)
+
+    for filepath, filehash, duration in fixed_modules:
+        cache_path = cache_dir / (filehash + ".py")
+        if duration is not None:
+            durations[str(filepath)] = duration
+
+        shutil.copy(cache_path, filepath)
+        module_hashes[str(filepath)] = filehash
+
+    return module_hashes
+
+
+def build_packages(
+    cfg: common.BuildConfig,
+    build_package_dir: common.PackageDir,
+    jobs: int = 0,
+    manifest_path: pl.Path = None,
+) -> ModuleHashes:
+    """Transpile all packages, optionally recording the build in a manifest.
+
+    The manifest is a json file with the source hash and last
+    transpile duration of every module, which is used to
+    schedule the next build.
+    """
+    init_cache_dir(build_cache_dir(cfg))
+
+    manifest: typ.Dict[str, typ.Any] = {"modules": {}}
+    if manifest_path:
+        manifest = read_build_manifest(manifest_path)
+
+    durations: Durations = {
+        module_path: module_info["duration"]
+        for module_path, module_info in manifest["modules"].items()
+        if isinstance(module_info, dict) and "duration" in module_info
+    }
 
+    module_hashes: ModuleHashes = {}
     for package, build_dir in build_package_dir.items():
-        build_package(cfg, package, build_dir)
+        module_hashes.update(build_package(cfg, package, build_dir, jobs, durations))
+
+    if manifest_path:
+        manifest["modules"] = {}
+        for module_path, filehash in sorted(module_hashes.items()):
+            module_info: typ.Dict[str, typ.Any] = {"hash": filehash}
+            if module_path in durations:
+                module_info["duration"] = durations[module_path]
+            manifest["modules"][module_path] = module_info
+
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        write_build_manifest(manifest_path, manifest)
+
+    return module_hashes
+
+
+# NOTE (mb 2018-09-20): Hash based pycs (PEP 552) are valid
+#   independent of the mtime of the source file, which is what
+#   allows us to cache them. With older versions, the bytecode
+#   is compiled every time.
+HAS_HASH_BASED_PYC = sys.version_info >= (3, 7)
+
+
+def _pyc_cache_path(cache_dir: pl.Path, filehash: str) -> pl.Path:
+    cache_tag = sys.implementation.cache_tag
+    return cache_dir / (filehash + "." + cache_tag + ".pyc")
 
 
-def fix(package_dir: common.PackageDir=None) -> common.PackageDir:
+def _compile_module(module_path: str, pyc_path: str) -> str:
+    tmp_pyc_path = pyc_path + f".{os.getpid()}.tmp"
+    if HAS_HASH_BASED_PYC:
+        py_compile.compile(
+            module_path,
+            cfile=tmp_pyc_path,
+            doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH,
+        )
+    else:
+        py_compile.compile(module_path, cfile=tmp_pyc_path, doraise=True)
+    os.replace(tmp_pyc_path, pyc_path)
+    return pyc_path
+
+
+def precompile_modules(
+    cfg: common.BuildConfig, module_hashes: ModuleHashes, jobs: int = 0
+) -> None:
+    """Write bytecode of transpiled modules into __pycache__.
+
+    Compilation is done in a process pool for the running
+    interpreter. The bytecode is cached using the same hashes
+    as the transpiled sources, so compilation is skipped for
+    any module whose bytecode is still in the cache.
+    """
+    cache_dir = build_cache_dir(cfg)
+    init_cache_dir(cache_dir)
+
+    # module_path -> path of the pyc to compile into
+    pending: typ.Dict[str, str] = {}
+
+    for module_path, filehash in sorted(module_hashes.items()):
+        target_pyc_path = importlib.util.cache_from_source(module_path)
+        pl.Path(target_pyc_path).parent.mkdir(exist_ok=True)
+        if not HAS_HASH_BASED_PYC:
+            pending[module_path] = target_pyc_path
+            continue
+
+        cached_pyc_path = str(_pyc_cache_path(cache_dir, filehash))
+        if not (cached_pyc_path in pending.values() or os.path.exists(cached_pyc_path)):
+            pending[module_path] = cached_pyc_path
+
+    if pending:
+        with cf.ProcessPoolExecutor(max_workers=jobs or None) as executor:
+            list(executor.map(_compile_module, pending.keys(), pending.values()))
+
+    if HAS_HASH_BASED_PYC:
+        for module_path, filehash in module_hashes.items():
+            target_pyc_path = importlib.util.cache_from_source(module_path)
+            shutil.copy(str(_pyc_cache_path(cache_dir, filehash)), target_pyc_path)
+
+
+def _git_output(*args: str) -> typ.List[str]:
+    output = sp.check_output(("git",) + args)
+    return [part.decode("utf-8") for part in output.split(b"\0") if part]
+
+
+# Status letters of 'git diff --name-status', without renames and
+# copies these are (A)dded, (M)odified, (D)eleted and (T)ype changed.
+DELETED_STATUS = "D"
+
+
+def iter_changed_modules(ref: str) -> typ.Iterable[typ.Tuple[str, str]]:
+    """Yield (status, path) of modules that changed since ref.
+
+    Paths are relative to (and restricted to) the current
+    directory. Renames are reported as a deletion plus an
+    addition, files which are not yet tracked as additions.
+    """
+    diff_parts = _git_output(
+        "diff", "--name-status", "--no-renames", "--relative", "-z", ref, "--", "*.py"
+    )
+    for status, path in zip(diff_parts[0::2], diff_parts[1::2]):
+        yield status, path
+
+    untracked_paths = _git_output(
+        "ls-files", "--others", "--exclude-standard", "-z", "--", "*.py"
+    )
+    for path in untracked_paths:
+        yield "A", path
+
+
+def transpile_changed_modules(
+    cfg: common.BuildConfig, ref: str, output_dir: str, jobs: int = 0
+) -> typ.Tuple[typ.List[str], typ.List[str]]:
+    """Update an existing output tree with modules that changed since ref.
+
+    Returns the output paths that were written and removed.
+    """
+    if not os.path.isdir(output_dir):
+        raise Exception(f"Output directory '{output_dir}' does not exist")
+
+    changed_paths: typ.List[str] = []
+    removed_paths: typ.List[str] = []
+
+    for status, path in iter_changed_modules(ref):
+        if status == DELETED_STATUS:
+            output_path = pl.Path(output_dir) / path
+            if output_path.exists():
+                output_path.unlink()
+                removed_paths.append(str(output_path))
+        else:
+            changed_paths.append(path)
+
+    module_datas = (fileio.read_file(path) for path in changed_paths)
+    fixed_module_datas = iter_transpiled_data(cfg, module_datas, jobs)
+    written_paths: typ.List[str] = []
+    for path, fixed_module_data in zip(changed_paths, fixed_module_datas):
+        output_path = pl.Path(output_dir) / path
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, mode="wb") as fh:
+            fh.write(fixed_module_data)
+        written_paths.append(str(output_path))
+
+    return written_paths, removed_paths
+
+
+def fix(package_dir: common.PackageDir=None, **kwargs: str) -> common.PackageDir:
     if package_dir is None:
         package_dir = {"": "."}
 
-    build_package_dir = init_build_package_dir(package_dir)
-    build_cfg = eval_build_config()
-    build_packages(build_cfg, build_package_dir)
+    build_cfg = eval_build_config(**kwargs)
+    output_dir = build_output_dir(build_cfg)
+    build_package_dir = init_build_package_dir(package_dir, output_dir)
+    manifest_path = build_manifest_path(build_cfg)
+    module_hashes = build_packages(build_cfg, build_package_dir, manifest_path=manifest_path)
+    if int(build_cfg["precompile"]):
+        precompile_modules(build_cfg, module_hashes)
     return build_package_dir
+
+
+def _iter_pool_map(
+    func: typ.Callable[[common.BuildConfig, T], typ.Any],
+    cfg: common.BuildConfig,
+    items: typ.Iterable[T],
+    jobs: int = 0,
+) -> typ.Iterable[typ.Any]:
+    if jobs == 1:
+        for item in items:
+            yield func(cfg, item)
+        return
+
+    # NOTE (mb 2018-09-28): Executor.map would consume all items
+    #   up front, instead only a few items per worker are taken
+    #   from the (possibly lazy) items at a time.
+    max_workers = jobs or os.cpu_count() or 1
+    with cf.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending: typ.Deque[cf.Future] = collections.deque()
+        for item in items:
+            pending.append(executor.submit(func, cfg, item))
+            if len(pending) > max_workers * 2:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_transpiled_data(
+    cfg: common.BuildConfig, module_datas: typ.Iterable[bytes], jobs: int = 0
+) -> typ.Iterable[bytes]:
+    """Transpile module sources, preserving their order.
+
+    With jobs == 1 everything runs in the current process,
+    otherwise a process pool with that many workers is used
+    (0 meaning one worker per cpu).
+    """
+    return _iter_pool_map(transpile.transpile_module_data, cfg, module_datas, jobs)
+
+
+# (fixed module source, error message), one of which is None
+TranspileResult = typ.Tuple[typ.Optional[str], typ.Optional[str]]
+
+
+def error_message(ex: Exception) -> str:
+    if isinstance(ex, common.FixerError):
+        return f"{type(ex).__name__}: {ex.msg}"
+    return f"{type(ex).__name__}: {ex}"
+
+
+def transpile_source(cfg: common.BuildConfig, module_source: str) -> TranspileResult:
+    try:
+        return transpile.transpile_module(cfg, module_source), None
+    except Exception as ex:
+        return None, error_message(ex)
+
+
+def iter_transpiled_sources(
+    cfg: common.BuildConfig, module_sources: typ.Iterable[str], jobs: int = 0
+) -> typ.Iterable[TranspileResult]:
+    """Transpile module sources, preserving their order.
+
+    Unlike iter_transpiled_data, an error in one module doesn't
+    stop the others from being transpiled, instead its error
+    message is part of the result.
+    """
+    return _iter_pool_map(transpile_source, cfg, module_sources, jobs)
+
+
+# (fixed module source data, error message) by target version, one
+# of which is None for every target version
+TargetsTranspileResult = typ.Dict[str, typ.Tuple[typ.Optional[bytes], typ.Optional[str]]]
+
+
+def transpile_targets_data(
+    cfg: common.BuildConfig, module_source_data: bytes
+) -> TargetsTranspileResult:
+    """Transpile a module for the comma separated target versions of cfg."""
+    target_versions = cfg["target_version"].split(",")
+    try:
+        results = transpile.transpile_module_data_targets(cfg, module_source_data, target_versions)
+    except Exception as ex:
+        return {tgt_version: (None, error_message(ex)) for tgt_version in target_versions}
+
+    return {
+        tgt_version: (fixed_data, None if error is None else error_message(error))
+        for tgt_version, (fixed_data, error) in results.items()
+    }
+
+
+def iter_transpiled_targets_data(
+    cfg: common.BuildConfig, module_datas: typ.Iterable[bytes], jobs: int = 0
+) -> typ.Iterable[TargetsTranspileResult]:
+    """Transpile module sources for several target versions at once.
+
+    Each module is only parsed and checked once, see
+    transpile.transpile_module_targets.
+    """
+    return _iter_pool_map(transpile_targets_data, cfg, module_datas, jobs)
+
+
+# (fixed module source data, error message), one of which is None
+DataTranspileResult = typ.Tuple[typ.Optional[bytes], typ.Optional[str]]
+
+
+def transpile_cached_data(
+    cfg: common.BuildConfig, module_source_data: bytes
+) -> DataTranspileResult:
+    cache_path = build_cache_dir(cfg) / (fileio.hash_data(module_source_data) + ".py")
+    force_transpile = int(cfg.get("force_transpile", "1"))
+    if not force_transpile and cache_path.exists():
+        return cache_path.read_bytes(), None
+
+    try:
+        fixed_module_source_data = transpile.transpile_module_data(cfg, module_source_data)
+    except Exception as ex:
+        return None, error_message(ex)
+
+    fileio.write_atomic(str(cache_path), fixed_module_source_data)
+    return fixed_module_source_data, None
+
+
+def iter_cached_transpiled_data(
+    cfg: common.BuildConfig, module_datas: typ.Iterable[bytes], jobs: int = 0
+) -> typ.Iterable[DataTranspileResult]:
+    """Transpile module sources using the build cache.
+
+    Unless "force_transpile" is set, modules which were
+    transpiled before with the same config (by a build or an
+    earlier call) are only read from the cache. As with
+    iter_transpiled_sources, errors are part of the results.
+    """
+    init_cache_dir(build_cache_dir(cfg))
+    return _iter_pool_map(transpile_cached_data, cfg, module_datas, jobs)
+
+
+def _record_digest(data: bytes) -> str:
+    # https://www.python.org/dev/peps/pep-0376/#record
+    digest = hl.sha256(data).digest()
+    return "sha256=" + base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+
+def _copy_zipinfo(info: zipfile.ZipInfo) -> zipfile.ZipInfo:
+    new_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    new_info.compress_type = info.compress_type
+    new_info.create_system = info.create_system
+    new_info.external_attr = info.external_attr
+    new_info.comment = info.comment
+    return new_info
+
+
+def _is_record_file(filename: str) -> bool:
+    dirname, _, basename = filename.rpartition("/")
+    is_dist_info = dirname.endswith(".dist-info") and "/" not in dirname
+    return is_dist_info and basename in ("RECORD", "RECORD.jws", "RECORD.p7s")
+
+
+def _retag_wheel_metadata(wheel_metadata: bytes, python_tag: str) -> bytes:
+    lines = wheel_metadata.decode("utf-8").splitlines()
+    tag_offsets = [i for i, line in enumerate(lines) if line.startswith("Tag:")]
+    if not tag_offsets:
+        raise common.InvalidPackage("Missing 'Tag' in WHEEL metadata")
+
+    for line in (lines[i] for i in tag_offsets):
+        _, abi_tag, platform_tag = line[len("Tag:"):].strip().split("-")
+        if (abi_tag, platform_tag) != ("none", "any"):
+            raise common.InvalidPackage(f"Only pure python wheels are supported, got '{line}'")
+
+    new_tags = [f"Tag: {tag}-none-any" for tag in python_tag.split(".")]
+    first_tag_offset = tag_offsets[0]
+    lines = [line for line in lines if not line.startswith("Tag:")]
+    lines[first_tag_offset:first_tag_offset] = new_tags
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+ModuleDatasFixer = typ.Callable[[typ.Iterable[bytes]], typ.Iterable[bytes]]
+
+
+def _rewrite_wheel(
+    in_wheel_path: str,
+    out_wheel_path: str,
+    fix_module_datas: typ.Optional[ModuleDatasFixer] = None,
+    python_tag: typ.Optional[str] = None,
+) -> None:
+    with zipfile.ZipFile(in_wheel_path, mode="r") as in_wheel:
+        infos = [info for info in in_wheel.infolist() if not _is_record_file(info.filename)]
+        record_infos = [
+            info for info in in_wheel.infolist()
+            if info.filename.endswith("/RECORD") and _is_record_file(info.filename)
+        ]
+        if len(record_infos) != 1:
+            raise common.InvalidPackage(f"Expected exactly one RECORD in '{in_wheel_path}'")
+
+        record_info = record_infos[0]
+        wheel_metadata_filename = record_info.filename[:-len("RECORD")] + "WHEEL"
+
+        fixed_module_datas: typ.Iterator[bytes] = iter(())
+        if fix_module_datas:
+            module_datas = (
+                in_wheel.read(info) for info in infos if info.filename.endswith(".py")
+            )
+            fixed_module_datas = iter(fix_module_datas(module_datas))
+
+        record_lines: typ.List[str] = []
+
+        with zipfile.ZipFile(out_wheel_path, mode="w") as out_wheel:
+            for info in infos:
+                if fix_module_datas and info.filename.endswith(".py"):
+                    data = next(fixed_module_datas)
+                elif python_tag and info.filename == wheel_metadata_filename:
+                    data = _retag_wheel_metadata(in_wheel.read(info), python_tag)
+                else:
+                    data = in_wheel.read(info)
+
+                out_wheel.writestr(_copy_zipinfo(info), data)
+                record_lines.append(f"{info.filename},{_record_digest(data)},{len(data)}")
+
+            record_lines.append(f"{record_info.filename},,")
+            record_data = ("\n".join(record_lines) + "\n").encode("utf-8")
+            out_wheel.writestr(_copy_zipinfo(record_info), record_data)
+
+
+def transpile_wheel(
+    cfg: common.BuildConfig,
+    in_wheel_path: str,
+    out_wheel_path: str,
+    jobs: int = 0,
+    python_tag: str = None,
+) -> None:
+    """Write a copy of a wheel with all python modules transpiled.
+
+    The wheel is never extracted to disk, its entries are
+    rewritten one by one in their original order. The RECORD
+    of the wheel is regenerated, signatures of the old RECORD
+    are dropped as they would no longer be valid. If a
+    python_tag is given, the tags in the WHEEL metadata are
+    replaced.
+    """
+    def fix_module_datas(module_datas: typ.Iterable[bytes]) -> typ.Iterable[bytes]:
+        return iter_transpiled_data(cfg, module_datas, jobs)
+
+    _rewrite_wheel(in_wheel_path, out_wheel_path, fix_module_datas, python_tag)
+
+
+def retag_wheel(in_wheel_path: str, out_wheel_path: str, python_tag: str) -> None:
+    """Write a copy of a wheel with new python tags and no other changes."""
+    _rewrite_wheel(in_wheel_path, out_wheel_path, python_tag=python_tag)
+
+
+def _parse_version(version: str) -> typ.Tuple[int, int]:
+    major, minor = version.split(".")[:2]
+    return int(major), int(minor)
+
+
+def native_python_tag() -> str:
+    """Python tag for wheels of untranspiled code.
+
+    The source version is that of the current interpreter
+    (which is also what transpile_module assumes). Installers
+    treat pyXY as compatible with any later 3.x version.
+    """
+    src_major, src_minor = sys.version_info[:2]
+    return f"py{src_major}{src_minor}"
+
+
+def transpiled_python_tag(target_version: str) -> str:
+    """Python tag for wheels of code transpiled to target_version.
+
+    The tag covers every version from the target up to (but
+    excluding) the source version. It deliberately doesn't use
+    the generic "py3" tag, which installers would prefer over
+    the native wheel on later versions of python.
+    """
+    tgt_major, tgt_minor = _parse_version(target_version)
+    src_major, src_minor = sys.version_info[:2]
+    if (tgt_major, tgt_minor) >= (src_major, src_minor):
+        raise Exception(
+            f"target_version {target_version} must be older than {src_major}.{src_minor}"
+        )
+
+    tags: typ.List[str] = []
+    if tgt_major == 2:
+        tags.append("py2")
+        tgt_minor = 0
+    tags.extend(f"py{src_major}{minor}" for minor in range(tgt_minor, src_minor))
+    return ".".join(tags)
+
+
+def _wheel_path_with_tag(wheel_path: str, dist_dir: str, python_tag: str) -> str:
+    # https://www.python.org/dev/peps/pep-0427/#file-name-convention
+    wheel_name = pl.Path(wheel_path).name
+    name_parts = wheel_name[:-len(".whl")].split("-")
+    if len(name_parts) not in (5, 6):
+        raise common.InvalidPackage(f"Invalid wheel filename '{wheel_name}'")
+
+    name_parts[-3] = python_tag
+    return str(pl.Path(dist_dir) / ("-".join(name_parts) + ".whl"))
+
+
+def build_dual_wheels(
+    cfg: common.BuildConfig, native_wheel_path: str, dist_dir: typ.Optional[str] = None, jobs: int = 0
+) -> typ.Tuple[str, str]:
+    """Create a native and a transpiled wheel from a wheel of untranspiled code.
+
+    The native wheel is only retagged, so that interpreters
+    at least as new as the source version install untranspiled
+    code. The transpiled wheel is tagged for all older versions
+    down to the target_version of the cfg.
+
+    Both wheels are written to dist_dir, by default the directory
+    of native_wheel_path. If native_wheel_path is in dist_dir, it
+    is removed once both wheels are written, as its (generic) tag
+    would otherwise let older interpreters install untranspiled
+    code from dist_dir.
+
+    Returns the paths of the native and the transpiled wheel.
+    """
+    if dist_dir is None:
+        dist_dir = str(pl.Path(native_wheel_path).parent)
+
+    native_tag = native_python_tag()
+    transpiled_tag = transpiled_python_tag(cfg["target_version"])
+
+    native_out_path = _wheel_path_with_tag(native_wheel_path, dist_dir, native_tag)
+    transpiled_out_path = _wheel_path_with_tag(native_wheel_path, dist_dir, transpiled_tag)
+
+    if native_out_path != native_wheel_path:
+        retag_wheel(native_wheel_path, native_out_path, native_tag)
+    transpile_wheel(cfg, native_wheel_path, transpiled_out_path, jobs, transpiled_tag)
+
+    is_in_dist_dir = pl.Path(native_wheel_path).resolve().parent == pl.Path(dist_dir).resolve()
+    if is_in_dist_dir and native_out_path != native_wheel_path:
+        os.remove(native_wheel_path)
+    return native_out_path, transpiled_out_path
@@ -0,0 +1,341 @@
+# This file is part of the lib3to6 project
+# https://github.com/mbarkhau/lib3to6
+#
+# (C) 2018 Manuel Barkhau (@mbarkhau)
+# SPDX-License-Identifier: MIT
+
+"""Lexical prefilter for modules which don't require any fixes.
+
+Most fixers and checkers only have something to do if a module
+contains particular tokens. If none of the selected fixers and
+checkers are triggered by the tokens of a module, the module can
+be transpiled without parsing it: the original source is kept
+and only the header and __future__ imports are spliced in.
+
+The scan is conservative, a pseudo token may be reported for
+a construct that isn't actually there, but never the other way
+around.
+"""
+
+import io
+import re
+import keyword
+import tokenize
+import typing as typ
+
+from . import common
+
+
+# Pseudo tokens for constructs that can't be identified by a
+# single token.
+
+ANNOTATION = "<annotation>"
+KWONLY_ARGS = "<kwonly_args>"
+FSTRING = "<fstring>"
+BUILTIN_BINDING = "<builtin_binding>"
+STAR_IMPORT = "<star_import>"
+
+# Lexical constructs which are only valid in newer versions, but
+# which have no representation in the ast, so they are removed
+# by parsing and regenerating the module (e.g. 1_000).
+REQUIRES_CODEGEN = "<requires_codegen>"
+
+TriggerTokens = typ.Optional[typ.FrozenSet[str]]
+
+
+class ModuleScan(typ.NamedTuple):
+    tokens: typ.Set[str]
+    # names imported by "from __future__ import ..."
+    future_names: typ.Set[str]
+    # new __future__ imports are inserted after this line (one based),
+    # zero if there is neither a docstring nor a __future__ import
+    future_imports_lineno: int
+
+
+# NOTE (mb 2018-09-30): str.splitlines and tokenize don't agree
+#   on these, so line numbers couldn't be mapped reliably.
+UNUSUAL_LINE_BREAKS = "\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+
+_LINE_BREAK_RE = re.compile(r"\r\n|\r|\n")
+
+# "\n" which isn't part of a "\r\n"
+_LF_RE = re.compile(r"(?<!\r)\n")
+
+_NEWLINE = "<newline>"
+
+_COMPOUND_KEYWORDS = {
+    "if", "elif", "else", "for", "while", "try", "except", "finally", "with", "def", "class",
+    "async",
+}
+
+_AUGASSIGN_OPS = {
+    "+=", "-=", "*=", "/=", "//=", "%=", "@=", "&=", "|=", "^=", ">>=", "<<=", "**=",
+}
+
+_BINDING_PREV = {
+    _NEWLINE, ";", ":", ",", "(", "[", "=", "*", "**",
+    "import", "as", "for", "lambda", "global", "nonlocal",
+}
+
+_BINDING_NEXT = {_NEWLINE, ";", ":", ",", ")", "]", "=", ":=", "in", "as"} | _AUGASSIGN_OPS
+
+_SAFE_STRING_PREFIXES = {"", "r", "b", "br"}
+
+_FSTRING_START = getattr(tokenize, "FSTRING_START", None)
+
+# async/await have their own token types on python 3.5 and 3.6
+_NAME_TYPES = {
+    tokenize.NAME,
+    getattr(tokenize, "ASYNC", tokenize.NAME),
+    getattr(tokenize, "AWAIT", tokenize.NAME),
+}
+
+
+class _Bracket:
+
+    kind: str
+    has_bindings: bool
+    pending_lambdas: int
+
+    def __init__(self, kind: str, has_bindings: bool = False) -> None:
+        # "call" for brackets in which names can only be loaded
+        # (call arguments, subscripts...), "def" for parameters of a
+        # function definition, "stmt" for the statement itself.
+        self.kind = kind
+        # a comprehension or lambda can bind names anywhere
+        self.has_bindings = has_bindings
+        self.pending_lambdas = 0
+
+
+def _string_prefix(token_str: str) -> str:
+    quote_index = min(i for i in (token_str.find('"'), token_str.find("'")) if i >= 0)
+    return token_str[:quote_index].lower()
+
+
+def _is_builtin_binding(prev_tok: str, next_tok: str, bracket: _Bracket) -> bool:
+    if prev_tok in ("def", "class"):
+        return True
+    if prev_tok == ".":
+        return False
+    if bracket.kind == "call" and not bracket.has_bindings:
+        return next_tok == ":="
+    if next_tok in ("(", ".", "["):
+        return False
+    return prev_tok in _BINDING_PREV and next_tok in _BINDING_NEXT
+
+
+def _iter_tokens(module_source: str) -> typ.Iterable[typ.Tuple[int, str, int]]:
+    """Yield (type, string, end line) of significant tokens.
+
+    Tokens which end a statement or start a block are yielded
+    as _NEWLINE.
+    """
+    readline = io.StringIO(module_source).readline
+    for tok in tokenize.generate_tokens(readline):
+        if tok.type in (tokenize.COMMENT, tokenize.NL, tokenize.ENDMARKER):
+            continue
+        if tok.type in (tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT):
+            yield tok.type, _NEWLINE, tok.end[0]
+        else:
+            yield tok.type, tok.string, tok.end[0]
+
+
+def _parse_future_names(stmt: typ.List[str]) -> typ.Set[str]:
+    # stmt: from __future__ import a, b as c, (d)
+    future_names: typ.Set[str] = set()
+    names = [tok for tok in stmt[3:] if tok not in ("(", ")", ",")]
+    for i, name in enumerate(names):
+        is_alias = i > 0 and names[i - 1] == "as"
+        has_alias = i + 1 < len(names) and names[i + 1] == "as"
+        if not (name == "as" or is_alias or has_alias):
+            future_names.add(name)
+    return future_names
+
+
+def scan_module(module_source: str) -> typ.Optional[ModuleScan]:
+    """Collect the (pseudo) tokens of a module.
+
+    Returns None if the module can't be scanned reliably, in
+    which case it has to be parsed.
+    """
+    if any(c in module_source for c in UNUSUAL_LINE_BREAKS):
+        return None
+
+    try:
+        toks = list(_iter_tokens(module_source))
+    except (tokenize.TokenError, SyntaxError):
+        return None
+
+    found_tokens: typ.Set[str] = set()
+    future_names: typ.Set[str] = set()
+    future_imports_lineno = 0
+
+    brackets = [_Bracket("stmt")]
+    stmt: typ.List[str] = []
+    stmt_index = 0
+    has_header_colon = False
+    is_leading_stmt = True
+
+    for i, (tok_type, tok, end_lineno) in enumerate(toks):
+        prev_tok = toks[i - 1][1] if i > 0 else _NEWLINE
+        next_tok = toks[i + 1][1] if i + 1 < len(toks) else _NEWLINE
+        bracket = brackets[-1]
+
+        if tok == _NEWLINE:
+            if is_leading_stmt and stmt:
+                if ";" in stmt or (stmt_index == 0 and stmt[0] == "("):
+                    return None
+                is_docstring = stmt_index == 0 and all(
+                    stmt_tok.startswith(("'", '"')) for stmt_tok in stmt
+                )
+                if is_docstring:
+                    future_imports_lineno = end_lineno
+                elif stmt[:3] == ["from", "__future__", "import"]:
+                    future_names.update(_parse_future_names(stmt))
+                    future_imports_lineno = end_lineno
+                elif stmt[0] not in ("import", "from"):
+                    is_leading_stmt = False
+            if stmt:
+                stmt_index += 1
+            stmt = []
+            brackets = [_Bracket("stmt")]
+            has_header_colon = False
+            continue
+
+        if tok_type == tokenize.STRING:
+            prefix = _string_prefix(tok)
+            # str literals are normalized to start with their quote,
+            # so that the first statement can be checked for a docstring
+            stmt.append(tok[len(prefix):] if prefix in ("", "r", "u") else "<str>")
+            if "f" in prefix:
+                found_tokens.add(FSTRING)
+            elif prefix not in _SAFE_STRING_PREFIXES:
+                found_tokens.add(REQUIRES_CODEGEN)
+            continue
+
+        stmt.append(tok)
+        if _FSTRING_START is not None and tok_type == _FSTRING_START:
+            found_tokens.add(FSTRING)
+            continue
+        if tok_type == tokenize.NUMBER:
+            if "_" in tok:
+                found_tokens.add(REQUIRES_CODEGEN)
+            continue
+        if not (tok_type in _NAME_TYPES or tok_type == tokenize.OP):
+            continue
+
+        found_tokens.add(tok)
+
+        if tok in ("(", "[", "{"):
+            is_def_params = tok == "(" and i > 1 and toks[i - 2][1] == "def"
+            is_after_name = toks[i - 1][0] in (tokenize.NAME, tokenize.STRING)
+            is_after_value = prev_tok in (")", "]", "except") or (
+                is_after_name and not keyword.iskeyword(prev_tok)
+            )
+            is_load_bracket = tok in ("(", "[") and is_after_value
+            if is_def_params:
+                brackets.append(_Bracket("def"))
+            elif is_load_bracket or bracket.kind == "call":
+                brackets.append(_Bracket("call", bracket.has_bindings))
+            else:
+                brackets.append(_Bracket("other", bracket.has_bindings))
+        elif tok in (")", "]", "}"):
+            if len(brackets) > 1:
+                brackets.pop()
+        elif tok in ("for", "lambda"):
+            bracket.has_bindings = True
+            if tok == "lambda":
+                bracket.pending_lambdas += 1
+        elif tok == ":":
+            if bracket.pending_lambdas:
+                bracket.pending_lambdas -= 1
+            elif bracket.kind == "def":
+                found_tokens.add(ANNOTATION)
+            elif bracket.kind == "stmt":
+                if stmt[0] in _COMPOUND_KEYWORDS and not has_header_colon:
+                    has_header_colon = True
+                else:
+                    found_tokens.add(ANNOTATION)
+        elif tok == "->":
+            found_tokens.add(ANNOTATION)
+        elif tok == "*":
+            if bracket.kind == "def":
+                found_tokens.add(KWONLY_ARGS)
+            if prev_tok == "import":
+                found_tokens.add(STAR_IMPORT)
+        elif tok in common.BUILTIN_NAMES and not keyword.iskeyword(tok):
+            if _is_builtin_binding(prev_tok, next_tok, bracket):
+                found_tokens.add(BUILTIN_BINDING)
+
+    return ModuleScan(found_tokens, future_names, future_imports_lineno)
+
+
+def can_copy_source(scan: typ.Optional[ModuleScan]) -> bool:
+    """Whether (unfixed parts of) a module can be copied verbatim."""
+    return scan is not None and REQUIRES_CODEGEN not in scan.tokens
+
+
+def is_triggered(trigger_tokens: TriggerTokens, scan: ModuleScan) -> bool:
+    """Whether a fixer or checker has to run on the parsed module.
+
+    None means that it always has to run.
+    """
+    return trigger_tokens is None or not trigger_tokens.isdisjoint(scan.tokens)
+
+
+def module_newline(module_source: str) -> str:
+    """The line break used by module_source, judged by its first line."""
+    line_break = _LINE_BREAK_RE.search(module_source)
+    return "\n" if line_break is None else line_break.group()
+
+
+def with_newline(source: str, newline: str) -> str:
+    """Convert the line breaks of generated source to newline.
+
+    Line breaks which already are "\r\n" are kept, so source may
+    contain lines copied from a module.
+    """
+    if newline == "\n":
+        return source
+    return _LF_RE.sub(newline, source)
+
+
+def _line_offset(module_source: str, line_index: int) -> int:
+    # only the line breaks before the line (zero based) are scanned
+    offset = 0
+    line_breaks = _LINE_BREAK_RE.finditer(module_source)
+    for _ in range(line_index):
+        line_break = next(line_breaks, None)
+        if line_break is None:
+            return len(module_source)
+        offset = line_break.end()
+    return offset
+
+
+def splice_future_imports(
+    module_source: str,
+    header: str,
+    header_line_count: int,
+    scan: ModuleScan,
+    future_names: typ.Iterable[str],
+) -> str:
+    """Add the header and missing __future__ imports to a module.
+
+    The result is equivalent to what transpile_module produces
+    by parsing the module, adding the imports to the tree and
+    regenerating the source, only that formatting and comments
+    are preserved.
+    """
+    insert_index = max(scan.future_imports_lineno, header_line_count)
+    head_offset = _line_offset(module_source, header_line_count)
+    insert_offset = _line_offset(module_source, insert_index)
+
+    newline = module_newline(module_source)
+    body_head = module_source[head_offset:insert_offset]
+    body_tail = module_source[insert_offset:]
+    if body_head and not body_head.endswith(("\n", "\r")):
+        body_head += newline
+
+    missing_names = sorted(set(future_names) - scan.future_names)
+    future_imports = "".join(f"from __future__ import {name}{newline}" for name in missing_names)
+    return with_newline(header, newline) + body_head + future_imports + body_tail
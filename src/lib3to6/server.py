@@ -0,0 +1,251 @@
+# This file is part of the lib3to6 project
+# https://github.com/mbarkhau/lib3to6
+#
+# (C) 2018 Manuel Barkhau (@mbarkhau)
+# SPDX-License-Identifier: MIT
+
+import io
+import os
+import stat
+import json
+import time
+import socket
+import threading
+import collections
+import socketserver
+import typing as typ
+
+from . import common
+from . import fileio
+from . import transpile
+from . import packaging
+
+
+# NOTE (mb 2018-09-30): The socket is in a directory private to
+#   the user, where nobody else can bind a daemon of their own.
+DEFAULT_SOCKET_PATH = os.path.join(fileio.user_cache_dir(), "daemon.sock")
+
+MAX_CACHED_RESULTS = 1024
+
+# A request is a json object with the keys:
+#   "source" or "path"  : module source or path of a module to read
+#   "cfg"               : (optional) BuildConfig
+#   "target_version",
+#   "fixers", "checkers": (optional) override the entries of cfg
+#   "id"                : (optional) copied to the response
+#
+# The response has the keys "fixed" and "error" (the same as a
+# packaging.TranspileResult), "duration" in seconds, and "id"
+# if the request had one.
+Request = typ.Dict[str, typ.Any]
+Response = typ.Dict[str, typ.Any]
+
+CFG_REQUEST_KEYS = ("target_version", "fixers", "checkers")
+
+# sys.stdin.buffer or the rfile/wfile of a socketserver handler
+StreamFile = typ.Union[typ.BinaryIO, io.BufferedIOBase]
+
+
+def _request_source(request: Request) -> str:
+    if "source" in request:
+        return request["source"]
+
+    module_source, _ = transpile.decode_module(fileio.read_file(request["path"]))
+    return module_source
+
+
+class TranspileService:
+    """Handles requests, keeping recent results in memory.
+
+    Instances are thread safe, so one service can be shared by
+    all connections to the daemon.
+    """
+
+    _lock: threading.Lock
+    _fingerprints: typ.Dict[str, str]
+    _results: typ.MutableMapping[str, packaging.TranspileResult]
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._fingerprints = {}
+        self._results = collections.OrderedDict()
+
+    def _fingerprint(self, cfg: common.BuildConfig) -> str:
+        cfg_key = json.dumps(cfg, sort_keys=True)
+        fingerprint = self._fingerprints.get(cfg_key)
+        if fingerprint is None:
+            fingerprint = packaging.config_fingerprint(cfg)
+            self._fingerprints[cfg_key] = fingerprint
+        return fingerprint
+
+    def transpile(self, cfg: common.BuildConfig, source: str) -> packaging.TranspileResult:
+        source_hash = fileio.hash_data(source.encode("utf-8"))
+        cache_key = self._fingerprint(cfg) + source_hash
+        with self._lock:
+            result = self._results.get(cache_key)
+        if result is not None:
+            return result
+
+        result = packaging.transpile_source(cfg, source)
+        with self._lock:
+            self._results[cache_key] = result
+            while len(self._results) > MAX_CACHED_RESULTS:
+                self._results.popitem(last=False)    # type: ignore
+        return result
+
+    def handle(self, request: Request) -> Response:
+        tzero = time.time()
+        response: Response = {}
+        if "id" in request:
+            response["id"] = request["id"]
+
+        try:
+            cfg_kwargs = dict(request.get("cfg", {}))
+            for key in CFG_REQUEST_KEYS:
+                if key in request:
+                    cfg_kwargs[key] = request[key]
+            cfg = packaging.eval_build_config(**cfg_kwargs)
+            source = _request_source(request)
+        except Exception as ex:
+            response["fixed"] = None
+            response["error"] = f"Invalid request: {packaging.error_message(ex)}"
+        else:
+            response["fixed"], response["error"] = self.transpile(cfg, source)
+
+        response["duration"] = time.time() - tzero
+        return response
+
+    def handle_line(self, request_line: bytes) -> bytes:
+        try:
+            request = json.loads(request_line.decode("utf-8"))
+        except ValueError as ex:
+            response: Response = {"fixed": None, "error": f"Invalid request: {ex}"}
+        else:
+            response = self.handle(request)
+        return json.dumps(response).encode("utf-8") + b"\n"
+
+    def handle_stream(self, rfile: StreamFile, wfile: StreamFile) -> None:
+        """Answer newline delimited requests until rfile is closed.
+
+        Each response is flushed immediately, so that the other
+        side can wait for it before sending the next request.
+        """
+        for request_line in rfile:
+            if request_line.strip():
+                wfile.write(self.handle_line(request_line))
+                wfile.flush()
+
+
+class _StreamRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self) -> None:
+        service: TranspileService = self.server.service    # type: ignore
+        service.handle_stream(self.rfile, self.wfile)
+
+
+def make_server(socket_path: str = DEFAULT_SOCKET_PATH) -> socketserver.BaseServer:
+    """Create a daemon which listens on a unix domain socket.
+
+    Each connection can send any number of newline delimited
+    requests, responses are written in the same order.
+
+    The directory of the default socket_path is created private
+    to the user, for other paths the caller is responsible.
+    """
+    if socket_path == DEFAULT_SOCKET_PATH:
+        fileio.make_private_dir(os.path.dirname(socket_path))
+
+    if os.path.lexists(socket_path):
+        # NOTE (mb 2018-09-29): Most likely left over from a daemon
+        #   which was killed. If another daemon is still running on
+        #   it, it will keep serving existing connections only.
+        socket_stat = os.lstat(socket_path)
+        if not stat.S_ISSOCK(socket_stat.st_mode):
+            raise OSError(f"Not a socket: {socket_path}")
+        if not fileio.is_owned(socket_path):
+            raise PermissionError(f"Socket not owned by the current user: {socket_path}")
+        os.remove(socket_path)
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, _StreamRequestHandler)
+    server.daemon_threads = True
+    server.service = TranspileService()    # type: ignore
+    return server
+
+
+def serve(socket_path: str = DEFAULT_SOCKET_PATH) -> None:
+    server = make_server(socket_path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+
+class Client:
+    """Thin client for a daemon started with serve()."""
+
+    _sock: socket.socket
+    _rfile: typ.IO[bytes]
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH) -> None:
+        # a daemon of another user could return arbitrary code
+        if not fileio.is_owned(socket_path):
+            raise PermissionError(f"Socket not owned by the current user: {socket_path}")
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.connect(socket_path)
+        except Exception:
+            self._sock.close()
+            raise
+        self._rfile = self._sock.makefile(mode="rb")
+
+    def close(self) -> None:
+        self._rfile.close()
+        self._sock.close()
+
+    def transpile(self, cfg: common.BuildConfig, source: str) -> packaging.TranspileResult:
+        request_data = json.dumps({"cfg": cfg, "source": source}).encode("utf-8")
+        self._sock.sendall(request_data + b"\n")
+        response_line = self._rfile.readline()
+        if not response_line:
+            raise ConnectionError("Connection to lib3to6 daemon closed")
+        response = json.loads(response_line.decode("utf-8"))
+        return response["fixed"], response["error"]
+
+
+def connect(socket_path: str = DEFAULT_SOCKET_PATH) -> typ.Optional[Client]:
+    """Connect to a running daemon, None if there is none.
+
+    Daemons of other users are ignored, as if they weren't running.
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    try:
+        return Client(socket_path)
+    except OSError:
+        return None
+
+
+def iter_transpiled_sources(
+    cfg: common.BuildConfig,
+    module_sources: typ.Iterable[str],
+    socket_path: str = DEFAULT_SOCKET_PATH,
+    jobs: int = 0,
+) -> typ.Iterable[packaging.TranspileResult]:
+    """Transpile module sources using a daemon if one is running.
+
+    Without a daemon, this is the same as
+    packaging.iter_transpiled_sources.
+    """
+    client = connect(socket_path)
+    if client is None:
+        for result in packaging.iter_transpiled_sources(cfg, module_sources, jobs):
+            yield result
+        return
+
+    try:
+        for module_source in module_sources:
+            yield client.transpile(cfg, module_source)
+    finally:
+        client.close()
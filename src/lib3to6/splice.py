@@ -0,0 +1,462 @@
+# This file is part of the lib3to6 project
+# https://github.com/mbarkhau/lib3to6
+#
+# (C) 2018 Manuel Barkhau (@mbarkhau)
+# SPDX-License-Identifier: MIT
+
+"""Emit fixed modules by splicing into the original source.
+
+Statements which no fixer has changed are copied verbatim from
+the original source, preserving formatting and comments. Only
+statements which were changed or added are generated. For
+function and class definitions, the header and the body are
+handled separately, so that a changed signature doesn't cause
+the whole body to be regenerated.
+
+Which statements have changed is determined by the line numbers
+of the nodes that fixers have marked as changed. Nodes which
+replace another node take over its location.
+"""
+
+import re
+import ast
+import copy
+import bisect
+import tokenize
+import itertools
+import typing as typ
+
+from . import codegen
+from . import prefilter
+
+
+_LINE_BREAK_RE = re.compile(r"\r\n|\r|\n")
+
+_DEF_NODE_TYPES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+
+class SpliceError(Exception):
+    """The fixed tree can't be spliced into the original source."""
+
+
+class Chunk(typ.NamedTuple):
+    # first and last line (one based) of the original source, None
+    # for statements which were added
+    span: typ.Optional[typ.Tuple[int, int]]
+    # None to copy the original lines
+    source: typ.Optional[str]
+
+
+def line_offsets(module_source: str) -> typ.List[int]:
+    """Offsets of the start of each line in module_source.
+
+    Line numbers are one based, as in the ast, so the source of
+    line n is module_source[offsets[n - 1]:offsets[n]].
+    """
+    offsets = [0]
+    offsets.extend(match.end() for match in _LINE_BREAK_RE.finditer(module_source))
+    offsets.append(len(module_source))
+    return offsets
+
+
+def first_lineno(stmt: ast.stmt) -> int:
+    lineno = stmt.lineno
+    for decorator in getattr(stmt, "decorator_list", ()):
+        lineno = min(lineno, decorator.lineno)
+    return lineno
+
+
+def stmt_source(stmt: ast.stmt, indent_with: str = " " * 4, depth: int = 0) -> str:
+    """Generate the source of a statement, indented depth times."""
+    return codegen.to_source(stmt, indent_with, depth)
+
+
+def shift_chunk(chunk: Chunk, line_delta: int) -> Chunk:
+    if chunk.span is None:
+        return chunk
+    first, last = chunk.span
+    return Chunk((first + line_delta, last + line_delta), chunk.source)
+
+
+_COMPOUND_KEYWORDS = {"@", "if", "elif", "while", "for", "try", "with", "def", "class", "async"}
+
+# keywords which continue a compound statement after its block
+_CONTINUATION_KEYWORDS = {"else", "elif", "except", "finally"}
+
+
+def _simple_stmt_end_lineno(tokens: typ.Iterable[tokenize.TokenInfo]) -> typ.Optional[int]:
+    brackets = 0
+    for tok in tokens:
+        if tok.type == tokenize.NEWLINE:
+            return tok.start[0]
+        if tok.type == tokenize.OP:
+            if tok.string in "([{":
+                brackets += 1
+            elif tok.string in ")]}":
+                brackets -= 1
+            elif tok.string == ";" and brackets == 0:
+                return tok.start[0]
+    return None
+
+
+def _compound_stmt_end_lineno(tokens: typ.Iterable[tokenize.TokenInfo]) -> typ.Optional[int]:
+    end_lineno: typ.Optional[int] = None
+    depth = 0
+    is_decorator = False
+    is_line_start = True
+    try:
+        for tok in tokens:
+            if tok.type in (tokenize.COMMENT, tokenize.NL):
+                continue
+            if tok.type == tokenize.INDENT:
+                # the indentation of the first line is not a block
+                if end_lineno is not None:
+                    depth += 1
+                continue
+            if tok.type == tokenize.DEDENT:
+                depth -= 1
+                continue
+
+            if is_line_start and end_lineno is not None and depth <= 0:
+                is_continued = is_decorator or (
+                    tok.type == tokenize.NAME and tok.string in _CONTINUATION_KEYWORDS
+                )
+                if depth < 0 or not is_continued:
+                    return end_lineno
+            if is_line_start and depth == 0:
+                is_decorator = tok.type == tokenize.OP and tok.string == "@"
+
+            is_line_start = tok.type == tokenize.NEWLINE
+            if is_line_start:
+                end_lineno = tok.start[0]
+    except IndentationError:
+        # NOTE (mb 2018-09-30): Tokenizing starts at the indentation
+        #   of the statement, so a line which dedents further can't
+        #   be tokenized. It comes after the end of the statement.
+        if end_lineno is None:
+            raise
+    return end_lineno
+
+
+def _stmt_end_lineno(
+    tokens: typ.Iterable[tokenize.TokenInfo], col_offset: int, is_match: bool
+) -> typ.Optional[int]:
+    """The last line of the statement at col_offset of the first line."""
+    tokens = iter(tokens)
+    for tok in tokens:
+        if tok.type in (tokenize.INDENT, tokenize.COMMENT, tokenize.NL):
+            continue
+        if tok.start[0] > 1 or tok.start[1] >= col_offset:
+            break
+    else:
+        return None
+
+    # NOTE (mb 2018-09-30): "match" is only a keyword if the
+    #   statement is a match statement.
+    is_compound = tok.string in _COMPOUND_KEYWORDS or (tok.string == "match" and is_match)
+    remaining_tokens = itertools.chain([tok], tokens)
+    if is_compound:
+        return _compound_stmt_end_lineno(remaining_tokens)
+    else:
+        return _simple_stmt_end_lineno(remaining_tokens)
+
+
+class _SourceBuilder:
+
+    module_source: str
+    offsets: typ.List[int]
+    parts: typ.List[str]
+    next_lineno: int
+    newline: str
+
+    def __init__(
+        self, module_source: str, offsets: typ.List[int], lineno: int, newline: str = "\n"
+    ) -> None:
+        self.module_source = module_source
+        self.offsets = offsets
+        self.newline = newline
+        self.parts = []
+        # lines before this one (one based) have been emitted
+        self.next_lineno = lineno
+
+    def copy_until(self, lineno: typ.Optional[int]) -> None:
+        """Copy original lines, to the end of the module if lineno is None."""
+        if lineno is None:
+            self.parts.append(self.module_source[self.offsets[self.next_lineno - 1]:])
+        elif lineno >= self.next_lineno:
+            self.parts.append(self.module_source[self.offsets[self.next_lineno - 1]:self.offsets[lineno]])
+            self.next_lineno = lineno + 1
+
+    def skip_until(self, lineno: int) -> None:
+        self.next_lineno = lineno + 1
+
+    def append(self, source: str) -> None:
+        if self.parts and self.parts[-1].rstrip().endswith("\\"):
+            raise SpliceError("Line continuation before generated statement")
+        if self.parts and not self.parts[-1].endswith(("\n", "\r")):
+            self.parts.append(self.newline)
+        # generated code uses the same line breaks as copied lines
+        self.parts.append(prefilter.with_newline(source, self.newline))
+
+
+class Splicer:
+    """Generates the source of (parts of) a fixed module.
+
+    Raises SpliceError if the fixed tree can't be spliced into
+    the original source.
+    """
+
+    module_source: str
+    offsets: typ.List[int]
+    newline: str
+
+    _mark_linenos: typ.List[int]
+    _changed_ids: typ.Set[int]
+
+    def __init__(
+        self,
+        module_source: str,
+        changed_nodes: typ.Iterable[ast.AST],
+        offsets: typ.Optional[typ.List[int]] = None,
+    ) -> None:
+        # NOTE (mb 2018-09-30): The module must not contain any of
+        #   prefilter.UNUSUAL_LINE_BREAKS, which the ast doesn't
+        #   count as line breaks.
+        self.module_source = module_source
+        self.offsets = line_offsets(module_source) if offsets is None else offsets
+        self.newline = prefilter.module_newline(module_source)
+
+        self._mark_linenos = []
+        self._changed_ids = set()
+        for node in changed_nodes:
+            lineno = getattr(node, "lineno", None)
+            if lineno is None:
+                raise SpliceError(f"Changed node without location: {node}")
+            self._mark_linenos.append(lineno)
+            self._changed_ids.add(id(node))
+        self._mark_linenos.sort()
+
+    def _lines(self, first: int, last: int) -> str:
+        return self.module_source[self.offsets[first - 1]:self.offsets[last]]
+
+    def _has_marks(self, first: int, last: int) -> bool:
+        index = bisect.bisect_left(self._mark_linenos, first)
+        return index < len(self._mark_linenos) and self._mark_linenos[index] <= last
+
+    def _end_lineno(self, stmt: ast.stmt) -> int:
+        end_lineno = getattr(stmt, "end_lineno", None)
+        if end_lineno is not None:
+            return end_lineno
+
+        # NOTE (mb 2018-09-30): Before python 3.8, the ast has no end
+        #   positions. Nodes that replace a statement only take over
+        #   its start, so the end is found in the source instead,
+        #   tokenizing the lines of the statement.
+        first = first_lineno(stmt)
+        col_offset = stmt.col_offset if first == stmt.lineno else 0
+        is_match = isinstance(stmt, getattr(ast, "Match", ()))
+        lines = (self._lines(lineno, lineno) for lineno in range(first, len(self.offsets)))
+        try:
+            tokens = tokenize.generate_tokens(lambda: next(lines, ""))
+            end_lineno = _stmt_end_lineno(tokens, col_offset, is_match)
+        except (tokenize.TokenError, SyntaxError) as ex:
+            raise SpliceError(f"Can't find the end of the statement on line {first}: {ex}")
+        if end_lineno is None:
+            raise SpliceError(f"Can't find the end of the statement on line {first}")
+        return end_lineno + first - 1
+
+    def _indent(self, lineno: int) -> str:
+        line = self._lines(lineno, lineno)
+        return line[:len(line) - len(line.lstrip(" \t"))]
+
+    def _generate(self, stmt: ast.stmt, indent: str, unit: str) -> str:
+        if not indent:
+            return stmt_source(stmt)
+        if unit and indent == unit * (len(indent) // len(unit)):
+            return stmt_source(stmt, unit, len(indent) // len(unit))
+        return stmt_source(stmt, indent, 1)
+
+    def _emit_def(self, stmt: ast.stmt, indent: str, unit: str) -> typ.Optional[str]:
+        located_body = [
+            body_stmt for body_stmt in stmt.body    # type: ignore
+            if getattr(body_stmt, "lineno", None) is not None
+        ]
+        if not located_body:
+            return None
+
+        first = first_lineno(stmt)
+        header_last = first_lineno(located_body[0]) - 1
+        if header_last < stmt.lineno:
+            # e.g. "def f(): pass"
+            return None
+
+        body_indent = self._indent(first_lineno(located_body[0]))
+        if len(body_indent) <= len(indent):
+            return None
+
+        # comments before the first statement belong to the body
+        while header_last > stmt.lineno:
+            line = self._lines(header_last, header_last).strip()
+            if line and not line.startswith("#"):
+                break
+            header_last -= 1
+
+        if self._has_marks(first, header_last):
+            header_stmt = copy.copy(stmt)
+            header_stmt.body = [ast.Pass()]    # type: ignore
+            header_source = self._generate(header_stmt, indent, unit)
+            # strip the "pass" line
+            header_source = header_source.rstrip("\n").rsplit("\n", 1)[0] + "\n"
+            header_source = prefilter.with_newline(header_source, self.newline)
+        else:
+            header_source = self._lines(first, header_last)
+
+        body_chunks = self._stmt_chunks(stmt.body, body_indent, unit or body_indent)    # type: ignore
+        builder = _SourceBuilder(self.module_source, self.offsets, header_last + 1, self.newline)
+        self._join_chunks(builder, body_chunks)
+        builder.copy_until(self._end_lineno(stmt))
+        return header_source + "".join(builder.parts)
+
+    def _stmt_chunk(self, stmt: ast.stmt, indent: str, unit: str, is_original: bool) -> Chunk:
+        span = (first_lineno(stmt), self._end_lineno(stmt))
+        if is_original and not self._has_marks(*span):
+            return Chunk(span, None)
+
+        source: typ.Optional[str] = None
+        if isinstance(stmt, _DEF_NODE_TYPES):
+            source = self._emit_def(stmt, indent, unit)
+        if source is None:
+            source = self._generate(stmt, indent, unit)
+        return Chunk(span, source)
+
+    def _stmt_chunks(self, stmts: typ.Sequence[ast.stmt], indent: str, unit: str) -> typ.List[Chunk]:
+        # NOTE (mb 2018-09-30): Below the module level, statements
+        #   without a location are the only ones added by fixers.
+        return [
+            self._stmt_chunk(stmt, indent, unit, id(stmt) not in self._changed_ids)
+            if getattr(stmt, "lineno", None) is not None else
+            Chunk(None, self._generate(stmt, indent, unit))
+            for stmt in stmts
+        ]
+
+    def _join_chunks(self, builder: _SourceBuilder, chunks: typ.Sequence[Chunk]) -> None:
+        prev_span: typ.Optional[typ.Tuple[int, int]] = None
+        prev_is_copied = True
+        added_sources: typ.List[str] = []
+
+        for chunk in chunks:
+            if chunk.span is None:
+                assert chunk.source is not None
+                added_sources.append(chunk.source)
+                continue
+
+            first, last = chunk.span
+            is_copied = chunk.source is None
+            if prev_span and first <= prev_span[1]:
+                # statements on the same line, e.g. "a = 1; b = 2"
+                if added_sources or not (is_copied and prev_is_copied):
+                    raise SpliceError(f"Can't separate statements on line {first}")
+
+            if added_sources:
+                builder.copy_until(first - 1 if prev_span is None else prev_span[1])
+                for added_source in added_sources:
+                    builder.append(added_source)
+                added_sources = []
+
+            if chunk.source is not None:
+                builder.copy_until(first - 1)
+                builder.append(chunk.source)
+                builder.skip_until(last)
+
+            prev_span = chunk.span
+            prev_is_copied = is_copied
+
+        if added_sources:
+            if prev_span is None:
+                raise SpliceError("No statement to add statements after")
+            builder.copy_until(prev_span[1])
+            for added_source in added_sources:
+                builder.append(added_source)
+
+    def module_chunks(
+        self, original_body: typ.Sequence[ast.stmt], fixed_body: typ.Sequence[ast.stmt]
+    ) -> typ.List[Chunk]:
+        """Chunks for the top-level statements of a fixed module.
+
+        Statements of fixed_body which neither are in original_body
+        nor replace one of its statements (such as imports added by
+        transpile) are added.
+        """
+        original_ids = {id(stmt) for stmt in original_body}
+        chunks: typ.List[Chunk] = []
+        positions: typ.List[typ.Tuple[int, int]] = []
+        for stmt in fixed_body:
+            is_original = id(stmt) in original_ids
+            if is_original or id(stmt) in self._changed_ids:
+                chunks.append(self._stmt_chunk(stmt, "", "", is_original))
+                positions.append((first_lineno(stmt), stmt.col_offset))
+            else:
+                chunks.append(Chunk(None, stmt_source(stmt)))
+
+        # fixers may replace statements, but not remove them
+        original_positions = [(first_lineno(stmt), stmt.col_offset) for stmt in original_body]
+        if positions != original_positions:
+            raise SpliceError("Statements were removed or reordered")
+        return chunks
+
+    def _header_line_count(self) -> int:
+        # same criteria as transpile.read_module_header
+        line_count = len(self.offsets) - 1
+        for lineno in range(1, line_count + 1):
+            line = self._lines(lineno, lineno).rstrip()
+            if line and not line.startswith("#"):
+                return lineno - 1
+        return line_count
+
+    def module_parts(self, header: str, chunks: typ.Sequence[Chunk]) -> typ.List[str]:
+        """The parts of the source of a module, replacing its header."""
+        header_line_count = self._header_line_count()
+        builder = _SourceBuilder(self.module_source, self.offsets, header_line_count + 1, self.newline)
+        self._join_chunks(builder, chunks)
+        builder.copy_until(None)
+        return [prefilter.with_newline(header, self.newline)] + builder.parts
+
+    def join_module_chunks(self, header: str, chunks: typ.Sequence[Chunk]) -> str:
+        """Generate the source of a module, replacing its header."""
+        return "".join(self.module_parts(header, chunks))
+
+
+def splice_module_parts(
+    module_source: str,
+    header: str,
+    original_body: typ.Sequence[ast.stmt],
+    fixed_body: typ.Sequence[ast.stmt],
+    changed_nodes: typ.Iterable[ast.AST],
+) -> typ.Optional[typ.List[str]]:
+    """Generate the source of a fixed module based on module_source.
+
+    The source is returned in parts, which are mostly slices of
+    module_source. Returns None if the fixed module can't be
+    spliced into the original source, in which case it has to
+    be regenerated.
+    """
+    if any(c in module_source for c in prefilter.UNUSUAL_LINE_BREAKS):
+        return None
+
+    try:
+        splicer = Splicer(module_source, changed_nodes)
+        chunks = splicer.module_chunks(original_body, fixed_body)
+        return splicer.module_parts(header, chunks)
+    except SpliceError:
+        return None
+
+
+def splice_module(
+    module_source: str,
+    header: str,
+    original_body: typ.Sequence[ast.stmt],
+    fixed_body: typ.Sequence[ast.stmt],
+    changed_nodes: typ.Iterable[ast.AST],
+) -> typ.Optional[str]:
+    parts = splice_module_parts(module_source, header, original_body, fixed_body, changed_nodes)
+    return None if parts is None else "".join(parts)
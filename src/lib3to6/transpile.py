@@ -7,13 +7,19 @@
 import re
 import ast
 import sys
-import astor
+import copy
+import types
+import codecs
 import typing as typ
+import collections
 
 from . import utils
 from . import common
+from . import codegen
 from . import fixers
+from . import splice
 from . import checkers
+from . import prefilter
 
 
 DEFAULT_SOURCE_ENCODING_DECLARATION = "# -*- coding: {} -*-"
@@ -31,7 +37,46 @@ SOURCE_ENCODING_RE = re.compile(r"""
 """, re.VERBOSE)
 
 
-def parse_module_header(module_source: typ.Union[bytes, str]) -> typ.Tuple[str, str]:
+# Headers are rarely longer than this, if they are, the scanned
+# prefix of the module is grown.
+HEADER_SCAN_SIZE = 4096
+
+
+class ModuleHeader(typ.NamedTuple):
+    coding: str
+    # the header for the fixed module, with a coding declaration
+    header: str
+    # the number of lines of the header of the original module
+    line_count: int
+
+
+def _iter_leading_lines(module_source: typ.AnyStr) -> typ.Iterable[typ.AnyStr]:
+    """The lines of module_source, as by splitlines().
+
+    Only as much of module_source is split as the lines which
+    are consumed require.
+    """
+    scan_size = HEADER_SCAN_SIZE
+    line_index = 0
+    while True:
+        is_complete = scan_size >= len(module_source)
+        lines = module_source[:scan_size].splitlines()
+        # the last line of a prefix may continue beyond it
+        complete_lines = lines if is_complete else lines[:-1]
+        while line_index < len(complete_lines):
+            yield complete_lines[line_index]
+            line_index += 1
+        if is_complete:
+            return
+        scan_size *= 4
+
+
+def read_module_header(module_source: typ.Union[bytes, str]) -> ModuleHeader:
+    """Parse the leading comment lines of a module.
+
+    Only the lines of the header are split and decoded, the
+    rest of the module isn't scanned.
+    """
     shebang = False
     coding_declared = False
     coding = DEFAULT_SOURCE_ENCODING
@@ -40,10 +85,13 @@ def parse_module_header(module_source: typ.Union[bytes, str]) -> typ.Tuple[str,
 
     # NOTE (mb 2018-06-23): Sneaky replacement of coding is done during
     #   consumption of the generator.
-    source_lines: typ.Iterable[str] = (
-        line.decode(coding, errors="ignore") if isinstance(line, bytes) else line
-        for line in module_source.splitlines()
-    )
+    source_lines: typ.Iterable[str]
+    if isinstance(module_source, bytes):
+        source_lines = (
+            line.decode(coding, errors="ignore") for line in _iter_leading_lines(module_source)
+        )
+    else:
+        source_lines = _iter_leading_lines(module_source)
 
     for i, line in enumerate(source_lines):
         if i < 2:
@@ -60,6 +108,7 @@ def parse_module_header(module_source: typ.Union[bytes, str]) -> typ.Tuple[str,
         else:
             break
 
+    line_count = len(header_lines)
     if not coding_declared:
         coding_declaration = DEFAULT_SOURCE_ENCODING_DECLARATION.format(coding)
         if shebang:
@@ -68,9 +117,27 @@ def parse_module_header(module_source: typ.Union[bytes, str]) -> typ.Tuple[str,
             header_lines.insert(0, coding_declaration)
 
     header = "\n".join(header_lines) + "\n"
+    return ModuleHeader(coding, header, line_count)
+
+
+def parse_module_header(module_source: typ.Union[bytes, str]) -> typ.Tuple[str, str]:
+    coding, header, _ = read_module_header(module_source)
     return coding, header
 
 
+def decode_module(module_source_data: bytes) -> typ.Tuple[str, ModuleHeader]:
+    """Decode a module according to its coding declaration.
+
+    The header is parsed from the decoded source, since str and
+    bytes don't split into lines the same way, but it keeps the
+    coding of the data.
+    """
+    coding = read_module_header(module_source_data).coding
+    module_source = module_source_data.decode(coding)
+    _, header, line_count = read_module_header(module_source)
+    return module_source, ModuleHeader(coding, header, line_count)
+
+
 CheckerType = typ.Type[checkers.CheckerBase]
 
 FixerType = typ.Type[fixers.FixerBase]
@@ -255,40 +322,441 @@ def add_module_declarations(tree: ast.Module, module_declarations: typ.Set[str])
         imports_end_offset += 1
 
 
-def transpile_module(cfg: common.BuildConfig, module_source: str) -> str:
+SelectedCheckers = typ.List[checkers.CheckerBase]
+SelectedFixers = typ.List[fixers.FixerBase]
+
+
+def transpile_prefiltered(
+    module_source: str,
+    scan: typ.Optional[prefilter.ModuleScan],
+    selected_checkers: SelectedCheckers,
+    selected_fixers: SelectedFixers,
+    module_header: ModuleHeader = None,
+) -> typ.Optional[str]:
+    if scan is None or not prefilter.can_copy_source(scan):
+        return None
+
+    future_names: typ.List[str] = []
+    for checker in selected_checkers:
+        if prefilter.is_triggered(checker.trigger_tokens, scan):
+            return None
+    for fixer in selected_fixers:
+        if prefilter.is_triggered(fixer.trigger_tokens, scan):
+            return None
+        if isinstance(fixer, fixers.FutureImportFixerBase):
+            future_names.append(fixer.future_name)
+
+    if module_header is None:
+        module_header = read_module_header(module_source)
+    return prefilter.splice_future_imports(
+        module_source, module_header.header, module_header.line_count, scan, future_names
+    )
+
+
+def select_checkers_and_fixers(
+    cfg: common.BuildConfig
+) -> typ.Tuple[SelectedCheckers, SelectedFixers]:
     checker_names: FuzzyNames = cfg.get("checkers", "")
     fixer_names: FuzzyNames = cfg.get("fixers", "")
-    module_tree = ast.parse(module_source)
-    required_imports: typ.Set[common.ImportDecl] = set()
-    module_declarations: typ.Set[str] = set()
 
     ver = sys.version_info
     src_version = f"{ver.major}.{ver.minor}"
     tgt_version = cfg.get("target_version", DEFAULT_TARGET_VERSION)
 
-    for checker in iter_fuzzy_selected_checkers(checker_names):
-        if checker.is_prohibited_for(tgt_version):
-            checker(cfg, module_tree)
+    selected_checkers = [
+        checker
+        for checker in iter_fuzzy_selected_checkers(checker_names)
+        if checker.is_prohibited_for(tgt_version)
+    ]
+    selected_fixers = [
+        fixer
+        for fixer in iter_fuzzy_selected_fixers(fixer_names)
+        if fixer.is_applicable_to(src_version, tgt_version)
+    ]
+    return selected_checkers, selected_fixers
+
+
+class FixedTree(typ.NamedTuple):
+    tree: ast.Module
+    required_imports: typ.Set[common.ImportDecl]
+    module_declarations: typ.Set[str]
+
+
+def apply_checkers_and_fixers(
+    cfg: common.BuildConfig,
+    module_tree: ast.Module,
+    selected_checkers: SelectedCheckers,
+    selected_fixers: SelectedFixers,
+) -> FixedTree:
+    """Check and fix a tree, without adding required imports."""
+    required_imports: typ.Set[common.ImportDecl] = set()
+    module_declarations: typ.Set[str] = set()
+
+    for checker in selected_checkers:
+        checker(cfg, module_tree)
+
+    for fixer in selected_fixers:
+        maybe_fixed_module = fixer(cfg, module_tree)
+        if maybe_fixed_module is None:
+            raise Exception(f"Error running fixer {type(fixer).__name__}")
+        required_imports.update(fixer.required_imports)
+        module_declarations.update(fixer.module_declarations)
+        module_tree = maybe_fixed_module
+
+    return FixedTree(module_tree, required_imports, module_declarations)
 
-    for fixer in iter_fuzzy_selected_fixers(fixer_names):
-        if fixer.is_applicable_to(src_version, tgt_version):
-            maybe_fixed_module = fixer(cfg, module_tree)
-            if maybe_fixed_module is None:
-                raise Exception(f"Error running fixer {type(fixer).__name__}")
-            required_imports.update(fixer.required_imports)
-            module_declarations.update(fixer.module_declarations)
-            module_tree = maybe_fixed_module
 
+def parse_module(module_source: typ.Union[str, bytes], filename: str = "<unknown>") -> ast.Module:
+    return ast.parse(module_source, filename)
+
+
+def _fix_module_tree(
+    cfg: common.BuildConfig,
+    module_tree: ast.Module,
+    selected_checkers: SelectedCheckers,
+    selected_fixers: SelectedFixers,
+) -> ast.Module:
+    module_tree, required_imports, module_declarations = apply_checkers_and_fixers(
+        cfg, module_tree, selected_checkers, selected_fixers
+    )
     if any(required_imports):
         add_required_imports(module_tree, required_imports)
     if any(module_declarations):
         add_module_declarations(module_tree, module_declarations)
-    coding, header = parse_module_header(module_source)
-    return header + "".join(astor.to_source(module_tree))
+    return module_tree
+
+
+def _write_module(
+    cfg: common.BuildConfig, module_source: str, module_header: ModuleHeader, write: codegen.Write
+) -> None:
+    selected_checkers, selected_fixers = select_checkers_and_fixers(cfg)
+
+    # NOTE (mb 2018-09-30): Modules which none of the fixers or
+    #   checkers apply to are neither parsed nor regenerated. As a
+    #   consequence, syntax errors in such modules aren't detected
+    #   until they are imported.
+    scan = prefilter.scan_module(module_source)
+    prefiltered_source = transpile_prefiltered(
+        module_source, scan, selected_checkers, selected_fixers, module_header
+    )
+    if prefiltered_source is not None:
+        write(prefiltered_source)
+        return
+
+    module_tree = parse_module(module_source)
+    original_body = list(module_tree.body)
+    module_tree = _fix_module_tree(cfg, module_tree, selected_checkers, selected_fixers)
+    changed_nodes = [node for fixer in selected_fixers for node in fixer.changed_nodes]
+    _write_fixed_module(
+        module_source, module_header, scan, original_body, module_tree, changed_nodes, write
+    )
+
+
+def _write_fixed_module(
+    module_source: str,
+    module_header: ModuleHeader,
+    scan: typ.Optional[prefilter.ModuleScan],
+    original_body: typ.Sequence[ast.stmt],
+    module_tree: ast.Module,
+    changed_nodes: typ.Sequence[ast.AST],
+    write: codegen.Write,
+) -> None:
+    header = module_header.header
+
+    # NOTE (mb 2018-09-30): Only statements which fixers have
+    #   changed (and added imports and declarations) are generated,
+    #   everything else is copied from the original source.
+    if prefilter.can_copy_source(scan):
+        spliced_parts = splice.splice_module_parts(
+            module_source, header, original_body, module_tree.body, changed_nodes
+        )
+        if spliced_parts is not None:
+            for part in spliced_parts:
+                write(part)
+            return
+
+    write(header)
+    codegen.write_source(module_tree, write)
+
+
+def transpile_module(
+    cfg: common.BuildConfig, module_source: str, module_header: ModuleHeader = None
+) -> str:
+    if module_header is None:
+        module_header = read_module_header(module_source)
+    parts: typ.List[str] = []
+    _write_module(cfg, module_source, module_header, parts.append)
+    return "".join(parts)
+
+
+class _FixerBranch(typ.NamedTuple):
+    # the targets which share the fixers applied so far
+    target_versions: typ.List[str]
+    tree: ast.Module
+    # the number of fixers applied so far
+    fixer_index: int
+    original_body: typ.List[ast.stmt]
+    required_imports: typ.Set[common.ImportDecl]
+    module_declarations: typ.Set[str]
+    changed_nodes: typ.List[ast.AST]
+
+
+def _copy_branch(branch: _FixerBranch, target_versions: typ.List[str]) -> _FixerBranch:
+    memo: typ.Dict[int, typ.Any] = {}
+    tree = copy.deepcopy(branch.tree, memo)
+    return _FixerBranch(
+        target_versions,
+        tree,
+        branch.fixer_index,
+        [memo.get(id(stmt), stmt) for stmt in branch.original_body],
+        set(branch.required_imports),
+        set(branch.module_declarations),
+        [memo.get(id(node), node) for node in branch.changed_nodes],
+    )
+
+
+def _fix_branches(
+    target_cfgs: typ.Dict[str, common.BuildConfig],
+    target_fixers: typ.Dict[str, SelectedFixers],
+    module_tree: ast.Module,
+) -> typ.Tuple[typ.List[_FixerBranch], typ.Dict[str, Exception]]:
+    # NOTE (mb 2018-09-30): The fixers of each target are applied in
+    #   their usual order. As long as the next fixer is the same for
+    #   several targets, it is applied once to a tree they share. Only
+    #   when their fixers diverge is the tree copied for each group.
+    branches = [_FixerBranch(
+        list(target_fixers), module_tree, 0, list(module_tree.body), set(), set(), []
+    )]
+    done_branches: typ.List[_FixerBranch] = []
+    errors: typ.Dict[str, Exception] = {}
+
+    while branches:
+        branch = branches.pop()
+        groups: typ.Dict[typ.Optional[type], typ.List[str]] = collections.OrderedDict()
+        for tgt_version in branch.target_versions:
+            selected_fixers = target_fixers[tgt_version]
+            if branch.fixer_index < len(selected_fixers):
+                next_fixer_type: typ.Optional[type] = type(selected_fixers[branch.fixer_index])
+            else:
+                next_fixer_type = None
+            groups.setdefault(next_fixer_type, []).append(tgt_version)
+
+        if len(groups) > 1:
+            group_versions = list(groups.values())
+            for target_versions in group_versions[:-1]:
+                branches.append(_copy_branch(branch, target_versions))
+            branches.append(branch._replace(target_versions=group_versions[-1]))
+            continue
+
+        if None in groups:
+            done_branches.append(branch)
+            continue
+
+        tgt_version = branch.target_versions[0]
+        fixer = target_fixers[tgt_version][branch.fixer_index]
+        try:
+            fixed_tree = fixer(target_cfgs[tgt_version], branch.tree)
+            if fixed_tree is None:
+                raise Exception(f"Error running fixer {type(fixer).__name__}")
+        except Exception as ex:
+            for failed_version in branch.target_versions:
+                errors[failed_version] = ex
+            continue
+
+        branch.required_imports.update(fixer.required_imports)
+        branch.module_declarations.update(fixer.module_declarations)
+        branch.changed_nodes.extend(fixer.changed_nodes)
+        branches.append(branch._replace(tree=fixed_tree, fixer_index=branch.fixer_index + 1))
+
+    return done_branches, errors
+
+
+# (fixed module source, error), one of which is None
+TargetResult = typ.Tuple[typ.Optional[str], typ.Optional[Exception]]
+
+# (fixed module source data, error), one of which is None
+TargetDataResult = typ.Tuple[typ.Optional[bytes], typ.Optional[Exception]]
+
+
+def _check_targets(
+    target_cfgs: typ.Dict[str, common.BuildConfig],
+    target_checkers: typ.Dict[str, SelectedCheckers],
+    module_tree: ast.Module,
+) -> typ.Dict[str, Exception]:
+    """Run the checkers of each target, returning errors by target.
+
+    Each checker class is only run once. If it fails, the error
+    applies to every target which selects it.
+    """
+    checker_errors: typ.Dict[type, typ.Optional[Exception]] = {}
+    target_errors: typ.Dict[str, Exception] = {}
+    for tgt_version, selected_checkers in target_checkers.items():
+        for checker in selected_checkers:
+            checker_type = type(checker)
+            if checker_type not in checker_errors:
+                try:
+                    checker(target_cfgs[tgt_version], module_tree)
+                    checker_errors[checker_type] = None
+                except Exception as ex:
+                    checker_errors[checker_type] = ex
+
+            error = checker_errors[checker_type]
+            if error is not None:
+                # as in transpile_module, the first error is reported
+                target_errors[tgt_version] = error
+                break
+    return target_errors
+
+
+def _write_branch(
+    module_source: str,
+    module_header: ModuleHeader,
+    scan: typ.Optional[prefilter.ModuleScan],
+    branch: _FixerBranch,
+) -> typ.Dict[str, TargetResult]:
+    if any(branch.required_imports):
+        add_required_imports(branch.tree, branch.required_imports)
+    if any(branch.module_declarations):
+        add_module_declarations(branch.tree, branch.module_declarations)
+
+    parts: typ.List[str] = []
+    try:
+        _write_fixed_module(
+            module_source,
+            module_header,
+            scan,
+            branch.original_body,
+            branch.tree,
+            branch.changed_nodes,
+            parts.append,
+        )
+        result: TargetResult = ("".join(parts), None)
+    except Exception as ex:
+        result = (None, ex)
+    return {tgt_version: result for tgt_version in branch.target_versions}
+
+
+def transpile_module_targets(
+    cfg: common.BuildConfig,
+    module_source: str,
+    target_versions: typ.Sequence[str],
+    module_header: ModuleHeader = None,
+) -> typ.Dict[str, TargetResult]:
+    """Transpile a module for each of target_versions.
+
+    The module is scanned, parsed and checked only once. Fixers
+    which the targets have in common (up to the first one where
+    their fixers diverge) are also applied only once. Errors of
+    checkers and fixers are returned for the targets they apply
+    to, errors that apply to every target (such as syntax errors)
+    are raised.
+    """
+    target_cfgs: typ.Dict[str, common.BuildConfig] = collections.OrderedDict()
+    for tgt_version in target_versions:
+        target_cfg = dict(cfg)
+        target_cfg["target_version"] = tgt_version
+        target_cfgs[tgt_version] = target_cfg
+
+    if module_header is None:
+        module_header = read_module_header(module_source)
+
+    results: typ.Dict[str, TargetResult] = {}
+    target_checkers: typ.Dict[str, SelectedCheckers] = collections.OrderedDict()
+    target_fixers: typ.Dict[str, SelectedFixers] = collections.OrderedDict()
+
+    scan = prefilter.scan_module(module_source)
+    for tgt_version, target_cfg in target_cfgs.items():
+        selected_checkers, selected_fixers = select_checkers_and_fixers(target_cfg)
+        prefiltered_source = transpile_prefiltered(
+            module_source, scan, selected_checkers, selected_fixers, module_header
+        )
+        if prefiltered_source is None:
+            target_checkers[tgt_version] = selected_checkers
+            target_fixers[tgt_version] = selected_fixers
+        else:
+            results[tgt_version] = (prefiltered_source, None)
+
+    if target_fixers:
+        module_tree = parse_module(module_source)
+
+        for tgt_version, error in _check_targets(target_cfgs, target_checkers, module_tree).items():
+            results[tgt_version] = (None, error)
+            del target_fixers[tgt_version]
+
+    if target_fixers:
+        branches, fixer_errors = _fix_branches(target_cfgs, target_fixers, module_tree)
+        for tgt_version, error in fixer_errors.items():
+            results[tgt_version] = (None, error)
+
+        for branch in branches:
+            results.update(_write_branch(module_source, module_header, scan, branch))
+
+    return {tgt_version: results[tgt_version] for tgt_version in target_cfgs}
+
+
+def transpile_module_data_targets(
+    cfg: common.BuildConfig, module_source_data: bytes, target_versions: typ.Sequence[str]
+) -> typ.Dict[str, TargetDataResult]:
+    module_source, module_header = decode_module(module_source_data)
+    results = transpile_module_targets(cfg, module_source, target_versions, module_header)
+    data_results: typ.Dict[str, TargetDataResult] = collections.OrderedDict()
+    for tgt_version, (fixed_module_source, error) in results.items():
+        if fixed_module_source is None:
+            data_results[tgt_version] = (None, error)
+        else:
+            data_results[tgt_version] = (fixed_module_source.encode(module_header.coding), None)
+    return data_results
+
+
+def _fix_missing_stmt_locations(module_tree: ast.Module) -> None:
+    # NOTE (mb 2018-09-30): Statements added to the module (such as
+    #   __future__ imports) would otherwise get line 1, which the
+    #   compiler rejects if that comes before a preceding statement.
+    prev_stmt: typ.Optional[ast.stmt] = None
+    for stmt in module_tree.body:
+        if prev_stmt and getattr(stmt, "lineno", None) is None:
+            ast.copy_location(stmt, prev_stmt)
+        prev_stmt = stmt
+
+
+def transpile_to_code(
+    cfg: common.BuildConfig, module_source: typ.Union[str, bytes], filename: str
+) -> types.CodeType:
+    """Transpile a module and compile it for the current interpreter.
+
+    The fixed tree is compiled directly, instead of generating
+    source for it and parsing that again. Nodes from the
+    original module keep their line numbers, nodes added by
+    fixers get those of their parents.
+    """
+    selected_checkers, selected_fixers = select_checkers_and_fixers(cfg)
+    module_tree = parse_module(module_source, filename)
+    module_tree = _fix_module_tree(cfg, module_tree, selected_checkers, selected_fixers)
+    _fix_missing_stmt_locations(module_tree)
+    ast.fix_missing_locations(module_tree)
+    return compile(module_tree, filename, "exec", dont_inherit=True)
 
 
 def transpile_module_data(cfg: common.BuildConfig, module_source_data: bytes) -> bytes:
-    coding, header = parse_module_header(module_source_data)
-    module_source = module_source_data.decode(coding)
-    fixed_module_source = transpile_module(cfg, module_source)
-    return fixed_module_source.encode(coding)
+    module_source, module_header = decode_module(module_source_data)
+    fixed_module_source = transpile_module(cfg, module_source, module_header)
+    return fixed_module_source.encode(module_header.coding)
+
+
+def transpile_to_file(
+    cfg: common.BuildConfig, module_source_data: bytes, fh: typ.BinaryIO
+) -> None:
+    """Transpile a module, writing the result to a binary file.
+
+    The result is encoded and written as it is generated, so
+    neither the fixed source nor its encoded data are held in
+    memory as a whole.
+    """
+    module_source, module_header = decode_module(module_source_data)
+    encoder = codecs.getincrementalencoder(module_header.coding)()
+
+    def write(text: str) -> None:
+        fh.write(encoder.encode(text))
+
+    _write_module(cfg, module_source, module_header, write)
+    fh.write(encoder.encode("", final=True))
@@ -5,8 +5,8 @@
 # SPDX-License-Identifier: MIT
 
 import ast
-import astor
 import typing as typ
+from . import codegen
 from . import transpile
 
 
@@ -109,7 +109,7 @@ def parsedump_ast(code: str, mode="exec", **kwargs) -> str:
 
 def parsedump_source(code: str, mode="exec") -> str:
     node = ast.parse(clean_whitespace(code), mode=mode)
-    return astor.to_source(node)
+    return codegen.to_source(node)
 
 
 def transpile_and_dump(module_str: str, cfg=None):
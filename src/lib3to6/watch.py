@@ -0,0 +1,133 @@
+# This file is part of the lib3to6 project
+# https://github.com/mbarkhau/lib3to6
+#
+# (C) 2018 Manuel Barkhau (@mbarkhau)
+# SPDX-License-Identifier: MIT
+
+import os
+import time
+import typing as typ
+
+from . import common
+from . import fileio
+from . import packaging
+from . import incremental
+
+
+DEFAULT_POLL_INTERVAL = 0.25
+
+# (st_mtime_ns, st_size)
+FileStat = typ.Tuple[int, int]
+
+
+class WatchedFile(typ.NamedTuple):
+    relpath: str
+    stat: FileStat
+    filehash: str
+
+
+class PollResult(typ.NamedTuple):
+    written: typ.List[str]
+    removed: typ.List[str]
+    errors: typ.List[typ.Tuple[str, str]]
+
+
+def _stat(path: str) -> typ.Optional[FileStat]:
+    try:
+        stat_result = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat_result.st_mtime_ns, stat_result.st_size)
+
+
+class Watcher:
+    """Keeps an output directory in sync with a set of sources.
+
+    All state lives in memory, so only the first poll transpiles
+    every module. Later polls only stat the source files and
+    transpile those which have actually changed, and of those
+    only the statements which have changed.
+    """
+
+    cfg: common.BuildConfig
+    sources: typ.Sequence[str]
+    output_dir: str
+    include_globs: typ.Sequence[str]
+    exclude_globs: typ.Sequence[str]
+
+    _files: typ.Dict[str, WatchedFile]
+    _transpiler: incremental.IncrementalTranspiler
+
+    def __init__(
+        self,
+        cfg: common.BuildConfig,
+        sources: typ.Sequence[str],
+        output_dir: str,
+        include_globs: typ.Sequence[str] = ("*.py",),
+        exclude_globs: typ.Sequence[str] = (),
+    ) -> None:
+        self.cfg = cfg
+        self.sources = sources
+        self.output_dir = output_dir
+        self.include_globs = include_globs
+        self.exclude_globs = exclude_globs
+        self._files = {}
+        self._transpiler = incremental.IncrementalTranspiler(cfg)
+
+    def _output_path(self, relpath: str) -> str:
+        return os.path.join(self.output_dir, relpath)
+
+    def _transpile(self, relpath: str, module_source_data: bytes) -> None:
+        fixed_module_source_data = self._transpiler.transpile_module_data(module_source_data)
+        output_path = self._output_path(relpath)
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+        fileio.write_atomic(output_path, fixed_module_source_data)
+
+    def poll(self) -> PollResult:
+        result = PollResult([], [], [])
+
+        source_paths = fileio.iter_source_paths(
+            self.sources, self.include_globs, self.exclude_globs
+        )
+        seen_paths: typ.Set[str] = set()
+        for path, relpath in source_paths:
+            stat = _stat(path)
+            if stat is None:
+                continue
+
+            seen_paths.add(path)
+            prev_file = self._files.get(path)
+            if prev_file and prev_file.stat == stat:
+                continue
+
+            module_source_data = fileio.read_file(path)
+            filehash = fileio.hash_data(module_source_data)
+            self._files[path] = WatchedFile(relpath, stat, filehash)
+            if prev_file and prev_file.filehash == filehash:
+                # only touched
+                continue
+
+            try:
+                self._transpile(relpath, module_source_data)
+                result.written.append(self._output_path(relpath))
+            except Exception as ex:
+                # NOTE (mb 2018-09-29): Retry on the next change,
+                #   not on every poll.
+                result.errors.append((path, packaging.error_message(ex)))
+
+        for path in sorted(set(self._files) - seen_paths):
+            output_path = self._output_path(self._files.pop(path).relpath)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+                result.removed.append(output_path)
+
+        return result
+
+    def run(
+        self,
+        on_result: typ.Callable[[PollResult], None],
+        interval: float = DEFAULT_POLL_INTERVAL,
+    ) -> None:
+        while True:
+            on_result(self.poll())
+            time.sleep(interval)
@@ -0,0 +1,118 @@
+import ast
+
+import pytest
+
+from lib3to6 import codegen
+from lib3to6 import utils
+
+
+ROUNDTRIP_FIXTURES = [
+    "x = (a + b) * c - d ** -e ** f",
+    "x = (-1) ** 2; y = -(1 ** 2); z = not (a and b) or c",
+    "x = a if b else (c if d else e); f = (lambda: 1) if g else lambda x, *y, z=1, **k: x",
+    "x = [*a, *b]; y = {**a, 'b': 1}; z = (1,); e = (); s = set(); t = {1, 2}",
+    "x[1:2, ::3]; x[1:2]; x[a, b]; x[()]; x[(a, b)]",
+    "(1).real; 1.0.real; a.b.c(d)(e)",
+    "x = yield; y = yield from z; await w",
+    "f(*args, x=1, **kwargs); f(a for a in b); g(x := 1)",
+    "[x for x in y if x if not x]; {k: v async for k, v in w}",
+    "if (n := len(a)) > 10:\n    pass",
+    "assert x, 'msg'; del a, b[0]; global c; raise E from e",
+    "from . import a; from ..b import c as d, e; import f.g as h",
+    "x: int = 1; (y): str; z.a: int",
+    "x += 1; y //= 2; z @= w",
+    "f'{a!r:>{width}} {{}} {b[\"key\"]}' f\"{'c'}\"",
+    "x = 'a\\nb'; y = b'\\x00'; z = u'c'",
+    "x = 1e309; y = 1e309j; z = 10 ** -2",
+    (
+        "@decorator(arg)\n"
+        "async def f(a, b=1, /, c=2, *, d, e: int = 3, **kw) -> typ.List[int]:\n"
+        "    async with a as b, c:\n"
+        "        async for x in y:\n"
+        "            return await x\n"
+    ),
+    (
+        "class A(B, metaclass=M):\n"
+        "    '''Doc with \"quotes\" and \\\\ backslash'''\n"
+        "    def f(self):\n"
+        "        pass\n"
+    ),
+    (
+        "try:\n    pass\nexcept (A, B) as e:\n    pass\nexcept:\n    pass\n"
+        "else:\n    pass\nfinally:\n    pass\n"
+    ),
+    "try:\n    pass\nexcept* A:\n    pass\n",
+    "if a:\n    pass\nelif b:\n    pass\nelse:\n    if c:\n        pass\n    d = 1\n",
+    "while a:\n    break\nelse:\n    continue\nfor (a, b) in c:\n    pass\nelse:\n    pass",
+    (
+        "match command.split():\n"
+        "    case [action, *rest] if rest:\n"
+        "        pass\n"
+        "    case {'a': 1, **others} | Point(x=0, y=-1 + 2j) as p:\n"
+        "        pass\n"
+        "    case None | _:\n"
+        "        pass\n"
+    ),
+]
+
+
+@pytest.mark.parametrize("source", ROUNDTRIP_FIXTURES)
+def test_roundtrip(source):
+    module = ast.parse(source)
+    assert ast.dump(ast.parse(codegen.to_source(module))) == ast.dump(module)
+
+
+def test_module_layout():
+    source = utils.clean_whitespace('''
+    """Module docstring."""
+    import os
+    def f(a):
+        """Function docstring."""
+        x = 1
+        def g():
+            pass
+        return x
+    class A:
+        pass
+    y = 2
+    ''')
+    assert codegen.to_source(ast.parse(source)) == "\n".join([
+        '"""Module docstring."""',
+        "import os",
+        "",
+        "",
+        "def f(a):",
+        '    """Function docstring."""',
+        "    x = 1",
+        "",
+        "    def g():",
+        "        pass",
+        "",
+        "    return x",
+        "",
+        "",
+        "class A:",
+        "    pass",
+        "",
+        "",
+        "y = 2",
+        "",
+    ])
+
+
+def test_indentation():
+    stmt = utils.parse_stmt("if a:\n    b = 1\n")
+    assert codegen.to_source(stmt, indent_with="\t", depth=2) == "\t\tif a:\n\t\t\tb = 1\n"
+
+
+def test_generated_nodes():
+    # nodes as created by fixers, rather than by the parser
+    call = ast.Call(
+        func=ast.Name(id="f", ctx=ast.Load()),
+        args=[ast.BinOp(left=ast.Num(n=1), op=ast.Add(), right=ast.Num(n=2))],
+        keywords=[],
+    )
+    binop = ast.BinOp(left=call, op=ast.Mult(), right=ast.Constant(value=-1))
+    assert codegen.to_source(binop) == "f(1 + 2) * -1"
+    power = ast.BinOp(left=ast.Constant(value=-1), op=ast.Pow(), right=ast.Constant(value=2))
+    assert codegen.to_source(power) == "(-1) ** 2"
@@ -0,0 +1,112 @@
+import pytest
+
+from lib3to6 import fileio
+
+
+def test_iter_files(tmp_path):
+    (tmp_path / "pkg" / "sub").mkdir(parents=True)
+    (tmp_path / "pkg" / "__pycache__").mkdir()
+    (tmp_path / "build").mkdir()
+    (tmp_path / "pkg" / "__init__.py").write_bytes(b"x = 1\n")
+    (tmp_path / "pkg" / "sub" / "mod.py").write_bytes(b"")
+    (tmp_path / "pkg" / "data.txt").write_bytes(b"")
+    (tmp_path / "pkg" / "__pycache__" / "cached.py").write_bytes(b"")
+    (tmp_path / "build" / "built.py").write_bytes(b"")
+    # only the exact names are ignored
+    (tmp_path / "pkg" / "rebuild").mkdir()
+    (tmp_path / "pkg" / "nodist").mkdir()
+    (tmp_path / "pkg" / "rebuild" / "mod.py").write_bytes(b"")
+    (tmp_path / "pkg" / "nodist" / "mod.py").write_bytes(b"")
+
+    files = sorted(fileio.iter_files(str(tmp_path)))
+    assert files == [
+        (str(tmp_path / "pkg" / "__init__.py"), 6),
+        (str(tmp_path / "pkg" / "nodist" / "mod.py"), 0),
+        (str(tmp_path / "pkg" / "rebuild" / "mod.py"), 0),
+        (str(tmp_path / "pkg" / "sub" / "mod.py"), 0),
+    ]
+
+
+def test_iter_files_symlink_loop(tmp_path):
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "mod.py").write_bytes(b"")
+    (tmp_path / "pkg" / "loop").symlink_to(tmp_path, target_is_directory=True)
+    (tmp_path / "pkg" / "link.py").symlink_to(tmp_path / "pkg" / "mod.py")
+
+    files = sorted(fileio.iter_files(str(tmp_path)))
+    assert files == [
+        (str(tmp_path / "pkg" / "link.py"), 0),
+        (str(tmp_path / "pkg" / "mod.py"), 0),
+    ]
+
+
+@pytest.mark.parametrize("mmap_threshold", [1, fileio.MMAP_THRESHOLD])
+def test_read_hashed(tmp_path, mmap_threshold):
+    reader = fileio.FileReader(mmap_threshold=mmap_threshold)
+    small_path = tmp_path / "small.py"
+    large_path = tmp_path / "large.py"
+    small_path.write_bytes(b"x = 1\n")
+    large_path.write_bytes(b"x = 2\n" * 100000)
+
+    for path in [small_path, large_path, small_path]:
+        data = path.read_bytes()
+        # a stale size hint must not truncate the data
+        filehash, read_data = reader.read_hashed(str(path), 1, lambda filehash: True)
+        assert filehash == fileio.hash_data(data)
+        assert read_data == data
+
+        filehash, read_data = reader.read_hashed(str(path), len(data), lambda filehash: False)
+        assert filehash == fileio.hash_data(data)
+        assert read_data is None
+
+
+def test_open_atomic(tmp_path):
+    path = tmp_path / "file.py"
+    path.write_bytes(b"old")
+
+    with pytest.raises(ValueError):
+        with fileio.open_atomic(str(path)) as fh:
+            fh.write(b"partial")
+            raise ValueError()
+
+    assert path.read_bytes() == b"old"
+    assert [p.name for p in tmp_path.iterdir()] == ["file.py"]
+
+    with fileio.open_atomic(str(path)) as fh:
+        fh.write(b"new")
+    assert path.read_bytes() == b"new"
+
+
+def test_make_private_dir(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache" / "lib3to6"
+    fileio.make_private_dir(str(cache_dir))
+    assert cache_dir.stat().st_mode & 0o777 == 0o700
+
+    cache_dir.chmod(0o777)
+    fileio.make_private_dir(str(cache_dir))
+    assert cache_dir.stat().st_mode & 0o777 == 0o700
+
+    # a directory of another user is never used
+    monkeypatch.setattr(fileio.os, "getuid", lambda: cache_dir.stat().st_uid + 1)
+    assert not fileio.is_owned(str(cache_dir))
+    with pytest.raises(OSError):
+        fileio.make_private_dir(str(cache_dir))
+
+
+def test_user_cache_dir(monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", "/home/user/.xdg_cache")
+    assert fileio.user_cache_dir() == "/home/user/.xdg_cache/lib3to6"
+    monkeypatch.delenv("XDG_CACHE_HOME")
+    monkeypatch.setenv("HOME", "/home/user")
+    assert fileio.user_cache_dir() == "/home/user/.cache/lib3to6"
+
+
+def test_ignore_tmp_files(tmp_path):
+    for dirname in ["build", "rebuild", "__pycache__"]:
+        (tmp_path / dirname).mkdir()
+    for filename in ["build.py", "mod.pyc"]:
+        (tmp_path / filename).write_bytes(b"")
+
+    names = sorted(path.name for path in tmp_path.iterdir())
+    ignored = fileio.ignore_tmp_files(str(tmp_path), names)
+    assert sorted(ignored) == ["__pycache__", "build", "mod.pyc"]
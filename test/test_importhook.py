@@ -0,0 +1,83 @@
+import sys
+import importlib.util
+
+import pytest
+
+from lib3to6 import packaging
+from lib3to6 import transpile
+from lib3to6 import importhook
+
+
+@pytest.fixture()
+def hook_package(tmp_path, monkeypatch):
+    package_dir = tmp_path / "hooked_pkg"
+    package_dir.mkdir()
+    (package_dir / "__init__.py").write_bytes(b"")
+    (package_dir / "mod.py").write_bytes(b"def hello(who: str) -> str:\n    return f'Hello {who}'\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+    cfg = packaging.eval_build_config(target_version="2.7")
+    finder = importhook.install_import_hook(cfg, ["hooked_pkg"], cache_dir=tmp_path / "cache")
+    yield tmp_path / "cache"
+    importhook.uninstall_import_hook(finder)
+    for module_name in ["hooked_pkg", "hooked_pkg.mod"]:
+        sys.modules.pop(module_name, None)
+
+
+def test_import_hook(hook_package, monkeypatch):
+    import hooked_pkg.mod
+
+    assert hooked_pkg.mod.hello("World") == "Hello World"
+    # added by the transpiled __future__ imports
+    assert hasattr(hooked_pkg.mod, "unicode_literals")
+    assert len(list(hook_package.iterdir())) == 2
+
+    def fail_transpile(cfg, module_source_data):
+        raise AssertionError("not cached")
+
+    monkeypatch.setattr(transpile, "transpile_module_data", fail_transpile)
+    del sys.modules["hooked_pkg.mod"]
+    import hooked_pkg.mod
+
+    assert hooked_pkg.mod.hello("Cache") == "Hello Cache"
+    assert hooked_pkg.mod.hello.__code__.co_filename == hooked_pkg.mod.__file__
+    assert hooked_pkg.mod.hello.__code__.co_firstlineno == 1
+
+
+def test_transpile_to_code():
+    cfg = packaging.eval_build_config(target_version="2.7")
+    source = "\n".join([
+        "import sys",
+        "def f(*, a=1):",
+        "    return sys._getframe().f_lineno + a",
+        "",
+    ])
+    code = transpile.transpile_to_code(cfg, source, "<test>")
+    module_globals = {}
+    exec(code, module_globals)
+    assert module_globals["f"](a=10) == 3 + 10
+    # the kw-only argument was inlined
+    assert module_globals["f"].__code__.co_kwonlyargcount == 0
+    assert "unicode_literals" in module_globals
+
+
+def test_import_hook_cache_validation(hook_package, tmp_path):
+    other_dir = tmp_path / "other"
+    other_dir.mkdir()
+    source_data = (tmp_path / "hooked_pkg" / "mod.py").read_bytes()
+    (other_dir / "mod.py").write_bytes(source_data)
+
+    cfg = packaging.eval_build_config(target_version="2.7")
+    module_path = str(tmp_path / "hooked_pkg" / "mod.py")
+    loader = importhook.Lib3to6Loader("hooked_pkg.mod", module_path, cfg, hook_package)
+    other_loader = importhook.Lib3to6Loader("mod", str(other_dir / "mod.py"), cfg, hook_package)
+    assert loader.get_code("hooked_pkg.mod").co_filename == loader.path
+    # the same source at another path is compiled with its own filename
+    assert other_loader.get_code("mod").co_filename == other_loader.path
+
+    # entries which don't match the source hash are not used
+    cache_path = loader._cache_path(source_data)
+    cache_path.write_bytes(b"invalid" + cache_path.read_bytes()[7:])
+    assert loader.get_code("hooked_pkg.mod").co_filename == loader.path
+    assert cache_path.read_bytes().startswith(importlib.util.MAGIC_NUMBER)
+    assert hook_package.stat().st_mode & 0o777 == 0o700
@@ -0,0 +1,106 @@
+import ast
+
+import pytest
+
+from lib3to6 import common
+from lib3to6 import transpile
+from lib3to6 import packaging
+from lib3to6 import incremental
+
+
+MODULE_SOURCE = '''
+"""Module docstring."""
+import typing as typ
+
+
+class Point(typ.NamedTuple):
+    x: int
+    y: int
+
+
+def f(a, *, b: int = 1) -> int:
+    return a + b
+
+
+c = 1; d = 2
+x = [*f(1), *f(2)]
+if __name__ == "__main__":
+    print(f(1, b=2))
+'''
+
+
+def test_same_output_as_transpile_module():
+    cfg = packaging.eval_build_config()
+    transpiler = incremental.IncrementalTranspiler(cfg)
+    assert transpiler.transpile_module(MODULE_SOURCE) == transpile.transpile_module(cfg, MODULE_SOURCE)
+
+
+def test_reuse_unchanged_statements(monkeypatch):
+    cfg = packaging.eval_build_config()
+    transpiler = incremental.IncrementalTranspiler(cfg)
+    transpiler.transpile_module(MODULE_SOURCE)
+
+    fixed_stmts = []
+    fix_stmt = transpiler._fix_stmt
+
+    def _fix_stmt(module_source, offsets, stmt, context_imports):
+        fixed_stmts.append(stmt)
+        return fix_stmt(module_source, offsets, stmt, context_imports)
+
+    monkeypatch.setattr(transpiler, "_fix_stmt", _fix_stmt)
+
+    changed_source = MODULE_SOURCE.replace("return a + b", "return a - b")
+    fixed_source = transpiler.transpile_module(changed_source)
+    assert fixed_source == transpile.transpile_module(cfg, changed_source)
+    assert [stmt.name for stmt in fixed_stmts] == ["f"]
+
+    # statements after a changed import are fixed in a new context
+    del fixed_stmts[:]
+    changed_source = changed_source.replace("import typing as typ", "import typing as typ_mod")
+    changed_source = changed_source.replace("(typ.NamedTuple)", "(typ_mod.NamedTuple)")
+    fixed_source = transpiler.transpile_module(changed_source)
+    assert fixed_source == transpile.transpile_module(cfg, changed_source)
+    assert "namedtuple" in fixed_source.lower()
+    # the key of a statement includes the line where the next one
+    # starts, so the docstring before the import is fixed again too
+    assert len(fixed_stmts) == len(ast.parse(changed_source).body)
+
+
+def test_without_end_positions(monkeypatch):
+    cfg = packaging.eval_build_config()
+    expected_source = transpile.transpile_module(cfg, MODULE_SOURCE)
+
+    def parse_module(*args):
+        # as parsed by python < 3.8
+        module_tree = ast.parse(MODULE_SOURCE)
+        for node in ast.walk(module_tree):
+            for attr in ("end_lineno", "end_col_offset"):
+                if attr in node._attributes:
+                    setattr(node, attr, None)
+        return module_tree
+
+    monkeypatch.setattr(transpile, "parse_module", parse_module)
+    transpiler = incremental.IncrementalTranspiler(cfg)
+    assert transpiler.transpile_module(MODULE_SOURCE) == expected_source
+    assert transpiler.transpile_module(MODULE_SOURCE) == expected_source
+
+
+def test_errors():
+    cfg = packaging.eval_build_config()
+    transpiler = incremental.IncrementalTranspiler(cfg)
+    with pytest.raises(common.CheckError):
+        transpiler.transpile_module("def f(list):\n    return list\n")
+
+
+def test_checkers_before_fixers():
+    cfg = packaging.eval_build_config()
+    transpiler = incremental.IncrementalTranspiler(cfg)
+    # the first statement fails a fixer, the second a checker
+    module_source = "def f(*, a=[]):\n    pass\n\n\ndef g(list):\n    return list\n"
+    with pytest.raises(common.CheckError):
+        transpile.transpile_module(cfg, module_source)
+    with pytest.raises(common.CheckError):
+        transpiler.transpile_module(module_source)
+
+    with pytest.raises(common.FixerError):
+        transpiler.transpile_module("def f(*, a=[]):\n    pass\n")
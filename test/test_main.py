@@ -0,0 +1,176 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from lib3to6 import transpile
+from lib3to6 import packaging
+from lib3to6 import __main__ as lib3to6_main
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(packaging, "CACHE_DIR", tmp_path / "cache")
+
+
+def _write_sources(tmp_path, sources):
+    paths = []
+    for filename, source in sources:
+        path = tmp_path / filename
+        path.write_text(source)
+        paths.append(str(path))
+    return paths
+
+
+def test_jobs_preserve_order_and_report_errors(tmp_path):
+    paths = _write_sources(tmp_path, [
+        ("first.py", "first: int = 1\n"),
+        ("bad.py", "def f(*, a=[]):\n    pass\n"),
+        ("second.py", "second: int = 2\n"),
+    ])
+
+    result = CliRunner().invoke(lib3to6_main.main, ["--jobs", "2"] + paths)
+
+    assert result.exit_code == 1
+    assert result.output.index("first = 1") < result.output.index("second = 2")
+    assert "bad.py: FixerError: Keyword only arguments must be immutable" in result.output
+
+
+def test_directory_to_output_dir(tmp_path):
+    src_dir = tmp_path / "src"
+    (src_dir / "pkg" / "tests").mkdir(parents=True)
+    (src_dir / "pkg" / "__pycache__").mkdir()
+    (src_dir / "pkg" / "mod.py").write_text("x: int = 1\n")
+    (src_dir / "pkg" / "data.txt").write_text("x: int = 1\n")
+    (src_dir / "pkg" / "tests" / "test_mod.py").write_text("x: int = 1\n")
+    (src_dir / "pkg" / "__pycache__" / "cached.py").write_text("x: int = 1\n")
+    out_dir = tmp_path / "out"
+
+    args = ["--exclude", "tests", "-o", str(out_dir), str(src_dir)]
+    result = CliRunner().invoke(lib3to6_main.main, args)
+
+    assert result.exit_code == 0
+    out_paths = sorted(str(path.relative_to(out_dir)) for path in out_dir.rglob("*.*"))
+    assert out_paths == ["pkg/mod.py"]
+    assert (out_dir / "pkg" / "mod.py").read_text().endswith("\nx = 1\n")
+    assert (src_dir / "pkg" / "mod.py").read_text() == "x: int = 1\n"
+
+
+def test_stdin_source(tmp_path):
+    result = CliRunner().invoke(lib3to6_main.main, ["-"], input="x: int = 1\n")
+    assert result.exit_code == 0
+    assert result.output.endswith("\nx = 1\n\n")
+
+    # sources from stdin are never written to the output directory
+    out_dir = tmp_path / "out"
+    result = CliRunner().invoke(lib3to6_main.main, ["-o", str(out_dir), "-"], input="x: int = 1\n")
+    assert result.exit_code == 0
+    assert result.output.endswith("\nx = 1\n\n")
+    assert not out_dir.exists()
+
+
+def test_batch(tmp_path):
+    (path, ) = _write_sources(tmp_path, [("mod.py", "x: int = 1\n")])
+    requests = [
+        {"id": 1, "path": path},
+        {"id": 2, "source": "y: int = 2\n", "target_version": "3.4"},
+        {"id": 3, "path": str(tmp_path / "missing.py")},
+    ]
+    batch_input = "".join(json.dumps(request) + "\n" for request in requests)
+
+    result = CliRunner().invoke(lib3to6_main.main, ["--batch"], input=batch_input)
+
+    assert result.exit_code == 0
+    responses = [json.loads(line) for line in result.output.splitlines()]
+    assert [response["id"] for response in responses] == [1, 2, 3]
+    assert responses[0]["fixed"].endswith("\nx = 1\n")
+    assert "from __future__" not in responses[1]["fixed"]
+    assert responses[2]["error"].startswith("Invalid request: FileNotFoundError")
+    assert all(response["duration"] >= 0 for response in responses)
+
+
+def test_check_and_diff(tmp_path, monkeypatch):
+    paths = _write_sources(tmp_path, [
+        ("changed.py", "x: int = 1\n"),
+        ("unchanged.py", "# -*- coding: utf-8 -*-\nx = 1\n"),
+    ])
+
+    transpiled_datas = []
+    transpile_module_data = transpile.transpile_module_data
+
+    def counting_transpile(cfg, module_source_data):
+        transpiled_datas.append(module_source_data)
+        return transpile_module_data(cfg, module_source_data)
+
+    monkeypatch.setattr(transpile, "transpile_module_data", counting_transpile)
+
+    for _ in range(2):
+        result = CliRunner().invoke(lib3to6_main.main, ["--check", "--target-version", "3.4"] + paths)
+        assert result.exit_code == 1
+        assert result.output == paths[0] + "\n"
+        # the second run is answered from the cache
+        assert len(transpiled_datas) == 2
+
+    no_cache_args = ["--check", "--no-cache", "--target-version", "3.4"]
+    result = CliRunner().invoke(lib3to6_main.main, no_cache_args + paths)
+    assert result.output == paths[0] + "\n"
+    assert len(transpiled_datas) == 4
+
+    result = CliRunner().invoke(lib3to6_main.main, ["--diff", "--target-version", "3.4"] + paths)
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        f"--- {paths[0]}",
+        f"+++ {paths[0]}",
+        "@@ -1 +1,2 @@",
+        "-x: int = 1",
+        "+# -*- coding: utf-8 -*-",
+        "+x = 1",
+    ]
+
+
+def test_several_target_versions(tmp_path):
+    (path, ) = _write_sources(tmp_path, [("mod.py", "def f(a, *, b=1):\n    return [*a]\n")])
+    out_dir = tmp_path / "out"
+
+    args = ["--target-version", "2.7,3.5,3.6", "-o", str(out_dir), path]
+    result = CliRunner().invoke(lib3to6_main.main, args)
+    assert result.exit_code == 0
+
+    assert "kwargs" in (out_dir / "2.7" / "mod.py").read_text()
+    assert "*, b=1" not in (out_dir / "3.5" / "mod.py").read_text()
+    assert (out_dir / "3.6" / "mod.py").read_text().endswith("return [*a]\n")
+
+    result = CliRunner().invoke(lib3to6_main.main, ["--target-version", "2.7,3.5", path])
+    assert result.exit_code == 2
+    assert "require --output" in result.output
+
+
+def test_several_target_versions_errors(tmp_path):
+    module_source = "with open('a', encoding='utf-8') as fh:\n    pass\n"
+    (path, ) = _write_sources(tmp_path, [("mod.py", module_source)])
+    out_dir = tmp_path / "out"
+
+    args = ["--target-version", "2.7,3.6", "-o", str(out_dir), path]
+    result = CliRunner().invoke(lib3to6_main.main, args)
+    assert result.exit_code == 1
+    assert "(target version 2.7)" in result.output
+    assert not (out_dir / "2.7" / "mod.py").exists()
+    assert (out_dir / "3.6" / "mod.py").read_text().endswith(module_source)
+
+
+@pytest.mark.parametrize("args, func_name", [
+    (["--wheel", "in.whl", "--output", "out.whl"], "transpile_wheel"),
+    (["--wheel", "in.whl", "--dual"], "build_dual_wheels"),
+    (["--changed-since", "HEAD", "--output", "out"], "transpile_changed_modules"),
+])
+def test_jobs_passed_on(monkeypatch, args, func_name):
+    calls = []
+
+    def func(*args):
+        calls.append(args)
+        return [], []
+
+    monkeypatch.setattr(packaging, func_name, func)
+    result = CliRunner().invoke(lib3to6_main.main, ["--jobs", "3"] + args)
+    assert result.exit_code == 0
+    assert calls[0][-1] == 3
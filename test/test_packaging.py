@@ -0,0 +1,283 @@
+import os
+import pathlib
+import zipfile
+import threading
+import subprocess
+import importlib.util
+import concurrent.futures as cf
+
+import pytest
+
+import lib3to6
+from lib3to6 import fileio
+from lib3to6 import packaging
+
+
+WHEEL_MODULE_SOURCE = b"""
+def hello(who: str) -> None:
+    print(f"Hello {who}")
+"""
+
+
+def _write_test_wheel(wheel_path):
+    with zipfile.ZipFile(str(wheel_path), mode="w") as wheel:
+        wheel.writestr("my_module/__init__.py", WHEEL_MODULE_SOURCE)
+        wheel.writestr("my_module/data.txt", b"not python")
+        wheel.writestr("my_module-1.0.dist-info/WHEEL", b"Tag: py3-none-any\n")
+        wheel.writestr("my_module-1.0.dist-info/RECORD", b"stale\n")
+
+
+def test_transpile_wheel(tmp_path):
+    in_wheel_path = tmp_path / "my_module-1.0-py3-none-any.whl"
+    out_wheel_path = tmp_path / "my_module-1.0-py2.py3-none-any.whl"
+    _write_test_wheel(in_wheel_path)
+
+    cfg = packaging.eval_build_config()
+    packaging.transpile_wheel(cfg, str(in_wheel_path), str(out_wheel_path), jobs=1)
+
+    with zipfile.ZipFile(str(out_wheel_path)) as wheel:
+        names = wheel.namelist()
+        assert names[-1] == "my_module-1.0.dist-info/RECORD"
+        assert wheel.read("my_module/data.txt") == b"not python"
+
+        module_data = wheel.read("my_module/__init__.py")
+        assert b"from __future__ import" in module_data
+        assert b"'Hello {0}'.format(who)" in module_data
+
+        record_lines = wheel.read("my_module-1.0.dist-info/RECORD").decode("utf-8").splitlines()
+        record = {line.split(",")[0]: line for line in record_lines}
+        assert sorted(record) == sorted(names)
+        assert record["my_module-1.0.dist-info/RECORD"].endswith(",,")
+
+        module_digest = packaging._record_digest(module_data)
+        assert record["my_module/__init__.py"] == (
+            f"my_module/__init__.py,{module_digest},{len(module_data)}"
+        )
+
+
+def test_transpiled_python_tag(monkeypatch):
+    monkeypatch.setattr(packaging.sys, "version_info", (3, 7, 0))
+    assert packaging.native_python_tag() == "py37"
+    assert packaging.transpiled_python_tag("3.4") == "py34.py35.py36"
+    assert packaging.transpiled_python_tag("2.7") == "py2.py30.py31.py32.py33.py34.py35.py36"
+
+
+def test_build_dual_wheels(tmp_path):
+    native_wheel_path = tmp_path / "my_module-1.0-py3-none-any.whl"
+    _write_test_wheel(native_wheel_path)
+
+    cfg = packaging.eval_build_config(target_version="3.5")
+    native_path, transpiled_path = packaging.build_dual_wheels(
+        cfg, str(native_wheel_path), jobs=1
+    )
+
+    native_tag = packaging.native_python_tag()
+    assert native_path == str(tmp_path / f"my_module-1.0-{native_tag}-none-any.whl")
+    with zipfile.ZipFile(native_path) as wheel:
+        assert wheel.read("my_module/__init__.py") == WHEEL_MODULE_SOURCE
+        wheel_metadata = wheel.read("my_module-1.0.dist-info/WHEEL")
+        assert wheel_metadata == f"Tag: {native_tag}-none-any\n".encode("ascii")
+
+    with zipfile.ZipFile(transpiled_path) as wheel:
+        assert b"format(who)" in wheel.read("my_module/__init__.py")
+        wheel_metadata = wheel.read("my_module-1.0.dist-info/WHEEL").decode("ascii")
+        assert wheel_metadata.splitlines()[0] == "Tag: py35-none-any"
+
+    # the untranspiled input is not left next to the outputs
+    assert sorted(tmp_path.iterdir()) == sorted([pathlib.Path(native_path), pathlib.Path(transpiled_path)])
+
+
+def test_build_dual_wheels_dist_dir(tmp_path):
+    native_wheel_path = tmp_path / "my_module-1.0-py3-none-any.whl"
+    _write_test_wheel(native_wheel_path)
+    dist_dir = tmp_path / "dist"
+    dist_dir.mkdir()
+
+    cfg = packaging.eval_build_config(target_version="3.5")
+    out_paths = packaging.build_dual_wheels(cfg, str(native_wheel_path), str(dist_dir), jobs=1)
+    assert native_wheel_path.exists()
+    assert sorted(dist_dir.iterdir()) == sorted(pathlib.Path(path) for path in out_paths)
+
+
+def test_precompile_modules(tmp_path, monkeypatch):
+    monkeypatch.setattr(packaging, "CACHE_DIR", tmp_path / "cache")
+    module_path = tmp_path / "module.py"
+    module_path.write_bytes(b"x = 1\n")
+
+    cfg = packaging.eval_build_config()
+    module_hashes = {str(module_path): "0123abcd"}
+    packaging.precompile_modules(cfg, module_hashes, jobs=1)
+
+    pyc_path = importlib.util.cache_from_source(str(module_path))
+    assert os.path.exists(pyc_path)
+    if packaging.HAS_HASH_BASED_PYC:
+        cache_dir = packaging.build_cache_dir(cfg)
+        cached_pyc_path = packaging._pyc_cache_path(cache_dir, "0123abcd")
+        assert cached_pyc_path.read_bytes() == pathlib.Path(pyc_path).read_bytes()
+
+
+def test_build_output_dir():
+    cfg_27 = packaging.eval_build_config(target_version="2.7")
+    cfg_34 = packaging.eval_build_config(target_version="3.4")
+    output_dir_27 = packaging.build_output_dir(cfg_27)
+    output_dir_34 = packaging.build_output_dir(cfg_34)
+    assert output_dir_27 != output_dir_34
+    assert output_dir_27.name.startswith("py27_")
+    assert output_dir_34.name.startswith("py34_")
+
+    # options which don't change the output don't change the fingerprint
+    cfg_27_precompiled = packaging.eval_build_config(target_version="2.7", precompile="1")
+    assert packaging.build_output_dir(cfg_27_precompiled) == output_dir_27
+
+    explicit_cfg = packaging.eval_build_config(output_dir="build/custom")
+    assert str(packaging.build_output_dir(explicit_cfg)) == "build/custom"
+
+
+def test_config_fingerprint(monkeypatch):
+    cfg = packaging.eval_build_config()
+    fingerprint = packaging.config_fingerprint(cfg)
+    # the output of a different version may differ
+    monkeypatch.setattr(lib3to6, "__version__", "v999999.0001")
+    assert packaging.config_fingerprint(cfg) != fingerprint
+
+
+def test_iter_cached_transpiled_data(tmp_path, monkeypatch):
+    monkeypatch.setattr(packaging, "CACHE_DIR", tmp_path / "cache")
+    module_source_data = b"x: int = 1\n"
+
+    def transpile_cached(cfg):
+        (result, ) = packaging.iter_cached_transpiled_data(cfg, [module_source_data], jobs=1)
+        return result
+
+    cfg = packaging.eval_build_config(force_transpile="0")
+    fixed_data, error = transpile_cached(cfg)
+    assert error is None
+    assert fixed_data.endswith(b"\nx = 1\n")
+
+    cache_path = packaging.build_cache_dir(cfg) / (fileio.hash_data(module_source_data) + ".py")
+    cache_path.write_bytes(b"cached\n")
+    assert transpile_cached(cfg) == (b"cached\n", None)
+
+    forced_cfg = packaging.eval_build_config(force_transpile="1")
+    assert transpile_cached(forced_cfg) == (fixed_data, None)
+
+
+def _git(*args):
+    subprocess.check_call(("git",) + args, stdout=subprocess.DEVNULL)
+
+
+def test_transpile_changed_modules(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _git("init", "-q")
+    _git("config", "user.email", "test@example.com")
+    _git("config", "user.name", "test")
+
+    pathlib.Path("pkg").mkdir()
+    pathlib.Path("pkg/unchanged.py").write_bytes(b"x = 1\n")
+    pathlib.Path("pkg/modified.py").write_bytes(b"x = 1\n")
+    pathlib.Path("pkg/deleted.py").write_bytes(b"x = 1\n")
+    _git("add", "pkg")
+    _git("commit", "-q", "-m", "initial")
+
+    pathlib.Path("pkg/modified.py").write_bytes(b"x: int = 2\n")
+    pathlib.Path("pkg/added.py").write_bytes(b"y: int = 3\n")
+    pathlib.Path("pkg/deleted.py").unlink()
+
+    output_dir = tmp_path / "out"
+    (output_dir / "pkg").mkdir(parents=True)
+    (output_dir / "pkg" / "deleted.py").write_bytes(b"x = 1\n")
+
+    cfg = packaging.eval_build_config()
+    written_paths, removed_paths = packaging.transpile_changed_modules(
+        cfg, "HEAD", str(output_dir), jobs=1
+    )
+    assert sorted(written_paths) == [
+        str(output_dir / "pkg" / "added.py"),
+        str(output_dir / "pkg" / "modified.py"),
+    ]
+    assert removed_paths == [str(output_dir / "pkg" / "deleted.py")]
+    assert not (output_dir / "pkg" / "unchanged.py").exists()
+    assert b"x = 2" in (output_dir / "pkg" / "modified.py").read_bytes()
+
+
+def test_iter_threaded():
+    assert list(packaging._iter_threaded(range(100), maxsize=2)) == list(range(100))
+
+    def failing_items():
+        yield 1
+        raise ValueError("stage failed")
+
+    with pytest.raises(ValueError, match="stage failed"):
+        list(packaging._iter_threaded(failing_items()))
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_build_package(tmp_path, monkeypatch, jobs):
+    monkeypatch.setattr(packaging, "CACHE_DIR", tmp_path / "cache")
+    build_dir = tmp_path / "build"
+    (build_dir / "pkg").mkdir(parents=True)
+    for i in range(20):
+        (build_dir / "pkg" / f"mod{i}.py").write_bytes(f"x: int = {i}\n".encode("ascii"))
+    (build_dir / "pkg" / "data.txt").write_bytes(b"x: int = 1\n")
+
+    cfg = packaging.eval_build_config(force_transpile="0")
+    module_hashes = packaging.build_packages(cfg, {"pkg": str(build_dir)}, jobs=jobs)
+    assert len(module_hashes) == 20
+    for i in range(20):
+        fixed_module_data = (build_dir / "pkg" / f"mod{i}.py").read_bytes()
+        assert fixed_module_data.endswith(f"\nx = {i}\n".encode("ascii"))
+    assert (build_dir / "pkg" / "data.txt").read_bytes() == b"x: int = 1\n"
+
+
+def test_build_package_pool_thread(tmp_path, monkeypatch):
+    monkeypatch.setattr(packaging, "CACHE_DIR", tmp_path / "cache")
+    build_dir = tmp_path / "build"
+    (build_dir / "pkg").mkdir(parents=True)
+    for i in range(4):
+        (build_dir / "pkg" / f"mod{i}.py").write_bytes(f"x: int = {i}\n".encode("ascii"))
+
+    thread_count = threading.active_count()
+    submit_thread_counts = []
+
+    class _Executor(cf.ProcessPoolExecutor):
+
+        def submit(self, *args, **kwargs):
+            submit_thread_counts.append((threading.current_thread(), threading.active_count()))
+            return super().submit(*args, **kwargs)
+
+    monkeypatch.setattr(packaging.cf, "ProcessPoolExecutor", _Executor)
+    cfg = packaging.eval_build_config()
+    assert len(packaging.build_packages(cfg, {"pkg": str(build_dir)}, jobs=2)) == 4
+    # workers are forked by the first submit, before other threads are started
+    assert submit_thread_counts[0] == (threading.main_thread(), thread_count)
+    assert all(thread is threading.main_thread() for thread, _ in submit_thread_counts)
+
+
+def test_schedule_module_files():
+    module_files = [("small.py", 10), ("medium.py", 100), ("large.py", 1000), ("slow.py", 10)]
+
+    # without history, the largest modules are scheduled first
+    scheduled = packaging._schedule_module_files(module_files, {})
+    assert [path for path, _ in scheduled][:2] == ["large.py", "medium.py"]
+
+    # a small module which was slow last time is scheduled first,
+    # unknown modules are estimated using the average rate (~5ms/byte)
+    durations = {"slow.py": 5.0, "large.py": 0.1}
+    scheduled = packaging._schedule_module_files(module_files, durations)
+    assert [path for path, _ in scheduled] == ["slow.py", "medium.py", "large.py", "small.py"]
+
+
+def test_build_manifest(tmp_path, monkeypatch):
+    monkeypatch.setattr(packaging, "CACHE_DIR", tmp_path / "cache")
+    build_dir = tmp_path / "build"
+    build_dir.mkdir()
+    (build_dir / "mod.py").write_bytes(b"x: int = 1\n")
+    manifest_path = tmp_path / "manifest.json"
+
+    cfg = packaging.eval_build_config()
+    packaging.build_packages(cfg, {"": str(build_dir)}, jobs=1, manifest_path=manifest_path)
+
+    manifest = packaging.read_build_manifest(manifest_path)
+    module_info = manifest["modules"][str(build_dir / "mod.py")]
+    assert len(module_info["hash"]) == 40
+    assert module_info["duration"] > 0
@@ -0,0 +1,94 @@
+import ast
+
+import pytest
+
+from lib3to6 import prefilter
+from lib3to6 import transpile
+from lib3to6.utils import clean_whitespace
+
+
+@pytest.mark.parametrize("source, pseudo_token", [
+    ("x: int = 1", prefilter.ANNOTATION),
+    ("if x: y: int = 1", prefilter.ANNOTATION),
+    ("def f(a: int): pass", prefilter.ANNOTATION),
+    ("def f(a) -> int: pass", prefilter.ANNOTATION),
+    ("def f(*, a): pass", prefilter.KWONLY_ARGS),
+    ("x = f'{y}'", prefilter.FSTRING),
+    ("x = 1_000", prefilter.REQUIRES_CODEGEN),
+    ("from os import *", prefilter.STAR_IMPORT),
+    ("str = 1", prefilter.BUILTIN_BINDING),
+    ("def open(): pass", prefilter.BUILTIN_BINDING),
+    ("def f(str): pass", prefilter.BUILTIN_BINDING),
+    ("for i, str in x: pass", prefilter.BUILTIN_BINDING),
+    ("x = [1 for str in y]", prefilter.BUILTIN_BINDING),
+    ("f(lambda str: str)", prefilter.BUILTIN_BINDING),
+    ("f((str := 1))", prefilter.BUILTIN_BINDING),
+    ("from x import open", prefilter.BUILTIN_BINDING),
+])
+def test_scan_positive(source, pseudo_token):
+    assert pseudo_token in prefilter.scan_module(source).tokens
+
+
+@pytest.mark.parametrize("source, pseudo_token", [
+    ("x = {1: 2}[1:2]", prefilter.ANNOTATION),
+    ("if x: y = lambda a: a", prefilter.ANNOTATION),
+    ("def f(a, b=lambda c: c): pass", prefilter.ANNOTATION),
+    ("def f(a, **kw): pass", prefilter.KWONLY_ARGS),
+    ("x = 2 * 3", prefilter.STAR_IMPORT),
+    ("isinstance(x, str)", prefilter.BUILTIN_BINDING),
+    ("x = str(y).join(z)", prefilter.BUILTIN_BINDING),
+    ("f(key=len)", prefilter.BUILTIN_BINDING),
+    ("class A(object): pass", prefilter.BUILTIN_BINDING),
+    ("try: pass\nexcept (ValueError, TypeError): pass", prefilter.BUILTIN_BINDING),
+    ("raise StopIteration", prefilter.BUILTIN_BINDING),
+])
+def test_scan_negative(source, pseudo_token):
+    assert pseudo_token not in prefilter.scan_module(source).tokens
+
+
+def test_prefiltered_transpile():
+    source = clean_whitespace('''
+    #!/usr/bin/env python
+    """Module docstring."""
+    import os  # comment is preserved
+
+    x = os.sep
+    ''')
+    expected_source = clean_whitespace('''
+    #!/usr/bin/env python
+    # -*- coding: utf-8 -*-
+    """Module docstring."""
+    from __future__ import absolute_import
+    from __future__ import division
+    from __future__ import print_function
+    from __future__ import unicode_literals
+    import os  # comment is preserved
+
+    x = os.sep
+    ''')
+    result_source = transpile.transpile_module({"target_version": "2.7"}, source)
+    assert result_source == expected_source
+
+    crlf_source = source.replace("\n", "\r\n")
+    result_source = transpile.transpile_module({"target_version": "2.7"}, crlf_source)
+    assert result_source == expected_source.replace("\n", "\r\n")
+
+
+def test_prefiltered_existing_future_import():
+    source = "from __future__ import division, print_function\nx = 1\n"
+    result_source = transpile.transpile_module({"target_version": "2.7"}, source)
+    assert result_source.endswith(
+        "from __future__ import division, print_function\n"
+        "from __future__ import absolute_import\n"
+        "from __future__ import unicode_literals\n"
+        "x = 1\n"
+    )
+
+
+def test_unscannable_modules_are_parsed():
+    assert prefilter.scan_module("x = (1,\n") is None
+    assert prefilter.scan_module("x = 1\x0cy = 2\n") is None
+
+    result_source = transpile.transpile_module({"target_version": "3.4"}, "x = 1_000\n")
+    assert ast.dump(ast.parse(result_source)) == ast.dump(ast.parse("x = 1000"))
+    assert "1_000" not in result_source
@@ -0,0 +1,75 @@
+import json
+import threading
+
+import pytest
+
+from lib3to6 import fileio
+from lib3to6 import server
+from lib3to6 import packaging
+
+
+def test_service_handle_line():
+    service = server.TranspileService()
+    request = {"cfg": {"target_version": "3.4"}, "source": "x: int = 1\n"}
+    response = json.loads(service.handle_line(json.dumps(request).encode("utf-8")))
+    assert response["error"] is None
+    assert response["fixed"].endswith("\nx = 1\n")
+
+    response = json.loads(service.handle_line(b"{not json"))
+    assert response["fixed"] is None
+    assert response["error"].startswith("Invalid request")
+
+
+def test_daemon_and_fallback(tmp_path):
+    socket_path = str(tmp_path / "lib3to6.sock")
+    cfg = packaging.eval_build_config()
+    sources = ["x: int = 1\n", "def f(*, a=[]):\n    pass\n"]
+
+    # no daemon running, transpiled in process
+    fallback_results = list(server.iter_transpiled_sources(cfg, sources, socket_path, jobs=1))
+
+    daemon = server.make_server(socket_path)
+    daemon_thread = threading.Thread(target=daemon.serve_forever)
+    daemon_thread.start()
+    try:
+        daemon_results = list(server.iter_transpiled_sources(cfg, sources, socket_path))
+    finally:
+        daemon.shutdown()
+        daemon.server_close()
+        daemon_thread.join()
+
+    assert [fixed for fixed, _ in daemon_results] == [fixed for fixed, _ in fallback_results]
+    assert daemon_results[0][0].endswith("\nx = 1\n")
+    assert daemon_results[1][1].startswith("FixerError")
+    assert fallback_results[1][1].startswith("FixerError")
+
+
+def test_foreign_socket(tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "lib3to6.sock")
+    daemon = server.make_server(socket_path)
+    try:
+        client = server.connect(socket_path)
+        assert client is not None
+        client.close()
+
+        # sockets of other users are neither used nor removed
+        monkeypatch.setattr(fileio, "is_owned", lambda path: False)
+        assert server.connect(socket_path) is None
+        with pytest.raises(PermissionError):
+            server.make_server(socket_path)
+    finally:
+        daemon.server_close()
+
+    not_a_socket = tmp_path / "file.sock"
+    not_a_socket.write_bytes(b"")
+    with pytest.raises(OSError):
+        server.make_server(str(not_a_socket))
+    assert not_a_socket.exists()
+
+
+def test_default_socket_dir(tmp_path, monkeypatch):
+    socket_path = str(tmp_path / "cache" / "lib3to6" / "daemon.sock")
+    monkeypatch.setattr(server, "DEFAULT_SOCKET_PATH", socket_path)
+    daemon = server.make_server(socket_path)
+    daemon.server_close()
+    assert (tmp_path / "cache" / "lib3to6").stat().st_mode & 0o777 == 0o700
@@ -0,0 +1,182 @@
+import ast
+
+from lib3to6 import splice
+from lib3to6 import transpile
+from lib3to6 import packaging
+from lib3to6.utils import clean_whitespace
+
+
+def test_unchanged_module_is_copied():
+    cfg = packaging.eval_build_config()
+    module_source = clean_whitespace('''
+    #!/usr/bin/env python
+    """Module docstring."""
+    import os  # comment
+
+    # unchanged by fixers, only declarations are added
+    paths = list(map(os.path.join, ["a"], ["b"]))
+    ''')
+    fixed_source = transpile.transpile_module(cfg, module_source)
+    assert fixed_source == clean_whitespace('''
+    #!/usr/bin/env python
+    # -*- coding: utf-8 -*-
+    """Module docstring."""
+    from __future__ import absolute_import
+    from __future__ import division
+    from __future__ import print_function
+    from __future__ import unicode_literals
+    import os  # comment
+    import itertools
+    map = getattr(itertools, 'imap', map)
+
+    # unchanged by fixers, only declarations are added
+    paths = list(map(os.path.join, ["a"], ["b"]))
+    ''')
+
+
+def test_changed_module_is_regenerated():
+    cfg = packaging.eval_build_config()
+    module_source = "class A:  # comment\n    pass\n"
+    fixed_source = transpile.transpile_module(cfg, module_source)
+    assert "# comment" not in fixed_source
+    assert "class A(object):" in fixed_source
+
+
+def test_only_changed_header_is_regenerated():
+    cfg = packaging.eval_build_config()
+    module_source = clean_whitespace("""
+    class A(object):
+        def f(self, a: int) -> int:
+            # comment in body
+            return a  # trailing comment
+        def g(self):  # unchanged
+            return 1
+    """)
+    fixed_source = transpile.transpile_module(cfg, module_source)
+    assert fixed_source.endswith(clean_whitespace("""
+    class A(object):
+        def f(self, a):
+            # comment in body
+            return a  # trailing comment
+        def g(self):  # unchanged
+            return 1
+    """))
+
+
+def test_splice_module():
+    module_source = "x = 1\n\ny = 2\n"
+    module_tree = ast.parse(module_source)
+    original_body = list(module_tree.body)
+    inserted_stmt = ast.parse("import os").body[0]
+
+    fixed_body = [original_body[0], inserted_stmt, original_body[1]]
+    spliced_source = splice.splice_module(module_source, "", original_body, fixed_body, [])
+    assert spliced_source == "x = 1\nimport os\n\ny = 2\n"
+
+    fixed_body = original_body + [inserted_stmt]
+    spliced_source = splice.splice_module("x = 1\n\ny = 2", "", original_body, fixed_body, [])
+    assert spliced_source == "x = 1\n\ny = 2\nimport os\n"
+
+    # changed statements are regenerated
+    original_body[1].value = ast.Constant(value=3)
+    changed_nodes = [ast.copy_location(original_body[1].value, original_body[1])]
+    spliced_source = splice.splice_module(module_source, "", original_body, original_body, changed_nodes)
+    assert spliced_source == "x = 1\n\ny = 3\n"
+
+    # the original statements must all be kept
+    spliced_source = splice.splice_module(module_source, "", original_body, original_body[:1], [])
+    assert spliced_source is None
+
+    # statements on the same line can't be separated
+    module_source = "x = 1; y = 2\n"
+    original_body = ast.parse(module_source).body
+    fixed_body = [original_body[0], inserted_stmt, original_body[1]]
+    assert splice.splice_module(module_source, "", original_body, fixed_body, []) is None
+
+
+def test_splice_crlf_module():
+    cfg = packaging.eval_build_config()
+    module_source = clean_whitespace('''
+    """Doc."""
+    import os
+    class A(object):
+        def f(self, a: int) -> int:
+            return a  # trailing comment
+        def g(self):  # unchanged
+            return list(map(str, [1]))
+    x: int = 1
+    ''')
+    fixed_source = transpile.transpile_module(cfg, module_source)
+    assert "# trailing comment" in fixed_source
+
+    # generated lines use the line breaks of the module
+    crlf_module_source = module_source.replace("\n", "\r\n")
+    assert transpile.transpile_module(cfg, crlf_module_source) == fixed_source.replace("\n", "\r\n")
+
+
+def _strip_end_positions(module_tree):
+    # as parsed by python < 3.8
+    for node in ast.walk(module_tree):
+        for attr in ("end_lineno", "end_col_offset"):
+            if attr in node._attributes:
+                setattr(node, attr, None)
+    return module_tree
+
+
+def test_splice_without_end_positions(monkeypatch):
+    cfg = packaging.eval_build_config()
+    module_source = clean_whitespace('''
+    import os
+    x = (1,
+         2)
+    y = 3; w = 5
+    class A(object):
+        def f(self, a: int) -> int:
+            """Doc
+            string."""
+            if a:
+                return a  # trailing comment
+            else:
+                return (
+                    a + 1
+                )
+        def g(self):  # unchanged
+            return 1
+    z: int = 4
+    ''')
+    expected_source = transpile.transpile_module(cfg, module_source)
+
+    parse_module = transpile.parse_module
+    monkeypatch.setattr(
+        transpile, "parse_module", lambda *args: _strip_end_positions(parse_module(*args))
+    )
+    assert transpile.transpile_module(cfg, module_source) == expected_source
+    assert "# trailing comment" in expected_source
+
+
+def test_end_lineno_without_end_positions():
+    module_source = clean_whitespace('''
+    @decorator(
+        arg)
+    class A:
+        @property
+        def f(self):
+            try: return 1
+            finally: pass
+    # comment at a lower indentation
+            if a: b = 1
+            else: b = 2
+        x = 1; y = (2,
+                    3)
+    while a:
+        break
+    else:
+        pass
+    ''')
+    module_tree = ast.parse(module_source)
+    splicer = splice.Splicer(module_source, [])
+    for node in ast.walk(module_tree):
+        if isinstance(node, ast.stmt):
+            end_lineno = node.end_lineno
+            node.end_lineno = None
+            assert splicer._end_lineno(node) == end_lineno
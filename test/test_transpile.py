@@ -1,4 +1,9 @@
+import io
+
+from lib3to6 import common
+from lib3to6 import codegen
 from lib3to6 import transpile
+from lib3to6 import packaging
 from lib3to6.utils import clean_whitespace
 
 
@@ -26,3 +31,99 @@ def test_parse_header_coding():
     coding, header = transpile.parse_module_header(source_data)
     assert coding == "shift_jis"
     assert header == "# coding: shift_jis\n# 今日は\n"
+
+
+def test_read_module_header(monkeypatch):
+    header_lines = ["#!/usr/bin/env python", "# coding: latin-1"]
+    header_lines += [f"# line {i}" for i in range(20)] + ["", "  "]
+    source = "\r\n".join(header_lines + ["x = 1", "# not header"])
+    expected_header = "\n".join(header_lines) + "\n"
+
+    # headers longer than the scanned prefix
+    for scan_size in [1, 2, 5, 13, 4096]:
+        monkeypatch.setattr(transpile, "HEADER_SCAN_SIZE", scan_size)
+        module_header = transpile.read_module_header(source)
+        assert module_header == ("latin-1", expected_header, len(header_lines))
+        assert transpile.read_module_header(source.encode("latin-1")) == module_header
+
+    module_header = transpile.read_module_header("# only a comment")
+    assert module_header == ("utf-8", "# -*- coding: utf-8 -*-\n# only a comment\n", 1)
+
+    source_data = source.encode("latin-1")
+    module_source, module_header = transpile.decode_module(source_data)
+    assert module_source == source
+    assert module_header.coding == "latin-1"
+
+
+class _CountingFile(io.BytesIO):
+
+    def __init__(self):
+        super().__init__()
+        self.write_count = 0
+
+    def write(self, data):
+        self.write_count += 1
+        return super().write(data)
+
+
+def test_transpile_to_file(monkeypatch):
+    cfg = packaging.eval_build_config()
+    source_lines = [
+        "# coding: shift_jis",
+        "# 今日は",
+        "def f(a: int, *, b: str = '今日') -> int:",
+        "    return a",
+    ]
+    source_lines += [f"x{i} = f({i}, b=u'{i}')" for i in range(100)]
+    source_data = "\n".join(source_lines).encode("shift_jis")
+
+    fh = _CountingFile()
+    transpile.transpile_to_file(cfg, source_data, fh)
+    assert fh.getvalue() == transpile.transpile_module_data(cfg, source_data)
+
+    # generated code is written in chunks
+    monkeypatch.setattr(codegen, "FLUSH_PARTS", 1)
+    fh = _CountingFile()
+    transpile.transpile_to_file(cfg, source_data, fh)
+    assert fh.getvalue() == transpile.transpile_module_data(cfg, source_data)
+    assert fh.write_count > 100
+
+
+def test_transpile_module_targets():
+    cfg = packaging.eval_build_config()
+    source = clean_whitespace('''
+    import typing as typ
+
+    class Point(typ.NamedTuple):
+        x: int
+        y: int
+
+    def f(a, *, b: int = 1) -> str:
+        return f"{a} {b}"
+
+    c = [*range(2), *range(3)]
+    ''')
+    target_versions = ["2.7", "3.4", "3.5", "3.6"]
+    results = transpile.transpile_module_targets(cfg, source, target_versions)
+    assert list(results) == target_versions
+    for tgt_version in target_versions:
+        target_cfg = packaging.eval_build_config(target_version=tgt_version)
+        assert results[tgt_version] == (transpile.transpile_module(target_cfg, source), None)
+
+    fixed_sources = {tgt_version: fixed_source for tgt_version, (fixed_source, _) in results.items()}
+    assert "class Point" not in fixed_sources["3.4"]
+    assert "class Point" in fixed_sources["3.6"]
+    assert fixed_sources["3.6"].endswith(source)
+
+
+def test_transpile_module_targets_errors():
+    cfg = packaging.eval_build_config()
+    # only prohibited for 2.7
+    source = "with open('a', encoding='utf-8') as fh:\n    pass\n"
+    results = transpile.transpile_module_targets(cfg, source, ["2.7", "3.5", "3.6"])
+    fixed_source, error = results["2.7"]
+    assert fixed_source is None
+    assert isinstance(error, common.CheckError)
+    for tgt_version in ["3.5", "3.6"]:
+        target_cfg = packaging.eval_build_config(target_version=tgt_version)
+        assert results[tgt_version] == (transpile.transpile_module(target_cfg, source), None)
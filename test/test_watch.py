@@ -0,0 +1,34 @@
+import os
+
+from lib3to6 import packaging
+from lib3to6 import watch
+
+
+def test_watcher_poll(tmp_path):
+    src_dir = tmp_path / "src"
+    src_dir.mkdir()
+    out_dir = tmp_path / "out"
+    (src_dir / "a.py").write_bytes(b"a: int = 1\n")
+    (src_dir / "b.py").write_bytes(b"b: int = 1\n")
+
+    cfg = packaging.eval_build_config()
+    watcher = watch.Watcher(cfg, [str(src_dir)], str(out_dir))
+
+    result = watcher.poll()
+    assert sorted(result.written) == [str(out_dir / "a.py"), str(out_dir / "b.py")]
+    assert watcher.poll() == ([], [], [])
+
+    # touching a file without changing it doesn't transpile it again
+    stat = os.stat(str(src_dir / "a.py"))
+    os.utime(str(src_dir / "a.py"), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert watcher.poll() == ([], [], [])
+
+    (src_dir / "a.py").write_bytes(b"a: int = 2\n")
+    (src_dir / "b.py").unlink()
+    (src_dir / "c.py").write_bytes(b"def f(*, c=[]):\n    pass\n")
+    written, removed, errors = watcher.poll()
+    assert written == [str(out_dir / "a.py")]
+    assert removed == [str(out_dir / "b.py")]
+    assert [path for path, _ in errors] == [str(src_dir / "c.py")]
+    assert (out_dir / "a.py").read_bytes().endswith(b"\na = 2\n")
+    assert not (out_dir / "b.py").exists()